@@ -45,10 +45,30 @@ def create_app(test_config=None):
     from .routes import user_activity # Added this line
     app.register_blueprint(user_activity.bp) # Added this line
 
+    from . import vote_buffer
+    vote_buffer.init_app(app)
+
+    from . import list_import
+    list_import.init_app(app)
+
     # Route for the new homepage
     @app.route('/')
     def hello(): # Renaming to 'home' would be more descriptive, but keeping 'hello' as per instruction to modify existing
-        from flask import render_template
-        return render_template('home.html')
+        from flask import render_template, g
+        from .db import get_home_feed, get_top_chart, get_trending_anime, get_all_genres, get_user_favorite_genre_ids
+        home_feed, genres, favorite_genre_ids = [], [], []
+        if g.user:
+            home_feed = get_home_feed(g.user.id) # Cached per user, so the logged-in page stays cheap
+            genres = get_all_genres()
+            favorite_genre_ids = get_user_favorite_genre_ids(g.user.id)
+        top_anime, _ = get_top_chart('top', limit=10)
+        return render_template(
+            'home.html',
+            home_feed=home_feed,
+            genres=genres,
+            favorite_genre_ids=favorite_genre_ids,
+            top_anime=top_anime,
+            trending_anime=get_trending_anime(limit=10)
+        )
 
     return app
@@ -1,6 +1,24 @@
+import array
+import base64
+import bisect
+import collections
+import csv
+import heapq
+import json
+import math
+import mmap
+import os
+import random
+import re
 import sqlite3
+import struct
+import sys
+import threading
+import time
+import zlib
 import click
 from flask import current_app, g
+from markupsafe import Markup, escape
 from flask.cli import with_appcontext
 from app.models.user import User # Assuming User model is in app.models.user
 
@@ -22,6 +40,7 @@ def init_db():
     db = get_db()
     with current_app.open_resource('schema.sql') as f:
         db.executescript(f.read().decode('utf8'))
+    invalidate_anime_caches() # Cached catalog data refers to the old tables
 
 @click.command('init-db')
 @with_appcontext
@@ -35,6 +54,30 @@ def init_app(app):
     app.cli.add_command(init_db_command)
     app.config['DATABASE'] = 'instance/flaskr.sqlite' # Added this line, common practice for flask
 
+# Keyset pagination helpers
+def encode_cursor(values):
+    """Encodes the sort-key values of the last row on a page into an opaque, URL-safe cursor."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf8')).decode('ascii')
+
+def decode_cursor(cursor, length=None):
+    """
+    Decodes a cursor made by encode_cursor into its list of values. Returns None for a missing or
+    malformed cursor (bad base64 or JSON, not a list of `length` strings and numbers), so callers
+    fall back to the first page rather than failing on a hand-edited URL.
+    """
+    if not cursor:
+        return None
+    try:
+        # binascii.Error (bad padding) is a ValueError; RecursionError comes from absurdly nested JSON
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf8'))
+    except (ValueError, UnicodeError, RecursionError):
+        return None
+    if not isinstance(values, list) or (length is not None and len(values) != length):
+        return None
+    if not all(isinstance(value, (str, int, float)) and not isinstance(value, bool) for value in values):
+        return None
+    return values
+
 # User specific database functions
 def add_user(username, email, password):
     """Adds a new user to the database."""
@@ -158,11 +201,33 @@ def get_all_tags():
     rows = db.execute("SELECT * FROM Tags ORDER BY name").fetchall()
     return [Tag(**row) for row in rows]
 
+def _intern_taxonomy_names(db, table, names, interned):
+    """
+    Makes sure every name exists in table ('Genres' or 'Tags') and records its id in interned
+    ({name: id}). Names already in interned cost nothing; the rest take one INSERT and one SELECT
+    however many there are. Does not commit.
+    """
+    new_names = {name for name in names if name not in interned}
+    if not new_names:
+        return interned
+    names_json = json.dumps(sorted(new_names))
+    # Filtered rather than INSERT OR IGNORE, which would use up an AUTOINCREMENT id per existing name
+    db.execute(
+        f"""INSERT INTO {table} (name) SELECT value FROM json_each(?)
+            WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE name = value)""",
+        (names_json,)
+    )
+    interned.update(
+        (row['name'], row['id'])
+        for row in db.execute(f"SELECT id, name FROM {table} WHERE name IN (SELECT value FROM json_each(?))", (names_json,))
+    )
+    return interned
+
 # Anime specific database functions
 def add_anime(title, description=None, release_year=None, cover_image_url=None, language=None, genre_names=None, tag_names=None):
     """
-    Adds a new anime to the database and links it to genres and tags.
-    genre_names and tag_names should be lists of strings.
+    Adds a new anime to the database and links it to genres and tags, creating any that don't
+    exist yet, all in one transaction. genre_names and tag_names should be lists of strings.
     """
     db = get_db()
     try:
@@ -173,26 +238,18 @@ def add_anime(title, description=None, release_year=None, cover_image_url=None,
         )
         anime_id = cursor.lastrowid
 
-        if genre_names:
-            for genre_name in genre_names:
-                genre = get_genre_by_name(genre_name)
-                if not genre: # If genre doesn't exist, add it
-                    genre_id = add_genre(genre_name)
-                    if genre_id:
-                        link_anime_to_genre(anime_id, genre_id)
-                else:
-                    link_anime_to_genre(anime_id, genre.id)
-        
-        if tag_names:
-            for tag_name in tag_names:
-                tag = get_tag_by_name(tag_name)
-                if not tag: # If tag doesn't exist, add it
-                    tag_id = add_tag(tag_name)
-                    if tag_id:
-                        link_anime_to_tag(anime_id, tag_id)
-                else:
-                    link_anime_to_tag(anime_id, tag.id)
-        
+        genre_ids = _intern_taxonomy_names(db, 'Genres', genre_names or [], {})
+        tag_ids = _intern_taxonomy_names(db, 'Tags', tag_names or [], {})
+        db.executemany(
+            "INSERT OR IGNORE INTO AnimeGenres (anime_id, genre_id) VALUES (?, ?)",
+            [(anime_id, genre_ids[name]) for name in genre_names or []]
+        )
+        db.executemany(
+            "INSERT OR IGNORE INTO AnimeTags (anime_id, tag_id) VALUES (?, ?)",
+            [(anime_id, tag_ids[name]) for name in tag_names or []]
+        )
+
+        _refresh_similar_anime(db, anime_id) # Once for all links, rather than per link
         db.commit()
         return anime_id
     except sqlite3.Error as e:
@@ -200,129 +257,522 @@ def add_anime(title, description=None, release_year=None, cover_image_url=None,
         print(f"Error adding anime: {e}")
         return None
 
-def link_anime_to_genre(anime_id, genre_id):
+def link_anime_to_genre(anime_id, genre_id, refresh_similar=True):
     db = get_db()
     try:
         db.execute("INSERT INTO AnimeGenres (anime_id, genre_id) VALUES (?, ?)", (anime_id, genre_id))
         # db.commit() # Commit is usually handled by the calling function (e.g., add_anime)
+        # Catalog caches follow CatalogVersion, which a trigger bumps, so they refresh once this commits
+        _refresh_top_chart_entries(db, anime_id) # A rated anime joins the new genre's chart
+        if refresh_similar:
+            _refresh_similar_anime(db, anime_id)
     except sqlite3.IntegrityError: # Handles cases where the link already exists
         pass
     except sqlite3.Error as e:
         print(f"Error linking anime {anime_id} to genre {genre_id}: {e}")
 
-def link_anime_to_tag(anime_id, tag_id):
+def link_anime_to_tag(anime_id, tag_id, refresh_similar=True):
     db = get_db()
     try:
         db.execute("INSERT INTO AnimeTags (anime_id, tag_id) VALUES (?, ?)", (anime_id, tag_id))
         # db.commit() # Commit is usually handled by the calling function (e.g., add_anime)
+        if refresh_similar:
+            _refresh_similar_anime(db, anime_id)
     except sqlite3.IntegrityError: # Handles cases where the link already exists
         pass
     except sqlite3.Error as e:
         print(f"Error linking anime {anime_id} to tag {tag_id}: {e}")
 
 def get_anime_by_id(anime_id):
-    from app.models.anime import Anime
-    from app.models.taxonomy import Genre, Tag
     db = get_db()
     
     anime_row = db.execute("SELECT * FROM Anime WHERE id = ?", (anime_id,)).fetchone()
     if not anime_row:
         return None
 
-    # Fetch genres for the anime
+    # Single-row case of the batched hydration used by list views
+    return _hydrate_anime_rows([anime_row])[0]
+
+
+def _hydrate_anime_rows(rows):
+    """
+    Builds Anime objects (with genres and tags) for a list of Anime rows.
+    Genres and tags for the whole result set are loaded with one query each,
+    so the number of statements does not grow with the number of rows.
+    """
+    from app.models.anime import Anime
+    from app.models.taxonomy import Genre, Tag
+    if not rows:
+        return []
+
+    db = get_db()
+    # Pass the ids as a single JSON array so large result sets stay within SQLite's variable limit
+    anime_ids = json.dumps([row['id'] for row in rows])
+    genres_by_anime = {}
+    tags_by_anime = {}
+
     genre_rows = db.execute(
-        """SELECT g.id, g.name FROM Genres g
-           JOIN AnimeGenres ag ON g.id = ag.genre_id
-           WHERE ag.anime_id = ?""", (anime_id,)
+        """SELECT ag.anime_id, g.id, g.name FROM AnimeGenres ag
+           JOIN Genres g ON g.id = ag.genre_id
+           WHERE ag.anime_id IN (SELECT value FROM json_each(?))""", (anime_ids,)
     ).fetchall()
-    genres = [Genre(**row) for row in genre_rows]
+    for row in genre_rows:
+        genres_by_anime.setdefault(row['anime_id'], []).append(Genre(id=row['id'], name=row['name']))
 
-    # Fetch tags for the anime
     tag_rows = db.execute(
-        """SELECT t.id, t.name FROM Tags t
-           JOIN AnimeTags at ON t.id = at.tag_id
-           WHERE at.anime_id = ?""", (anime_id,)
+        """SELECT at.anime_id, t.id, t.name FROM AnimeTags at
+           JOIN Tags t ON t.id = at.tag_id
+           WHERE at.anime_id IN (SELECT value FROM json_each(?))""", (anime_ids,)
     ).fetchall()
-    tags = [Tag(**row) for row in tag_rows]
-    
-    # Create Anime object with its genres and tags
-    anime_data = dict(anime_row) # Convert sqlite3.Row to dict
-    return Anime(**anime_data, genres=genres, tags=tags)
+    for row in tag_rows:
+        tags_by_anime.setdefault(row['anime_id'], []).append(Tag(id=row['id'], name=row['name']))
+
+    anime_list = []
+    for row in rows:
+        anime_data = dict(row) # Convert sqlite3.Row to dict
+        anime_list.append(Anime(
+            **anime_data,
+            genres=genres_by_anime.get(anime_data['id']),
+            tags=tags_by_anime.get(anime_data['id'])
+        ))
+    return anime_list
 
 
-def get_all_anime(filters=None):
-    from app.models.anime import Anime
-    from app.models.taxonomy import Genre, Tag # Needed for constructing objects if fetching details here
+# In-process catalog caches, keyed by database path. Catalog writes bump CatalogVersion (by trigger,
+# in the writing transaction), and every worker drops its caches when it sees a new committed version.
+_facet_cache = {}       # (database path, normalized filters) -> facet counts
+_FACET_CACHE_MAX_ENTRIES = 256
+_taxonomy_bitsets = {}  # database path -> {'genres': {genre_id: bitset}, 'tags': {tag_id: bitset}}
+_random_pick_pools = {} # (database path, normalized filters) -> dense list of matching anime ids
+_RANDOM_PICK_POOLS_MAX_ENTRIES = 256
+_catalog_cache_versions = {} # database path -> the CatalogVersion the caches were filled at
+
+def invalidate_anime_caches():
+    """Drops this process's cached catalog data, e.g. after the schema is recreated."""
+    _facet_cache.clear()
+    _taxonomy_bitsets.clear()
+    _random_pick_pools.clear()
+    _catalog_cache_versions.clear()
+
+def _catalog_cache_version():
+    """
+    Reads the committed CatalogVersion and drops the catalog caches if it moved since they were
+    filled. Returns the version, or None while this connection has a write transaction open: its
+    uncommitted rows must neither be cached nor be hidden by the cache, so callers skip it then.
+    """
     db = get_db()
-    
-    query = "SELECT DISTINCT a.id, a.title, a.description, a.release_year, a.cover_image_url, a.average_rating, a.language, a.created_at, a.updated_at FROM Anime a"
+    if db.in_transaction:
+        return None
+    cache_key = current_app.config['DATABASE']
+    version = db.execute("SELECT version FROM CatalogVersion WHERE id = 1").fetchone()[0]
+    if _catalog_cache_versions.get(cache_key) != version:
+        invalidate_anime_caches()
+        _catalog_cache_versions[cache_key] = version
+    return version
+
+def _ids_to_bitset(anime_ids):
+    """Returns an int bitset with bit N set for every anime id N."""
+    anime_ids = list(anime_ids)
+    if not anime_ids:
+        return 0
+    # Set bits in a byte buffer first; OR-ing into a big int per id would copy it every time
+    buffer = bytearray(max(anime_ids) // 8 + 1)
+    for anime_id in anime_ids:
+        buffer[anime_id >> 3] |= 1 << (anime_id & 7)
+    return int.from_bytes(buffer, 'little')
+
+def _build_bitsets(rows):
+    """Turns (key_id, anime_id) rows into {key_id: bitset of its anime ids}."""
+    members = {}
+    for key_id, anime_id in rows:
+        members.setdefault(key_id, []).append(anime_id)
+    return {key_id: _ids_to_bitset(anime_ids) for key_id, anime_ids in members.items()}
+
+def _get_taxonomy_bitsets():
+    """
+    Returns the per-genre and per-tag anime id bitsets (Python ints, bit N = anime id N),
+    built from AnimeGenres/AnimeTags on first use and cached until the next catalog write.
+    """
+    cache_key = current_app.config['DATABASE']
+    cacheable = _catalog_cache_version() is not None
+    bitsets = _taxonomy_bitsets.get(cache_key) if cacheable else None
+    if bitsets is None:
+        db = get_db()
+        bitsets = {
+            'genres': _build_bitsets(db.execute("SELECT genre_id, anime_id FROM AnimeGenres").fetchall()),
+            'tags': _build_bitsets(db.execute("SELECT tag_id, anime_id FROM AnimeTags").fetchall()),
+        }
+        if cacheable:
+            _taxonomy_bitsets[cache_key] = bitsets
+    return bitsets
+
+def _bitset_to_ids(bitset):
+    """Returns the anime ids whose bits are set, in ascending order."""
+    anime_ids = []
+    data = bitset.to_bytes((bitset.bit_length() + 7) // 8, 'little')
+    for byte_index, byte in enumerate(data):
+        if byte: # Skip empty bytes; most are empty for selective filters
+            base = byte_index * 8
+            for bit in range(8):
+                if byte >> bit & 1:
+                    anime_ids.append(base + bit)
+    return anime_ids
+
+def _normalize_anime_filters(filters):
+    """
+    Returns the canonical (hashable) form of an anime filter dict. Supported keys:
+      genre_ids / tag_ids: iterables of ids; genre_mode / tag_mode: 'all' (AND, default) or 'any' (OR)
+      year_min / year_max: inclusive release year range; language: exact language
+    The single-value keys genre_id, tag_id and release_year are still accepted.
+    """
+    filters = filters or {}
+    normalized = {}
+    for key, single_key, mode_key in (('genre_ids', 'genre_id', 'genre_mode'), ('tag_ids', 'tag_id', 'tag_mode')):
+        ids = {int(i) for i in (filters.get(key) or []) if i}
+        if filters.get(single_key):
+            ids.add(int(filters[single_key]))
+        if ids:
+            normalized[key] = tuple(sorted(ids))
+            normalized[mode_key] = 'any' if filters.get(mode_key) == 'any' else 'all'
+
+    year_min, year_max = filters.get('year_min'), filters.get('year_max')
+    if filters.get('release_year'):
+        year_min = year_max = filters['release_year']
+    if year_min:
+        normalized['year_min'] = int(year_min)
+    if year_max:
+        normalized['year_max'] = int(year_max)
+    if filters.get('language'):
+        normalized['language'] = filters['language']
+    return normalized
+
+def _combine_bitsets(bitsets, ids, mode):
+    """Intersects ('all') or unions ('any') the bitsets of the given ids."""
+    selected = [bitsets.get(i, 0) for i in ids]
+    combined = selected[0]
+    for bitset in selected[1:]:
+        combined = combined | bitset if mode == 'any' else combined & bitset
+    return combined
+
+def _anime_filter_conditions(filters, exclude=None):
+    """
+    Builds WHERE conditions (against alias `a`) for normalized filters. `exclude` names a
+    filter group ('genres', 'tags', 'years' or 'language') to leave out, as facet counts need.
+    Genre/tag filters are resolved with bitset AND/OR in memory and passed to SQLite as one
+    id list, so any number of them costs no extra joins.
+    """
     conditions = []
     params = []
+    candidates = None
+    if filters.get('genre_ids') or filters.get('tag_ids'):
+        bitsets = _get_taxonomy_bitsets()
+        for group, ids_key, mode_key in (('genres', 'genre_ids', 'genre_mode'), ('tags', 'tag_ids', 'tag_mode')):
+            if filters.get(ids_key) and exclude != group:
+                combined = _combine_bitsets(bitsets[group], filters[ids_key], filters[mode_key])
+                candidates = combined if candidates is None else candidates & combined
+    if candidates is not None:
+        conditions.append("a.id IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(_bitset_to_ids(candidates)))
+
+    if filters.get('year_min') and exclude != 'years':
+        conditions.append("a.release_year >= ?")
+        params.append(filters['year_min'])
+    if filters.get('year_max') and exclude != 'years':
+        conditions.append("a.release_year <= ?")
+        params.append(filters['year_max'])
+    if filters.get('language') and exclude != 'language':
+        conditions.append("a.language = ?")
+        params.append(filters['language'])
+    return conditions, params
+
+
+def get_all_anime(filters=None, limit=None, cursor=None):
+    """
+    Returns anime ordered by (title, id), optionally filtered (see _normalize_anime_filters).
+    With `limit`, returns one page; pass `cursor` (from anime_page_cursor) to continue after
+    the last anime of the previous page. The keyset condition is served by idx_anime_title
+    (which carries the rowid), so deep pages cost the same as the first one.
+    """
+    db = get_db()
+    
+    query = "SELECT a.id, a.title, a.description, a.release_year, a.cover_image_url, a.average_rating, a.language, a.created_at, a.updated_at FROM Anime a"
+    conditions, params = _anime_filter_conditions(_normalize_anime_filters(filters))
 
-    if filters:
-        if filters.get('genre_id'):
-            query += " JOIN AnimeGenres ag ON a.id = ag.anime_id"
-            conditions.append("ag.genre_id = ?")
-            params.append(filters['genre_id'])
-        if filters.get('tag_id'): # Assuming filtering by a single tag ID for now
-            query += " JOIN AnimeTags at ON a.id = at.tag_id"
-            conditions.append("at.tag_id = ?")
-            params.append(filters['tag_id'])
-        if filters.get('release_year'):
-            conditions.append("a.release_year = ?")
-            params.append(filters['release_year'])
-        if filters.get('language'):
-            conditions.append("a.language = ?")
-            params.append(filters['language'])
+    after = decode_cursor(cursor, 2)
+    if after:
+        conditions.append("(a.title, a.id) > (?, ?)")
+        params.extend(after)
 
     if conditions:
         query += " WHERE " + " AND ".join(conditions)
     
-    query += " ORDER BY a.title" # Default ordering
+    query += " ORDER BY a.title, a.id" # Default ordering, id breaks ties between equal titles
+
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
 
     rows = db.execute(query, params).fetchall()
     
-    # For simplicity, this function returns a list of basic Anime objects without genre/tag details.
-    # If full details are needed for each anime in the list, we'd need to loop and call get_anime_by_id
-    # or expand the query to fetch all related data (which can get complex with many-to-many).
-    # For a list view, this is often sufficient, and details are fetched on demand for a single anime view.
-    anime_list = []
-    for row in rows:
-        # To get genres and tags for each anime in the list, we would need N+1 queries or a more complex join.
-        # For now, let's fetch them individually for simplicity in this example, though it's not the most performant for large lists.
-        # A better approach for list views might be to just show genre/tag names as strings from a joined query.
-        anime_obj = get_anime_by_id(row['id']) # This will fetch genres/tags for each anime
-        if anime_obj:
-            anime_list.append(anime_obj)
-            
-    return anime_list
+    # Genres and tags are attached in batch rather than through get_anime_by_id per row
+    return _hydrate_anime_rows(rows)
+
+
+def anime_page_cursor(anime):
+    """Returns the cursor that continues get_all_anime after the given anime."""
+    return encode_cursor([anime.title, anime.id])
 
 
-def get_random_anime():
+def get_anime_facets(filters=None):
+    """
+    Returns the distinct filter values with per-value anime counts:
+    {'years': [{'value', 'count'}], 'languages': [{'value', 'count'}],
+     'genres': [{'id', 'name', 'count'}], 'tags': [{'id', 'name', 'count'}]}
+    Counts respect the applied filters, except that each facet ignores its own
+    filter so the alternatives stay selectable. Results are cached until the next catalog write.
+    """
+    filters = _normalize_anime_filters(filters)
+    cache_key = (current_app.config['DATABASE'], tuple(sorted(filters.items())))
+    cacheable = _catalog_cache_version() is not None
+    if cacheable and cache_key in _facet_cache:
+        return _facet_cache[cache_key]
+
     db = get_db()
-    row = db.execute("SELECT id FROM Anime ORDER BY RANDOM() LIMIT 1").fetchone()
-    if row:
-        return get_anime_by_id(row['id'])
-    return None
 
-def update_anime_average_rating(anime_id):
+    def grouped(select, group_by, order_by, exclude, extra_conditions):
+        conditions, params = _anime_filter_conditions(filters, exclude=exclude)
+        conditions = list(extra_conditions) + conditions
+        query = f"SELECT {select}, COUNT(*) AS count FROM Anime a WHERE " + " AND ".join(conditions)
+        query += f" GROUP BY {group_by} ORDER BY {order_by}"
+        return [dict(row) for row in db.execute(query, params).fetchall()]
+
+    def taxonomy_counts(group, table):
+        # Popcount of each genre/tag bitset, masked by the anime matching the other filters
+        conditions, params = _anime_filter_conditions(filters, exclude=group)
+        mask = None
+        if conditions:
+            rows = db.execute("SELECT a.id FROM Anime a WHERE " + " AND ".join(conditions), params).fetchall()
+            mask = _ids_to_bitset(row[0] for row in rows)
+        bitsets = _get_taxonomy_bitsets()[group]
+        counts = []
+        for row in db.execute(f"SELECT id, name FROM {table} ORDER BY name").fetchall():
+            bitset = bitsets.get(row['id'], 0)
+            count = bin(bitset & mask if mask is not None else bitset).count('1')
+            if count:
+                counts.append({'id': row['id'], 'name': row['name'], 'count': count})
+        return counts
+
+    facets = {
+        'years': grouped("a.release_year AS value", "a.release_year", "a.release_year DESC",
+                         'years', ["a.release_year IS NOT NULL"]),
+        'languages': grouped("a.language AS value", "a.language", "a.language",
+                             'language', ["a.language IS NOT NULL", "a.language != ''"]),
+        'genres': taxonomy_counts('genres', 'Genres'),
+        'tags': taxonomy_counts('tags', 'Tags'),
+    }
+
+    if cacheable:
+        if len(_facet_cache) >= _FACET_CACHE_MAX_ENTRIES:
+            _facet_cache.clear()
+        _facet_cache[cache_key] = facets
+    return facets
+
+
+# Markers passed to FTS5 highlight()/snippet(); replaced with <mark> tags after HTML-escaping the text
+_HIGHLIGHT_START = '\x02'
+_HIGHLIGHT_END = '\x03'
+
+def _fts_match_expression(query):
+    """
+    Turns free text into a safe FTS5 MATCH expression: every word is quoted, so FTS
+    operators and punctuation in user input are treated literally. Words are ANDed.
+    """
+    terms = [term.replace('"', '""') for term in query.split()]
+    if not terms:
+        return None
+    return " ".join(f'"{term}"' for term in terms)
+
+def _highlighted_markup(text):
+    """HTML-escapes FTS5 output and converts the highlight markers into <mark> tags."""
+    if text is None:
+        return None
+    return Markup(str(escape(text)).replace(_HIGHLIGHT_START, '<mark>').replace(_HIGHLIGHT_END, '</mark>'))
+
+def search_anime(query, limit=20, cursor=None):
     """
-    Updates the average_rating for an anime based on scores in the Ratings table.
-    This should be called when a new rating is added or an existing one is updated/deleted.
+    Full-text search over anime titles and descriptions, best bm25 match first.
+    Returns (anime_list, next_cursor). Each Anime carries `title_highlight` and
+    `snippet` (HTML-safe Markup with <mark> around matched terms).
+    Pass next_cursor back in to fetch the following page.
     """
+    match_expression = _fts_match_expression(query or "")
+    if not match_expression:
+        return [], None
+
     db = get_db()
+    sql = f"""SELECT a.*, s.rank AS search_rank,
+                     highlight(AnimeSearch, 0, '{_HIGHLIGHT_START}', '{_HIGHLIGHT_END}') AS title_highlight,
+                     snippet(AnimeSearch, 1, '{_HIGHLIGHT_START}', '{_HIGHLIGHT_END}', '…', 16) AS snippet
+              FROM AnimeSearch s
+              JOIN Anime a ON a.id = s.rowid
+              WHERE AnimeSearch MATCH ?"""
+    params = [match_expression]
+
+    after = decode_cursor(cursor, 2)
+    if after:
+        sql += " AND (s.rank > ? OR (s.rank = ? AND s.rowid > ?))"
+        params.extend([after[0], after[0], after[1]])
+
+    # Fetch one extra row to know whether another page exists
+    sql += " ORDER BY s.rank, s.rowid LIMIT ?"
+    params.append(limit + 1)
+
     try:
-        cursor = db.execute(
-            """SELECT AVG(score) as avg_score FROM Ratings WHERE anime_id = ?""",
+        rows = db.execute(sql, params).fetchall()
+    except sqlite3.OperationalError as e: # e.g. a query made only of punctuation
+        print(f"Error searching anime for '{query}': {e}")
+        return [], None
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    search_columns = ('search_rank', 'title_highlight', 'snippet')
+    anime_list = _hydrate_anime_rows(
+        [{k: row[k] for k in row.keys() if k not in search_columns} for row in rows]
+    )
+    for anime, row in zip(anime_list, rows):
+        anime.search_rank = row['search_rank']
+        anime.title_highlight = _highlighted_markup(row['title_highlight'])
+        anime.snippet = _highlighted_markup(row['snippet'])
+
+    next_cursor = None
+    if has_more and anime_list:
+        next_cursor = encode_cursor([anime_list[-1].search_rank, anime_list[-1].id])
+    return anime_list, next_cursor
+
+
+def get_random_anime_id(filters=None):
+    """
+    Returns a uniformly random anime id matching `filters` (same keys as get_all_anime,
+    e.g. genre_ids/genre_mode and language), or None if nothing matches.
+    Matching ids are collected once into a dense list, cached until the next catalog
+    write, so each pick is a single random.choice instead of ORDER BY RANDOM().
+    """
+    filters = _normalize_anime_filters(filters)
+    cache_key = (current_app.config['DATABASE'], tuple(sorted(filters.items())))
+    cacheable = _catalog_cache_version() is not None
+    pool = _random_pick_pools.get(cache_key) if cacheable else None
+    if pool is None:
+        conditions, params = _anime_filter_conditions(filters)
+        query = "SELECT a.id FROM Anime a"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        pool = [row[0] for row in get_db().execute(query, params).fetchall()]
+        if cacheable:
+            if len(_random_pick_pools) >= _RANDOM_PICK_POOLS_MAX_ENTRIES:
+                _random_pick_pools.clear()
+            _random_pick_pools[cache_key] = pool
+    return random.choice(pool) if pool else None
+
+def get_random_anime(filters=None):
+    anime_id = get_random_anime_id(filters)
+    if anime_id is not None:
+        return get_anime_by_id(anime_id)
+    return None
+
+def _apply_rating_delta(db, anime_id, score_delta, count_delta):
+    """
+    Shifts an anime's running rating_sum/rating_count by the given deltas and refreshes
+    average_rating from them. Does not commit; call it inside the rating write's transaction.
+    """
+    # Right-hand sides see the pre-update column values, so the new average uses the shifted totals
+    db.execute(
+        """UPDATE Anime SET
+               rating_sum = rating_sum + ?,
+               rating_count = rating_count + ?,
+               average_rating = CASE WHEN rating_count + ? > 0
+                                     THEN (rating_sum + ?) * 1.0 / (rating_count + ?)
+                                     ELSE 0.0 END
+           WHERE id = ?""",
+        (score_delta, count_delta, count_delta, score_delta, count_delta, anime_id)
+    )
+    db.execute(
+        "UPDATE RatingTotals SET rating_sum = rating_sum + ?, rating_count = rating_count + ? WHERE id = 1",
+        (score_delta, count_delta)
+    )
+
+RATING_SCORES = range(1, 11)
+_RATING_HISTOGRAM_COLUMNS = ', '.join(f"score_{score}" for score in RATING_SCORES)
+_RATING_HISTOGRAM_SUMS = ', '.join(f"SUM(score = {score})" for score in RATING_SCORES)
+
+def _apply_rating_histogram_move(db, anime_id, old_score, new_score):
+    """
+    Moves one rating in an anime's score histogram from old_score to new_score (old_score None
+    for a new rating). Scores are 1-10 (Ratings' CHECK constraint). Does not commit.
+    """
+    if old_score is None:
+        db.execute(
+            f"""INSERT INTO RatingHistograms (anime_id, score_{int(new_score)}) VALUES (?, 1)
+                ON CONFLICT(anime_id) DO UPDATE SET score_{int(new_score)} = score_{int(new_score)} + 1""",
             (anime_id,)
         )
-        result = cursor.fetchone()
-        avg_score = result['avg_score'] if result['avg_score'] is not None else 0.0
-        
+    elif old_score != new_score:
         db.execute(
-            "UPDATE Anime SET average_rating = ? WHERE id = ?",
-            (avg_score, anime_id)
+            f"""UPDATE RatingHistograms SET score_{int(old_score)} = score_{int(old_score)} - 1,
+                                            score_{int(new_score)} = score_{int(new_score)} + 1
+                WHERE anime_id = ?""",
+            (anime_id,)
         )
+
+def get_rating_histogram(anime_id):
+    """Returns the number of ratings at each score 1-10 for an anime, as a list of ten counts."""
+    db = get_db()
+    row = db.execute(
+        f"SELECT {_RATING_HISTOGRAM_COLUMNS} FROM RatingHistograms WHERE anime_id = ?", (anime_id,)
+    ).fetchone()
+    return list(row) if row else [0] * len(RATING_SCORES)
+
+def _recompute_rating_stats(db, anime_ids=None):
+    """
+    Recomputes rating_sum, rating_count, average_rating and the score histogram from the Ratings
+    table, for the given anime ids or (None) every anime. Returns the number of anime updated.
+    Does not touch RatingTotals or the charts, and does not commit.
+    """
+    if anime_ids is None:
+        anime_filter, ratings_filter, params = "", "", ()
+    else:
+        anime_filter = "WHERE id IN (SELECT value FROM json_each(?))"
+        ratings_filter = "WHERE anime_id IN (SELECT value FROM json_each(?))"
+        params = (json.dumps(list(anime_ids)),)
+    cursor = db.execute(
+        f"""UPDATE Anime SET
+                rating_sum = (SELECT COALESCE(SUM(score), 0) FROM Ratings WHERE anime_id = Anime.id),
+                rating_count = (SELECT COUNT(*) FROM Ratings WHERE anime_id = Anime.id)
+            {anime_filter}""",
+        params
+    )
+    updated = cursor.rowcount
+    db.execute(
+        f"""UPDATE Anime SET average_rating = CASE WHEN rating_count > 0
+                                                  THEN rating_sum * 1.0 / rating_count ELSE 0.0 END
+            {anime_filter}""",
+        params
+    )
+    db.execute(f"DELETE FROM RatingHistograms {ratings_filter}", params)
+    db.execute(
+        f"""INSERT INTO RatingHistograms (anime_id, {_RATING_HISTOGRAM_COLUMNS})
+            SELECT anime_id, {_RATING_HISTOGRAM_SUMS} FROM Ratings {ratings_filter} GROUP BY anime_id""",
+        params
+    )
+    return updated
+
+def update_anime_average_rating(anime_id):
+    """
+    Recomputes rating_sum, rating_count, average_rating and the score histogram for one anime from
+    the Ratings table. Rating writes keep these up to date by delta; this is only needed to repair drift.
+    """
+    db = get_db()
+    try:
+        _recompute_rating_stats(db, [anime_id])
         db.commit()
         return True
     except sqlite3.Error as e:
@@ -330,6 +780,931 @@ def update_anime_average_rating(anime_id):
         db.rollback()
         return False
 
+def rebuild_anime_rating_stats():
+    """
+    Recomputes rating_sum, rating_count, average_rating and the score histogram for every anime in
+    one transaction.
+    Returns the number of anime updated, or None on error.
+    """
+    db = get_db()
+    try:
+        updated = _recompute_rating_stats(db)
+        db.execute(
+            """UPDATE RatingTotals SET
+                   rating_sum = (SELECT COALESCE(SUM(rating_sum), 0) FROM Anime),
+                   rating_count = (SELECT COALESCE(SUM(rating_count), 0) FROM Anime)
+               WHERE id = 1"""
+        )
+        db.commit()
+        return updated
+    except sqlite3.Error as e:
+        print(f"Error rebuilding anime rating stats: {e}")
+        db.rollback()
+        return None
+
+@click.command('rebuild-rating-stats')
+@with_appcontext
+def rebuild_rating_stats_command():
+    """Recompute every anime's rating sum, count, average and score histogram from the Ratings table."""
+    updated = rebuild_anime_rating_stats()
+    if updated is None:
+        raise click.ClickException("Rebuilding rating stats failed.")
+    click.echo(f"Rebuilt rating stats for {updated} anime.")
+    # Chart scores are derived from the stats, so re-rank against the rebuilt totals
+    if rebuild_top_charts() is None:
+        raise click.ClickException("Rebuilding top charts failed.")
+    click.echo("Rebuilt top charts.")
+
+# Top charts
+TOP_CHART_KINDS = ('top', 'year', 'genre')
+TOP_CHART_PRIOR_WEIGHT = 25 # m: ratings a title needs before its own mean outweighs the catalog mean
+
+def _catalog_mean_score(db):
+    """Returns C, the mean of every rating in the catalog (0.0 when there are none)."""
+    totals = db.execute("SELECT rating_sum, rating_count FROM RatingTotals WHERE id = 1").fetchone()
+    if not totals or not totals['rating_count']:
+        return 0.0
+    return totals['rating_sum'] / totals['rating_count']
+
+def _refresh_top_chart_entries(db, anime_id):
+    """
+    Re-scores one anime in every chart it belongs to (overall, its release year, each of its genres).
+    Unrated anime are left out of the charts. Does not commit; call it inside the write's transaction.
+    Every entry is scored against the same C, RatingTotals.chart_mean, so entries stay comparable.
+    The live catalog mean drifts from it as ratings arrive; re-scoring every entry is left to
+    `flask rebuild-top-charts` (run it from cron), never done inside a rating write.
+    """
+    chart_mean = db.execute("SELECT chart_mean FROM RatingTotals WHERE id = 1").fetchone()['chart_mean']
+    if chart_mean is None: # First rating in the catalog: nothing has been scored yet
+        chart_mean = _catalog_mean_score(db)
+        db.execute("UPDATE RatingTotals SET chart_mean = ? WHERE id = 1", (chart_mean,))
+
+    db.execute("DELETE FROM TopChartEntries WHERE anime_id = ?", (anime_id,))
+    anime = db.execute(
+        "SELECT rating_sum, rating_count, release_year FROM Anime WHERE id = ?", (anime_id,)
+    ).fetchone()
+    if not anime or not anime['rating_count']:
+        return
+
+    prior = TOP_CHART_PRIOR_WEIGHT
+    score = (anime['rating_sum'] + prior * chart_mean) / (anime['rating_count'] + prior)
+    entries = [('top', 0, anime_id, score)]
+    if anime['release_year']:
+        entries.append(('year', anime['release_year'], anime_id, score))
+    genre_rows = db.execute("SELECT genre_id FROM AnimeGenres WHERE anime_id = ?", (anime_id,)).fetchall()
+    entries.extend(('genre', row['genre_id'], anime_id, score) for row in genre_rows)
+    db.executemany(
+        "INSERT INTO TopChartEntries (chart, chart_key, anime_id, score) VALUES (?, ?, ?, ?)", entries
+    )
+
+def _rebuild_top_charts(db):
+    """
+    Recomputes every chart entry against the current catalog mean and records it as
+    RatingTotals.chart_mean. Returns the number of entries written. Does not commit.
+    """
+    catalog_mean = _catalog_mean_score(db)
+    prior = TOP_CHART_PRIOR_WEIGHT
+    score = "(a.rating_sum + ?) * 1.0 / (a.rating_count + ?)"
+    db.execute("DELETE FROM TopChartEntries")
+    written = 0
+    for chart_sql in (
+        f"SELECT 'top', 0, a.id, {score} FROM Anime a WHERE a.rating_count > 0",
+        f"""SELECT 'year', a.release_year, a.id, {score} FROM Anime a
+            WHERE a.rating_count > 0 AND a.release_year IS NOT NULL""",
+        f"""SELECT 'genre', ag.genre_id, a.id, {score} FROM Anime a
+            JOIN AnimeGenres ag ON ag.anime_id = a.id WHERE a.rating_count > 0""",
+    ):
+        cursor = db.execute(
+            "INSERT INTO TopChartEntries (chart, chart_key, anime_id, score) " + chart_sql,
+            (prior * catalog_mean, prior)
+        )
+        written += cursor.rowcount
+    db.execute("UPDATE RatingTotals SET chart_mean = ? WHERE id = 1", (catalog_mean,))
+    return written
+
+def rebuild_top_charts():
+    """
+    Recomputes every chart entry against the current catalog mean in one transaction.
+    Returns the number of entries written, or None on error.
+    """
+    db = get_db()
+    try:
+        written = _rebuild_top_charts(db)
+        db.commit()
+        return written
+    except sqlite3.Error as e:
+        print(f"Error rebuilding top charts: {e}")
+        db.rollback()
+        return None
+
+@click.command('rebuild-top-charts')
+@with_appcontext
+def rebuild_top_charts_command():
+    """Re-score every top chart entry against the current catalog mean rating (run periodically)."""
+    written = rebuild_top_charts()
+    if written is None:
+        raise click.ClickException("Rebuilding top charts failed.")
+    click.echo(f"Wrote {written} top chart entries.")
+
+def get_top_chart(kind, key=None, limit=20, cursor=None):
+    """
+    Returns one page of a top chart as (anime_list, next_cursor), best first.
+    kind is 'top' (key ignored), 'year' (key = release year) or 'genre' (key = genre id).
+    Each anime gets .chart_score and .chart_rank. Pages are read straight off
+    idx_topchartentries_rank using a keyset cursor, so no sorting happens per request.
+    """
+    if kind not in TOP_CHART_KINDS:
+        return [], None
+    chart_key = 0 if kind == 'top' else key
+    db = get_db()
+
+    sql = """SELECT a.*, c.score AS chart_score FROM TopChartEntries c
+             JOIN Anime a ON a.id = c.anime_id
+             WHERE c.chart = ? AND c.chart_key = ?"""
+    params = [kind, chart_key]
+    rank = 0
+    cursor_values = decode_cursor(cursor, 3)
+    if cursor_values and isinstance(cursor_values[2], int):
+        last_score, last_id, rank = cursor_values
+        sql += " AND (c.score < ? OR (c.score = ? AND c.anime_id > ?))"
+        params.extend([last_score, last_score, last_id])
+    sql += " ORDER BY c.score DESC, c.anime_id LIMIT ?"
+    params.append(limit + 1)
+
+    rows = db.execute(sql, params).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    anime_list = _hydrate_anime_rows([{k: row[k] for k in row.keys() if k != 'chart_score'} for row in rows])
+    for position, (anime, row) in enumerate(zip(anime_list, rows), start=rank + 1):
+        anime.chart_score = row['chart_score']
+        anime.chart_rank = position
+
+    next_cursor = None
+    if has_more and anime_list:
+        last = anime_list[-1]
+        next_cursor = encode_cursor([last.chart_score, last.id, last.chart_rank])
+    return anime_list, next_cursor
+
+
+# Trending
+TRENDING_EVENT_WEIGHTS = {'rating': 1.0, 'review': 3.0, 'watchlist': 2.0}
+TRENDING_WINDOW_HOURS = 7 * 24
+TRENDING_HALF_LIFE_HOURS = 48 # An event's weight halves every two days
+TRENDING_TOP_K = 50
+TRENDING_CACHE_SECONDS = 300
+_trending_cache = {} # database path -> (computed_at, [(anime_id, trending_score), ...] best first)
+
+def _record_anime_activity(db, anime_id, event):
+    """
+    Adds one event's weight to the anime's counter for the current hour.
+    Does not commit; call it inside the write's transaction.
+    """
+    db.execute(
+        """INSERT INTO AnimeActivityBuckets (anime_id, bucket, score) VALUES (?, ?, ?)
+           ON CONFLICT (anime_id, bucket) DO UPDATE SET score = score + excluded.score""",
+        (anime_id, int(time.time() // 3600), TRENDING_EVENT_WEIGHTS[event])
+    )
+
+def refresh_trending_anime():
+    """
+    Recomputes the cached trending top-K from the last TRENDING_WINDOW_HOURS of activity
+    buckets, each weighted by 0.5 ** (age in hours / TRENDING_HALF_LIFE_HOURS).
+    Read-only, so it's safe on GET requests; older buckets are left for prune_trending_activity.
+    Returns the new [(anime_id, trending_score)] list.
+    """
+    db = get_db()
+    current_bucket = int(time.time() // 3600)
+    oldest_bucket = current_bucket - TRENDING_WINDOW_HOURS + 1
+    decay = [0.5 ** (age / TRENDING_HALF_LIFE_HOURS) for age in range(TRENDING_WINDOW_HOURS)]
+
+    scores = {}
+    for anime_id, bucket, score in db.execute(
+        "SELECT anime_id, bucket, score FROM AnimeActivityBuckets WHERE bucket >= ?", (oldest_bucket,)
+    ):
+        # Clamp in case a bucket was written by a process whose clock runs ahead
+        weight = decay[min(max(current_bucket - bucket, 0), TRENDING_WINDOW_HOURS - 1)]
+        scores[anime_id] = scores.get(anime_id, 0.0) + score * weight
+    top = heapq.nlargest(TRENDING_TOP_K, scores.items(), key=lambda item: (item[1], -item[0]))
+    _trending_cache[current_app.config['DATABASE']] = (time.time(), top)
+    return top
+
+def prune_trending_activity():
+    """
+    Deletes activity buckets that have left the trending window. Reads skip them anyway, so this
+    only bounds the table's size; run it from cron via `flask prune-trending-activity`.
+    Returns the number of buckets deleted, or None on error.
+    """
+    db = get_db()
+    oldest_bucket = int(time.time() // 3600) - TRENDING_WINDOW_HOURS + 1
+    try:
+        cursor = db.execute("DELETE FROM AnimeActivityBuckets WHERE bucket < ?", (oldest_bucket,))
+        db.commit()
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        db.rollback()
+        print(f"Error pruning activity buckets: {e}")
+        return None
+
+@click.command('prune-trending-activity')
+@with_appcontext
+def prune_trending_activity_command():
+    """Delete trending activity buckets older than the trending window."""
+    pruned = prune_trending_activity()
+    if pruned is None:
+        raise click.ClickException("Pruning trending activity failed.")
+    click.echo(f"Pruned {pruned} activity bucket(s).")
+
+def get_trending_anime(limit=10):
+    """
+    Returns up to `limit` (at most TRENDING_TOP_K) trending anime, best first, each with
+    .trending_score. Served from the cached top-K, recomputed every TRENDING_CACHE_SECONDS.
+    """
+    cached = _trending_cache.get(current_app.config['DATABASE'])
+    if cached and time.time() - cached[0] < TRENDING_CACHE_SECONDS:
+        top = cached[1]
+    else:
+        top = refresh_trending_anime()
+    top = top[:limit]
+    if not top:
+        return []
+
+    rows = get_db().execute(
+        "SELECT * FROM Anime WHERE id IN (SELECT value FROM json_each(?))",
+        (json.dumps([anime_id for anime_id, _ in top]),)
+    ).fetchall()
+    rows_by_id = {row['id']: row for row in rows}
+    ordered = [rows_by_id[anime_id] for anime_id, _ in top if anime_id in rows_by_id]
+    anime_list = _hydrate_anime_rows(ordered)
+    trending_scores = dict(top)
+    for anime in anime_list:
+        anime.trending_score = trending_scores[anime.id]
+    return anime_list
+
+# Item-item recommendations
+RECOMMENDER_NEIGHBORS = 50 # K: neighbours kept per anime
+RECOMMENDER_SHRINKAGE = 10 # similarity *= co-raters / (co-raters + shrinkage), damping pairs few users share
+RECOMMENDER_MAX_USER_RATINGS = 1000 # Heavier users are skipped when pairing; they add cost quadratically, little signal
+
+def _load_rating_matrix(db):
+    """
+    Loads Ratings as a sparse user x anime matrix of mean-centered scores, in both orientations:
+    user_rows {user_id: [(anime_id, value), ...]} and anime_columns {anime_id: [(user_id, value), ...]}.
+    Also returns each anime's column norm.
+    """
+    user_rows = {}
+    for user_id, anime_id, score in db.execute("SELECT user_id, anime_id, score FROM Ratings"):
+        user_rows.setdefault(user_id, []).append((anime_id, score))
+
+    anime_columns = {}
+    norms = {}
+    for user_id, ratings in user_rows.items():
+        mean = sum(score for _, score in ratings) / len(ratings)
+        centered = [(anime_id, score - mean) for anime_id, score in ratings]
+        user_rows[user_id] = centered
+        for anime_id, value in centered:
+            anime_columns.setdefault(anime_id, []).append((user_id, value))
+            norms[anime_id] = norms.get(anime_id, 0.0) + value * value
+    return user_rows, anime_columns, {anime_id: norm ** 0.5 for anime_id, norm in norms.items()}
+
+def _similarity_row(anime_id, user_rows, anime_columns, norms):
+    """Returns {other_anime_id: similarity} for every anime sharing a rater with anime_id."""
+    dots = {}
+    common = {}
+    for user_id, value in anime_columns.get(anime_id, ()):
+        row = user_rows[user_id]
+        if len(row) > RECOMMENDER_MAX_USER_RATINGS:
+            continue
+        for other_id, other_value in row:
+            dots[other_id] = dots.get(other_id, 0.0) + value * other_value
+            common[other_id] = common.get(other_id, 0) + 1
+    dots.pop(anime_id, None)
+
+    norm = norms.get(anime_id)
+    similarities = {}
+    for other_id, dot in dots.items():
+        if dot <= 0 or not norm or not norms[other_id]:
+            continue
+        shrink = common[other_id] / (common[other_id] + RECOMMENDER_SHRINKAGE)
+        similarities[other_id] = dot / (norm * norms[other_id]) * shrink
+    return similarities
+
+def _top_neighbors(similarities):
+    return heapq.nlargest(RECOMMENDER_NEIGHBORS, similarities.items(), key=lambda item: (item[1], -item[0]))
+
+def build_anime_neighbors(incremental=False):
+    """
+    Computes item-item neighbours from Ratings and stores the top RECOMMENDER_NEIGHBORS per anime.
+    A full build replaces the whole table. An incremental build recomputes only the anime rated by
+    users who rated something since the last build (their mean-centered vectors changed), updating
+    the reverse entries in other anime's lists to match. Returns the number of anime refreshed, or None on error.
+    """
+    db = get_db()
+    try:
+        started_at = db.execute("SELECT CURRENT_TIMESTAMP").fetchone()[0]
+        last_built_at = db.execute("SELECT last_built_at FROM RecommenderState WHERE id = 1").fetchone()[0]
+        user_rows, anime_columns, norms = _load_rating_matrix(db)
+
+        if incremental and last_built_at:
+            changed = db.execute(
+                """SELECT DISTINCT anime_id FROM Ratings WHERE user_id IN
+                       (SELECT DISTINCT user_id FROM Ratings WHERE created_at >= ?)""",
+                (last_built_at,)
+            ).fetchall()
+            anime_ids = [row[0] for row in changed]
+            for anime_id in anime_ids:
+                similarities = _similarity_row(anime_id, user_rows, anime_columns, norms)
+                db.execute("DELETE FROM AnimeNeighbors WHERE anime_id = ?", (anime_id,))
+                db.executemany(
+                    "INSERT INTO AnimeNeighbors (anime_id, neighbor_id, similarity) VALUES (?, ?, ?)",
+                    [(anime_id, other_id, similarity) for other_id, similarity in _top_neighbors(similarities)]
+                )
+                # Similarity is symmetric: refresh this anime's entry in lists that hold it or should now
+                holders = {row[0] for row in db.execute(
+                    "SELECT anime_id FROM AnimeNeighbors WHERE neighbor_id = ?", (anime_id,)
+                )}
+                db.execute("DELETE FROM AnimeNeighbors WHERE neighbor_id = ?", (anime_id,))
+                for other_id in holders | {other_id for other_id, _ in _top_neighbors(similarities)}:
+                    if other_id in similarities:
+                        db.execute(
+                            "INSERT INTO AnimeNeighbors (anime_id, neighbor_id, similarity) VALUES (?, ?, ?)",
+                            (other_id, anime_id, similarities[other_id])
+                        )
+                        db.execute(
+                            """DELETE FROM AnimeNeighbors WHERE anime_id = ? AND neighbor_id NOT IN
+                                   (SELECT neighbor_id FROM AnimeNeighbors WHERE anime_id = ?
+                                    ORDER BY similarity DESC LIMIT ?)""",
+                            (other_id, other_id, RECOMMENDER_NEIGHBORS)
+                        )
+        else:
+            anime_ids = list(anime_columns)
+            db.execute("DELETE FROM AnimeNeighbors")
+            for anime_id in anime_ids:
+                similarities = _similarity_row(anime_id, user_rows, anime_columns, norms)
+                db.executemany(
+                    "INSERT INTO AnimeNeighbors (anime_id, neighbor_id, similarity) VALUES (?, ?, ?)",
+                    [(anime_id, other_id, similarity) for other_id, similarity in _top_neighbors(similarities)]
+                )
+
+        db.execute("UPDATE RecommenderState SET last_built_at = ? WHERE id = 1", (started_at,))
+        db.commit()
+        return len(anime_ids)
+    except sqlite3.Error as e:
+        print(f"Error building anime neighbours: {e}")
+        db.rollback()
+        return None
+
+@click.command('build-recommendations')
+@click.option('--incremental', is_flag=True, help='Only refresh anime affected by ratings since the last build.')
+@with_appcontext
+def build_recommendations_command(incremental):
+    """Compute item-item anime neighbours from the Ratings table."""
+    started = time.time()
+    refreshed = build_anime_neighbors(incremental=incremental)
+    if refreshed is None:
+        raise click.ClickException("Building recommendations failed.")
+    click.echo(f"Refreshed neighbours for {refreshed} anime in {time.time() - started:.1f}s.")
+
+def get_recommendations_for_user(user_id, limit=10):
+    """
+    Returns up to `limit` anime recommended for the user, best first, each with .recommendation_score.
+    Each rated anime votes for its stored neighbours with similarity * (score - 5.5), so liked titles
+    pull their neighbours in and disliked ones push them away. Anime the user has rated or
+    put on their watchlist are left out.
+    """
+    db = get_db()
+    rows = db.execute(
+        """SELECT n.neighbor_id AS anime_id, SUM(n.similarity * (r.score - 5.5)) AS recommendation_score
+           FROM Ratings r
+           JOIN AnimeNeighbors n ON n.anime_id = r.anime_id
+           WHERE r.user_id = ?
+             AND n.neighbor_id NOT IN (SELECT anime_id FROM Ratings WHERE user_id = ?)
+             AND n.neighbor_id NOT IN (SELECT anime_id FROM WatchlistItems WHERE user_id = ?)
+           GROUP BY n.neighbor_id
+           HAVING recommendation_score > 0
+           ORDER BY recommendation_score DESC, n.neighbor_id
+           LIMIT ?""",
+        (user_id, user_id, user_id, limit)
+    ).fetchall()
+    if not rows:
+        return []
+
+    anime_rows = db.execute(
+        "SELECT * FROM Anime WHERE id IN (SELECT value FROM json_each(?))",
+        (json.dumps([row['anime_id'] for row in rows]),)
+    ).fetchall()
+    anime_rows_by_id = {row['id']: row for row in anime_rows}
+    anime_list = _hydrate_anime_rows([anime_rows_by_id[row['anime_id']] for row in rows
+                                      if row['anime_id'] in anime_rows_by_id])
+    scores = {row['anime_id']: row['recommendation_score'] for row in rows}
+    for anime in anime_list:
+        anime.recommendation_score = scores[anime.id]
+    return anime_list
+
+# Personalized home feed
+HOME_FEED_SIZE = 20
+HOME_FEED_GENRES = 8 # Highest-affinity genres whose charts supply candidates
+HOME_FEED_CANDIDATES_PER_CHART = 50 # Read off idx_topchartentries_rank per genre chart, and from the overall chart
+HOME_FEED_RECENT_WATCHLIST = 20 # Latest watchlist changes whose genres count as current interests
+HOME_FEED_WATCHLIST_WEIGHT = 0.5 # Affinity a genre gains from the newest watchlist change; a favourite genre gets 1.0
+HOME_FEED_CACHE_SECONDS = 300
+_home_feed_cache = {} # (database path, user_id) -> (computed_at, [Anime, ...] best first)
+
+def get_user_favorite_genre_ids(user_id):
+    rows = get_db().execute("SELECT genre_id FROM UserFavoriteGenres WHERE user_id = ?", (user_id,)).fetchall()
+    return [row['genre_id'] for row in rows]
+
+def set_user_favorite_genres(user_id, genre_ids):
+    """Replaces the user's favourite genres. Returns True on success, False on error."""
+    db = get_db()
+    try:
+        db.execute("DELETE FROM UserFavoriteGenres WHERE user_id = ?", (user_id,))
+        db.executemany(
+            "INSERT OR IGNORE INTO UserFavoriteGenres (user_id, genre_id) VALUES (?, ?)",
+            [(user_id, genre_id) for genre_id in genre_ids]
+        )
+        db.commit()
+        invalidate_home_feed(user_id)
+        return True
+    except sqlite3.Error as e:
+        db.rollback()
+        print(f"Error setting favorite genres: {e}")
+        return False
+
+def invalidate_home_feed(user_id):
+    """Drops the user's cached home feed; call after their ratings, watchlist or favourite genres change."""
+    _home_feed_cache.pop((current_app.config['DATABASE'], user_id), None)
+
+def _home_feed_genre_affinity(db, user_id):
+    """
+    Returns {genre_id: affinity}: 1.0 per favourite genre, plus HOME_FEED_WATCHLIST_WEIGHT for each
+    genre of the latest watchlist changes, halving every five changes back. Dropped titles don't count.
+    """
+    affinity = {genre_id: 1.0 for genre_id in get_user_favorite_genre_ids(user_id)}
+    recent = db.execute(
+        """SELECT anime_id, status FROM WatchlistItems WHERE user_id = ?
+           ORDER BY added_at DESC, id DESC LIMIT ?""",
+        (user_id, HOME_FEED_RECENT_WATCHLIST)
+    ).fetchall()
+    weights = {row['anime_id']: HOME_FEED_WATCHLIST_WEIGHT * 0.5 ** (position / 5)
+               for position, row in enumerate(recent) if row['status'] != 'dropped'}
+    if weights:
+        for anime_id, genre_id in db.execute(
+            "SELECT anime_id, genre_id FROM AnimeGenres WHERE anime_id IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(weights)),)
+        ):
+            affinity[genre_id] = affinity.get(genre_id, 0.0) + weights[anime_id]
+    return affinity
+
+def get_home_feed(user_id, limit=HOME_FEED_SIZE):
+    """
+    Returns up to `limit` (at most HOME_FEED_SIZE) anime for the user's home page, best first, each
+    with .feed_score. Candidates are the heads of the overall chart and of the charts for the user's
+    highest-affinity genres (see _home_feed_genre_affinity); each scores its chart score times
+    (1 + the affinity of every such genre chart it appears in). Anime the user has rated or put on
+    their watchlist are left out. Cached per user for HOME_FEED_CACHE_SECONDS or until
+    invalidate_home_feed.
+    """
+    cache_key = (current_app.config['DATABASE'], user_id)
+    cached = _home_feed_cache.get(cache_key)
+    if cached and time.time() - cached[0] < HOME_FEED_CACHE_SECONDS:
+        return cached[1][:limit]
+
+    db = get_db()
+    affinity = _home_feed_genre_affinity(db, user_id)
+    chart_sql = """SELECT anime_id, score FROM TopChartEntries WHERE chart = ? AND chart_key = ?
+                   ORDER BY score DESC, anime_id LIMIT ?"""
+    chart_scores = {}
+    boosts = collections.Counter()
+    for row in db.execute(chart_sql, ('top', 0, HOME_FEED_CANDIDATES_PER_CHART)):
+        chart_scores[row['anime_id']] = row['score']
+    for genre_id, genre_affinity in heapq.nlargest(HOME_FEED_GENRES, affinity.items(), key=lambda item: item[1]):
+        for row in db.execute(chart_sql, ('genre', genre_id, HOME_FEED_CANDIDATES_PER_CHART)):
+            chart_scores[row['anime_id']] = row['score']
+            boosts[row['anime_id']] += genre_affinity
+
+    seen = {row['anime_id'] for row in db.execute(
+        "SELECT anime_id FROM Ratings WHERE user_id = ? UNION SELECT anime_id FROM WatchlistItems WHERE user_id = ?",
+        (user_id, user_id)
+    )}
+    feed_scores = {anime_id: score * (1 + boosts[anime_id])
+                   for anime_id, score in chart_scores.items() if anime_id not in seen}
+    top = heapq.nlargest(HOME_FEED_SIZE, feed_scores.items(), key=lambda item: (item[1], -item[0]))
+
+    anime_list = []
+    if top:
+        rows = db.execute(
+            "SELECT * FROM Anime WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps([anime_id for anime_id, _ in top]),)
+        ).fetchall()
+        rows_by_id = {row['id']: row for row in rows}
+        anime_list = _hydrate_anime_rows([rows_by_id[anime_id] for anime_id, _ in top if anime_id in rows_by_id])
+        for anime in anime_list:
+            anime.feed_score = feed_scores[anime.id]
+    _home_feed_cache[cache_key] = (time.time(), anime_list)
+    return anime_list[:limit]
+
+# Similar anime (MinHash LSH over genres and tags)
+MINHASH_BANDS = 16
+MINHASH_ROWS_PER_BAND = 2 # 32 hash functions; pairs above ~0.3 Jaccard share a bucket with >75% probability
+MINHASH_PRIME = (1 << 61) - 1
+_minhash_rng = random.Random(20240601) # Fixed seed: signatures must match across processes and runs
+MINHASH_COEFFICIENTS = [(_minhash_rng.randrange(1, MINHASH_PRIME), _minhash_rng.randrange(MINHASH_PRIME))
+                        for _ in range(MINHASH_BANDS * MINHASH_ROWS_PER_BAND)]
+SIMILAR_ANIME_STORED = 20 # Neighbours kept per anime
+SIMILAR_ANIME_BUCKET_CAP = 50 # Candidates read per band bucket; common genre combos make some buckets huge
+SIMILAR_ANIME_SCORED = 3 * SIMILAR_ANIME_STORED # Candidates sharing the most bands get an exact Jaccard
+
+def _anime_feature_sets(db, anime_ids):
+    """Returns {anime_id: set of 'g<genre_id>'/'t<tag_id>' features} for the given anime."""
+    ids_param = json.dumps(list(anime_ids))
+    features = {}
+    for anime_id, feature in db.execute(
+        """SELECT anime_id, 'g' || genre_id FROM AnimeGenres WHERE anime_id IN (SELECT value FROM json_each(?))
+           UNION ALL
+           SELECT anime_id, 't' || tag_id FROM AnimeTags WHERE anime_id IN (SELECT value FROM json_each(?))""",
+        (ids_param, ids_param)
+    ):
+        features.setdefault(anime_id, set()).add(feature)
+    return features
+
+def _lsh_buckets(features):
+    """Returns the (band, bucket) pairs of a feature set's MinHash signature."""
+    hashed = [zlib.crc32(feature.encode('utf8')) for feature in features]
+    signature = [min((a * h + b) % MINHASH_PRIME for h in hashed) for a, b in MINHASH_COEFFICIENTS]
+    buckets = []
+    for band in range(MINHASH_BANDS):
+        rows = signature[band * MINHASH_ROWS_PER_BAND:(band + 1) * MINHASH_ROWS_PER_BAND]
+        buckets.append((band, zlib.crc32(json.dumps(rows).encode('ascii'))))
+    return buckets
+
+def _jaccard(first, second):
+    shared = len(first & second)
+    return shared / (len(first) + len(second) - shared)
+
+def _similar_anime_scores(db, anime_id, features, extra_ids=()):
+    """
+    Returns {other_id: Jaccard similarity} for the anime sharing the most LSH bands with anime_id
+    (plus extra_ids), keeping only similarities above zero. Reads anime_id's buckets from the table.
+    """
+    shared_bands = collections.Counter()
+    for band, bucket in _lsh_buckets(features):
+        shared_bands.update(row[0] for row in db.execute(
+            """SELECT anime_id FROM AnimeLshBuckets WHERE band = ? AND bucket = ? AND anime_id != ?
+               ORDER BY anime_id DESC LIMIT ?""",
+            (band, bucket, anime_id, SIMILAR_ANIME_BUCKET_CAP)
+        ))
+    candidates = {other_id for other_id, _ in shared_bands.most_common(SIMILAR_ANIME_SCORED)} | set(extra_ids)
+    candidates.discard(anime_id)
+    similarities = {}
+    for other_id, other_features in _anime_feature_sets(db, candidates).items():
+        similarity = _jaccard(features, other_features)
+        if similarity > 0:
+            similarities[other_id] = similarity
+    return similarities
+
+def _refresh_similar_anime(db, anime_id):
+    """
+    Recomputes one anime's LSH buckets and similar-anime list after its genres/tags change, and
+    updates its entry in its neighbours' lists and in the lists it already appeared in.
+    Candidates come from shared LSH buckets and are scored by exact Jaccard. A list this anime
+    drops out of, or falls to the bottom of, is recomputed from that anime's own buckets so a
+    better neighbour can take the place; that costs one bucket scan per such list. Does not commit.
+    """
+    features = _anime_feature_sets(db, [anime_id]).get(anime_id, set())
+    db.execute("DELETE FROM AnimeLshBuckets WHERE anime_id = ?", (anime_id,))
+    db.execute("DELETE FROM SimilarAnime WHERE anime_id = ?", (anime_id,))
+    holders = dict(db.execute("SELECT anime_id, similarity FROM SimilarAnime WHERE similar_id = ?", (anime_id,)))
+    db.execute("DELETE FROM SimilarAnime WHERE similar_id = ?", (anime_id,))
+
+    similarities = {}
+    if features:
+        db.executemany(
+            "INSERT INTO AnimeLshBuckets (band, bucket, anime_id) VALUES (?, ?, ?)",
+            [(band, bucket, anime_id) for band, bucket in _lsh_buckets(features)]
+        )
+        similarities = _similar_anime_scores(db, anime_id, features, holders)
+
+    top = heapq.nlargest(SIMILAR_ANIME_STORED, similarities.items(), key=lambda item: (item[1], -item[0]))
+    db.executemany(
+        "INSERT INTO SimilarAnime (anime_id, similar_id, similarity) VALUES (?, ?, ?)",
+        [(anime_id, other_id, similarity) for other_id, similarity in top]
+    )
+    # Jaccard is symmetric, so offer this anime back to its own neighbours and to the lists it was
+    # already in, keeping each list's best
+    offers = {other_id for other_id, _ in top} | {other_id for other_id in holders if other_id in similarities}
+    for other_id in offers:
+        similarity = similarities[other_id]
+        db.execute(
+            "INSERT INTO SimilarAnime (anime_id, similar_id, similarity) VALUES (?, ?, ?)",
+            (other_id, anime_id, similarity)
+        )
+        db.execute(
+            """DELETE FROM SimilarAnime WHERE anime_id = ? AND similar_id NOT IN
+                   (SELECT similar_id FROM SimilarAnime WHERE anime_id = ?
+                    ORDER BY similarity DESC, similar_id LIMIT ?)""",
+            (other_id, other_id, SIMILAR_ANIME_STORED)
+        )
+
+    # A holder whose entry got weaker may now rank an anime outside its list above this one:
+    # refill the lists this anime left, or now sits last in
+    refills = []
+    for holder_id, old_similarity in holders.items():
+        if similarities.get(holder_id, 0) >= old_similarity:
+            continue
+        last = db.execute(
+            "SELECT similar_id FROM SimilarAnime WHERE anime_id = ? ORDER BY similarity, similar_id DESC LIMIT 1",
+            (holder_id,)
+        ).fetchone()
+        if holder_id not in similarities or (last and last[0] == anime_id):
+            refills.append(holder_id)
+    holder_features = _anime_feature_sets(db, refills)
+    for holder_id in refills:
+        scores = _similar_anime_scores(db, holder_id, holder_features.get(holder_id, set()))
+        db.execute("DELETE FROM SimilarAnime WHERE anime_id = ?", (holder_id,))
+        db.executemany(
+            "INSERT INTO SimilarAnime (anime_id, similar_id, similarity) VALUES (?, ?, ?)",
+            [(holder_id, other_id, similarity) for other_id, similarity in
+             heapq.nlargest(SIMILAR_ANIME_STORED, scores.items(), key=lambda item: (item[1], -item[0]))]
+        )
+
+def rebuild_similar_anime():
+    """
+    Rebuilds every anime's LSH buckets and similar-anime list in one transaction (for backfills;
+    day-to-day the lists are maintained as genres and tags are linked). Returns the number of anime
+    indexed, or None on error.
+    """
+    db = get_db()
+    try:
+        features = _anime_feature_sets(db, [row[0] for row in db.execute("SELECT id FROM Anime")])
+        db.execute("DELETE FROM AnimeLshBuckets")
+        db.execute("DELETE FROM SimilarAnime")
+
+        bucket_members = {}
+        anime_buckets = {}
+        for anime_id in sorted(features, reverse=True): # Newest first, matching the incremental cap order
+            anime_buckets[anime_id] = _lsh_buckets(features[anime_id])
+            for key in anime_buckets[anime_id]:
+                bucket_members.setdefault(key, []).append(anime_id)
+        db.executemany(
+            "INSERT INTO AnimeLshBuckets (band, bucket, anime_id) VALUES (?, ?, ?)",
+            ((band, bucket, anime_id) for (band, bucket), members in bucket_members.items() for anime_id in members)
+        )
+
+        rows = []
+        for anime_id, buckets in anime_buckets.items():
+            shared_bands = collections.Counter()
+            for key in buckets:
+                shared_bands.update(bucket_members[key][:SIMILAR_ANIME_BUCKET_CAP + 1])
+            del shared_bands[anime_id]
+            scored = ((other_id, _jaccard(features[anime_id], features[other_id]))
+                      for other_id, _ in shared_bands.most_common(SIMILAR_ANIME_SCORED))
+            top = heapq.nlargest(SIMILAR_ANIME_STORED, scored, key=lambda item: (item[1], -item[0]))
+            rows.extend((anime_id, other_id, similarity) for other_id, similarity in top)
+        db.executemany("INSERT INTO SimilarAnime (anime_id, similar_id, similarity) VALUES (?, ?, ?)", rows)
+        db.commit()
+        return len(features)
+    except sqlite3.Error as e:
+        print(f"Error rebuilding similar anime: {e}")
+        db.rollback()
+        return None
+
+@click.command('rebuild-similar-anime')
+@with_appcontext
+def rebuild_similar_anime_command():
+    """Rebuild the MinHash LSH index and "more like this" lists for the whole catalog."""
+    indexed = rebuild_similar_anime()
+    if indexed is None:
+        raise click.ClickException("Rebuilding similar anime failed.")
+    click.echo(f"Indexed {indexed} anime.")
+
+def get_similar_anime(anime_id, k=6):
+    """
+    Returns up to k anime most similar to anime_id by genres and tags, best first, each with
+    .similarity. A single lookup on idx_similaranime_rank; genres/tags are not loaded.
+    """
+    from app.models.anime import Anime
+    rows = get_db().execute(
+        """SELECT a.*, s.similarity FROM SimilarAnime s
+           JOIN Anime a ON a.id = s.similar_id
+           WHERE s.anime_id = ?
+           ORDER BY s.similarity DESC, s.similar_id
+           LIMIT ?""",
+        (anime_id, k)
+    ).fetchall()
+    similar = []
+    for row in rows:
+        anime = Anime(**{key: row[key] for key in row.keys() if key != 'similarity'})
+        anime.similarity = row['similarity']
+        similar.append(anime)
+    return similar
+
+# Description similarity (TF-IDF index in a memory-mapped file)
+DESCRIPTION_INDEX_TERMS_PER_DOC = 32 # Highest-weighted terms kept per synopsis (re-normalized afterwards)
+DESCRIPTION_INDEX_POSTINGS_PER_TERM = 1000 # Highest-weighted documents kept per term; bounds query cost
+DESCRIPTION_INDEX_MAGIC = b'AGTFIDF1'
+# magic, byte order, document count, term count, then byte offsets of the six arrays below
+_DESCRIPTION_INDEX_HEADER = struct.Struct('<8s8sII6Q')
+_DESCRIPTION_STOPWORDS = frozenset("""
+    a about after again against all also an and any are as at be because been before being between both but by
+    can could did do does doing down during each few for from further had has have having he her here hers him
+    his how i if in into is it its itself just me more most my no nor not now of off on once only or other our
+    out over own same she should so some such than that the their them then there these they this those
+    through to too under until up very was we were what when where which while who whom why will with would
+    you your
+""".split())
+_description_index_maps = {} # index path -> (file mtime, mmap, arrays); mmap and arrays None for a bad file
+# Held while a worker's threads read the arrays, so a remap can release the old ones without pulling
+# them out from under a query in progress
+_description_index_lock = threading.Lock()
+
+def _description_index_path():
+    return current_app.config.get('DESCRIPTION_INDEX_PATH') or current_app.config['DATABASE'] + '.description-index'
+
+def _description_terms(text):
+    return [word for word in re.findall(r"[^\W\d_]{3,}", text.lower()) if word not in _DESCRIPTION_STOPWORDS]
+
+def build_description_index():
+    """
+    Builds the TF-IDF index over Anime.description and writes it to the index file, replacing the old
+    one atomically. Weights are (1 + log tf) * log(N / df), L2-normalized after keeping each synopsis's
+    top DESCRIPTION_INDEX_TERMS_PER_DOC terms. The file holds, as flat native-order arrays:
+      anime_ids (sorted), doc_offsets, doc_terms, doc_weights   - each synopsis's sparse vector
+      post_offsets, post_docs + post_weights                    - per-term postings, highest weight first
+    Returns the number of anime indexed.
+    """
+    rows = get_db().execute(
+        "SELECT id, description FROM Anime WHERE description IS NOT NULL AND description != '' ORDER BY id"
+    ).fetchall()
+    term_counts = [collections.Counter(_description_terms(row['description'])) for row in rows]
+    document_frequency = collections.Counter()
+    for counts in term_counts:
+        document_frequency.update(counts.keys())
+    # Terms in a single synopsis can't link two anime
+    term_ids = {term: i for i, term in enumerate(sorted(t for t, df in document_frequency.items() if df > 1))}
+
+    doc_count = len(rows)
+    vectors = []
+    for counts in term_counts:
+        weights = [(term_ids[term], (1 + math.log(tf)) * math.log(doc_count / document_frequency[term]))
+                   for term, tf in counts.items() if term in term_ids]
+        weights = heapq.nlargest(DESCRIPTION_INDEX_TERMS_PER_DOC, (w for w in weights if w[1] > 0), key=lambda w: w[1])
+        norm = math.sqrt(sum(weight * weight for _, weight in weights)) or 1.0
+        vectors.append(sorted((term_id, weight / norm) for term_id, weight in weights))
+
+    postings = [[] for _ in term_ids]
+    for doc_index, vector in enumerate(vectors):
+        for term_id, weight in vector:
+            postings[term_id].append((weight, doc_index))
+
+    anime_ids = array.array('I', (row['id'] for row in rows))
+    doc_offsets, doc_terms, doc_weights = array.array('I', [0]), array.array('I'), array.array('f')
+    for vector in vectors:
+        doc_terms.extend(term_id for term_id, _ in vector)
+        doc_weights.extend(weight for _, weight in vector)
+        doc_offsets.append(len(doc_terms))
+    post_offsets, post_docs, post_weights = array.array('I', [0]), array.array('I'), array.array('f')
+    for term_postings in postings:
+        for weight, doc_index in heapq.nlargest(DESCRIPTION_INDEX_POSTINGS_PER_TERM, term_postings):
+            post_docs.append(doc_index)
+            post_weights.append(weight)
+        post_offsets.append(len(post_docs))
+
+    sections = [anime_ids, doc_offsets, doc_terms, doc_weights, post_offsets, post_docs, post_weights]
+    offsets = [] # Byte offsets of every section after anime_ids, which starts right after the header
+    position = _DESCRIPTION_INDEX_HEADER.size
+    for section in sections[:-1]:
+        position += len(section) * section.itemsize
+        offsets.append(position)
+    path = _description_index_path()
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as index_file:
+        index_file.write(_DESCRIPTION_INDEX_HEADER.pack(
+            DESCRIPTION_INDEX_MAGIC, sys.byteorder.encode('ascii'), doc_count, len(term_ids), *offsets
+        ))
+        for section in sections:
+            section.tofile(index_file)
+    os.replace(temp_path, path) # Workers with the old file mapped keep reading it until they remap
+    return doc_count
+
+@click.command('build-description-index')
+@with_appcontext
+def build_description_index_command():
+    """Build the TF-IDF synopsis index used for "similar stories"."""
+    started = time.time()
+    indexed = build_description_index()
+    click.echo(f"Indexed {indexed} synopses in {time.time() - started:.1f}s.")
+
+def _get_description_index():
+    """
+    Maps the index file read-only and returns zero-copy memoryviews of its arrays, cached per worker
+    and remapped when the file is rebuilt (the old views are released and the old map closed).
+    Returns None if the index hasn't been built, or if the file is truncated or otherwise doesn't
+    match its header. Call with _description_index_lock held, and use the arrays only while holding it.
+    """
+    path = _description_index_path()
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = _description_index_maps.get(path)
+    if cached and cached[0] == mtime:
+        return cached[2]
+    if cached:
+        _close_description_index(*cached[1:])
+        del _description_index_maps[path]
+
+    mapped = arrays = None
+    try:
+        with open(path, 'rb') as index_file:
+            mapped = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        arrays = _description_index_arrays(mapped)
+    except (OSError, ValueError) as e: # ValueError: an empty file can't be mapped
+        print(f"Error reading description index {path}: {e}")
+    if arrays is None and mapped is not None:
+        mapped.close()
+        mapped = None
+        print(f"Ignoring description index {path}: it doesn't match its header; rebuild it")
+    _description_index_maps[path] = (mtime, mapped, arrays)
+    return arrays
+
+def _description_index_arrays(mapped):
+    """
+    Returns the index's arrays as memoryviews of the map, or None unless the header's magic and byte
+    order match and its document and term counts agree with the size of every section.
+    """
+    if len(mapped) < _DESCRIPTION_INDEX_HEADER.size:
+        return None
+    magic, byteorder, doc_count, term_count, *offsets = _DESCRIPTION_INDEX_HEADER.unpack_from(mapped)
+    if magic != DESCRIPTION_INDEX_MAGIC or byteorder.rstrip(b'\0').decode('ascii', 'replace') != sys.byteorder:
+        return None
+    bounds = [_DESCRIPTION_INDEX_HEADER.size] + offsets + [len(mapped)]
+    if any(end < start or (end - start) % 4 for start, end in zip(bounds, bounds[1:])):
+        return None
+    view = memoryview(mapped)
+    formats = ['I', 'I', 'I', 'f', 'I', 'I', 'f']
+    names = ['anime_ids', 'doc_offsets', 'doc_terms', 'doc_weights', 'post_offsets', 'post_docs', 'post_weights']
+    arrays = {name: view[start:end].cast(fmt) for name, fmt, start, end in zip(names, formats, bounds, bounds[1:])}
+    doc_offsets, post_offsets = arrays['doc_offsets'], arrays['post_offsets']
+    if (len(arrays['anime_ids']) != doc_count or len(doc_offsets) != doc_count + 1
+            or len(post_offsets) != term_count + 1
+            or doc_offsets[-1] != len(arrays['doc_terms']) or len(arrays['doc_weights']) != len(arrays['doc_terms'])
+            or post_offsets[-1] != len(arrays['post_docs']) or len(arrays['post_weights']) != len(arrays['post_docs'])):
+        _close_description_index(None, dict(arrays, view=view))
+        return None
+    arrays['view'] = view # Kept so _close_description_index can release it
+    return arrays
+
+def _close_description_index(mapped, arrays):
+    """Releases the arrays' memoryviews (the casts before the view they slice) and closes the map."""
+    for name, array_view in (arrays or {}).items():
+        if name != 'view':
+            array_view.release()
+    if arrays and 'view' in arrays:
+        arrays['view'].release()
+    if mapped is not None:
+        mapped.close()
+
+def get_similar_by_description(anime_id, k=6):
+    """
+    Returns up to k anime whose synopses are closest to anime_id's by TF-IDF cosine, best first, each
+    with .description_similarity. Reads the memory-mapped index (see build_description_index); returns
+    [] if it hasn't been built or the anime has no indexed synopsis. Genres/tags are not loaded.
+    """
+    from app.models.anime import Anime
+    with _description_index_lock:
+        index = _get_description_index()
+        if index is None:
+            return []
+        anime_ids = index['anime_ids']
+        doc_index = bisect.bisect_left(anime_ids, anime_id)
+        if doc_index == len(anime_ids) or anime_ids[doc_index] != anime_id:
+            return []
+
+        doc_offsets, post_offsets = index['doc_offsets'], index['post_offsets']
+        post_docs, post_weights = index['post_docs'], index['post_weights']
+        scores = collections.defaultdict(float)
+        for position in range(doc_offsets[doc_index], doc_offsets[doc_index + 1]):
+            term_id, weight = index['doc_terms'][position], index['doc_weights'][position]
+            for posting in range(post_offsets[term_id], post_offsets[term_id + 1]):
+                scores[post_docs[posting]] += weight * post_weights[posting]
+        scores.pop(doc_index, None)
+        top = heapq.nlargest(k, scores.items(), key=lambda item: (item[1], -item[0]))
+        if not top:
+            return []
+        top_ids = [anime_ids[other_index] for other_index, _ in top]
+
+    rows = get_db().execute(
+        "SELECT * FROM Anime WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(top_ids),)
+    ).fetchall()
+    rows_by_id = {row['id']: row for row in rows}
+    similar = []
+    for other_id, (_, score) in zip(top_ids, top):
+        if other_id in rows_by_id: # Deleted since the index was built
+            anime = Anime(**rows_by_id[other_id])
+            anime.description_similarity = score
+            similar.append(anime)
+    return similar
+
 # Seed data function (can be expanded)
 def seed_db():
     """Seeds the database with initial data for genres, tags, and anime."""
@@ -408,12 +1783,153 @@ def seed_db():
         else:
             click.echo(f"Failed to add anime: {anime_data['title']}")
     
-    # Initialize average ratings (assuming no ratings exist yet, so they'll be 0)
-    all_anime_for_ratings = get_all_anime()
-    for anime_item in all_anime_for_ratings:
-        update_anime_average_rating(anime_item.id)
-        click.echo(f"Initialized average rating for anime ID: {anime_item.id}")
+    # Initialize rating stats (assuming no ratings exist yet, so they'll be 0)
+    rebuild_anime_rating_stats()
+    click.echo("Initialized rating stats for all anime.")
+
+
+# Catalog ingestion
+CATALOG_INGEST_CHUNK_SIZE = 20000 # Titles per transaction
+CATALOG_FORMATS = ('jsonl', 'csv')
+CATALOG_NAME_SEPARATOR = '|' # Between genre/tag names in a CSV cell
+
+def _split_catalog_names(value):
+    if not value:
+        return []
+    names = value if isinstance(value, list) else str(value).split(CATALOG_NAME_SEPARATOR)
+    return list(dict.fromkeys(str(name).strip() for name in names if str(name).strip()))
+
+def _catalog_record(fields):
+    """Normalises one dump record to (title, description, release_year, cover_image_url, language, genres, tags)."""
+    title = str(fields.get('title') or '').strip()
+    if not title:
+        return None
+    try:
+        release_year = int(fields['release_year']) if fields.get('release_year') not in (None, '') else None
+    except (TypeError, ValueError):
+        release_year = None
+    return (title, fields.get('description') or None, release_year, fields.get('cover_image_url') or None,
+            fields.get('language') or None, _split_catalog_names(fields.get('genres')),
+            _split_catalog_names(fields.get('tags')))
+
+def iter_catalog_records(file, catalog_format):
+    """
+    Yields normalised records from an open text-mode catalog dump, reading it line by line.
+    JSONL has one object per line; CSV has a header row. Both use the Anime column names plus
+    genres and tags (a list in JSONL, '|'-separated in CSV). Records without a title are skipped.
+    """
+    if catalog_format == 'jsonl':
+        records = (json.loads(line) for line in file if line.strip())
+    elif catalog_format == 'csv':
+        records = csv.DictReader(file)
+    else:
+        raise ValueError(f"Unsupported catalog format: {catalog_format!r}")
+    for fields in records:
+        record = _catalog_record(fields)
+        if record is not None:
+            yield record
+
+def _ingest_catalog_chunk(db, chunk, genre_ids, tag_ids, summary):
+    """Writes one chunk of catalog records in its own transaction; commits."""
+    db.execute("BEGIN IMMEDIATE") # Hold the write lock from the id read below to the commit
+    titles_json = json.dumps([record[0] for record in chunk])
+    known_years = {} # title -> release years already in the catalog or earlier in this dump (None: unknown)
+    for title, release_year in db.execute(
+        "SELECT title, release_year FROM Anime WHERE title IN (SELECT value FROM json_each(?))", (titles_json,)
+    ):
+        known_years.setdefault(title, set()).add(release_year)
+    fresh = []
+    for record in chunk:
+        years = known_years.get(record[0])
+        # A remake shares its title but not its year; a missing year can't tell them apart, so it matches
+        if years is not None and (record[2] is None or None in years or record[2] in years):
+            summary['skipped'] += 1
+            continue
+        known_years.setdefault(record[0], set()).add(record[2])
+        fresh.append(record)
+
+    _intern_taxonomy_names(db, 'Genres', (name for record in fresh for name in record[5]), genre_ids)
+    _intern_taxonomy_names(db, 'Tags', (name for record in fresh for name in record[6]), tag_ids)
+    # Ids are assigned here rather than read back per row, so the links can go in with executemany too
+    first_id = db.execute(
+        """SELECT MAX(COALESCE((SELECT MAX(id) FROM Anime), 0),
+                      COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'Anime'), 0)) + 1"""
+    ).fetchone()[0]
+    # anime_search_after_insert indexes each row as it goes in, so the search index never misses a title
+    db.executemany(
+        """INSERT INTO Anime (id, title, description, release_year, cover_image_url, language)
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        ((first_id + offset,) + record[:5] for offset, record in enumerate(fresh))
+    )
+    db.executemany(
+        "INSERT OR IGNORE INTO AnimeGenres (anime_id, genre_id) VALUES (?, ?)",
+        ((first_id + offset, genre_ids[name]) for offset, record in enumerate(fresh) for name in record[5])
+    )
+    db.executemany(
+        "INSERT OR IGNORE INTO AnimeTags (anime_id, tag_id) VALUES (?, ?)",
+        ((first_id + offset, tag_ids[name]) for offset, record in enumerate(fresh) for name in record[6])
+    )
+    db.commit()
+    summary['added'] += len(fresh)
 
+def ingest_catalog(records, chunk_size=CATALOG_INGEST_CHUNK_SIZE):
+    """
+    Bulk-loads anime with their genres and tags from an iterable of records (see
+    iter_catalog_records), chunk_size titles per transaction. Genre and tag names are interned once
+    per run; titles already in the catalog with the same release year (or with either year unknown)
+    are skipped, so remakes sharing a title still load. The similar-anime lists and description
+    index are not updated (run rebuild-similar-anime and build-description-index afterwards).
+
+    Returns a summary dict (records, added, skipped). If a chunk fails, summary['error'] is set and
+    the chunks before it stay loaded.
+    """
+    db = get_db()
+    if db.in_transaction:
+        db.commit()
+    summary = {'records': 0, 'added': 0, 'skipped': 0, 'error': None}
+    genre_ids, tag_ids = {}, {}
+    chunk = []
+    try:
+        for record in records:
+            chunk.append(record)
+            summary['records'] += 1
+            if len(chunk) >= chunk_size:
+                _ingest_catalog_chunk(db, chunk, genre_ids, tag_ids, summary)
+                chunk = []
+        if chunk:
+            _ingest_catalog_chunk(db, chunk, genre_ids, tag_ids, summary)
+    except sqlite3.Error as e:
+        db.rollback()
+        print(f"Error ingesting catalog: {e}")
+        summary['error'] = str(e)
+    finally:
+        if db.in_transaction:
+            db.rollback()
+    return summary
+
+@click.command('ingest-catalog')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'catalog_format', type=click.Choice(CATALOG_FORMATS),
+              help="Dump format; guessed from the file extension by default.")
+@with_appcontext
+def ingest_catalog_command(path, catalog_format):
+    """Bulk-load anime, genres and tags from a JSONL or CSV dump."""
+    catalog_format = catalog_format or {'.jsonl': 'jsonl', '.ndjson': 'jsonl', '.csv': 'csv'}.get(
+        os.path.splitext(path)[1].lower())
+    if catalog_format is None:
+        raise click.ClickException("Can't tell the dump format from the file name; pass --format.")
+    started = time.time()
+    with open(path, encoding='utf-8-sig', newline='') as file:
+        try:
+            summary = ingest_catalog(iter_catalog_records(file, catalog_format))
+        except (ValueError, csv.Error) as e: # json.JSONDecodeError is a ValueError
+            raise click.ClickException(f"Couldn't read {path}: {e}")
+    click.echo(f"Added {summary['added']} anime ({summary['skipped']} already in the catalog) "
+               f"in {time.time() - started:.1f}s.")
+    if summary['error']:
+        raise click.ClickException(f"Ingest stopped early: {summary['error']}")
+    if summary['added']:
+        click.echo("Run rebuild-similar-anime and build-description-index to index the new titles.")
 
 @click.command('seed-db')
 @with_appcontext
@@ -429,6 +1945,15 @@ def init_app(app):
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
     app.cli.add_command(seed_db_command) # Add the new command
+    app.cli.add_command(ingest_catalog_command)
+    app.cli.add_command(rebuild_rating_stats_command)
+    app.cli.add_command(rebuild_top_charts_command)
+    app.cli.add_command(prune_trending_activity_command)
+    app.cli.add_command(build_recommendations_command)
+    app.cli.add_command(rebuild_similar_anime_command)
+    app.cli.add_command(build_description_index_command)
+    app.cli.add_command(reconcile_vote_counts_command)
+    app.cli.add_command(reconcile_comment_counts_command)
     app.config['DATABASE'] = 'instance/flaskr.sqlite'
 
 
@@ -439,7 +1964,7 @@ def add_or_update_rating(user_id, anime_id, score):
     try:
         # Check if a rating already exists
         existing_rating = db.execute(
-            "SELECT id FROM Ratings WHERE user_id = ? AND anime_id = ?",
+            "SELECT id, score FROM Ratings WHERE user_id = ? AND anime_id = ?",
             (user_id, anime_id)
         ).fetchone()
 
@@ -450,6 +1975,9 @@ def add_or_update_rating(user_id, anime_id, score):
                 (score, existing_rating['id'])
             )
             rating_id = existing_rating['id']
+            _apply_rating_delta(db, anime_id, score - existing_rating['score'], 0)
+            _apply_rating_histogram_move(db, anime_id, existing_rating['score'], score)
+            db.execute("UPDATE Reviews SET rating_score = ? WHERE rating_id = ?", (score, rating_id))
         else:
             # Insert new rating
             cursor = db.execute(
@@ -457,9 +1985,13 @@ def add_or_update_rating(user_id, anime_id, score):
                 (user_id, anime_id, score)
             )
             rating_id = cursor.lastrowid
-        
-        db.commit()
-        update_anime_average_rating(anime_id) # Update anime's average rating
+            _apply_rating_delta(db, anime_id, score, 1)
+            _apply_rating_histogram_move(db, anime_id, None, score)
+        _refresh_top_chart_entries(db, anime_id)
+        _record_anime_activity(db, anime_id, 'rating')
+
+        db.commit() # Rating, running totals, histogram and chart entries land together
+        invalidate_home_feed(user_id)
         return rating_id
     except sqlite3.Error as e:
         db.rollback()
@@ -481,10 +2013,11 @@ def add_review(user_id, anime_id, text_content, rating_id=None, is_spoiler=False
     db = get_db()
     try:
         cursor = db.execute(
-            """INSERT INTO Reviews (user_id, anime_id, rating_id, text_content, is_spoiler)
-               VALUES (?, ?, ?, ?, ?)""",
-            (user_id, anime_id, rating_id, text_content, is_spoiler)
+            """INSERT INTO Reviews (user_id, anime_id, rating_id, text_content, is_spoiler, rating_score)
+               VALUES (?, ?, ?, ?, ?, COALESCE((SELECT score FROM Ratings WHERE id = ?), 0))""",
+            (user_id, anime_id, rating_id, text_content, is_spoiler, rating_id)
         )
+        _record_anime_activity(db, anime_id, 'review')
         db.commit()
         return cursor.lastrowid
     except sqlite3.Error as e:
@@ -492,21 +2025,59 @@ def add_review(user_id, anime_id, text_content, rating_id=None, is_spoiler=False
         print(f"Error adding review: {e}")
         return None
 
-def get_reviews_for_anime(anime_id):
+REVIEW_SORTS = ('newest', 'helpful', 'rated')
+_REVIEW_SORT_KEYS = { # sort -> SQL sort key; every mode breaks ties by newest id first
+    'newest': 'r.created_at',
+    'helpful': 'r.helpfulness',
+    'rated': 'r.rating_score',
+}
+
+def _wilson_lower_bound(upvotes, downvotes, z=1.96):
+    """Lower bound of the 95% Wilson score interval for the share of upvotes; 0.0 with no votes."""
+    total = upvotes + downvotes
+    if not total:
+        return 0.0
+    share = upvotes / total
+    return (share + z * z / (2 * total) - z * math.sqrt((share * (1 - share) + z * z / (4 * total)) / total)) \
+        / (1 + z * z / total)
+
+def review_page_cursor(review, sort='newest'):
+    """Cursor for the page of get_reviews_for_anime(..., sort) that follows `review`."""
+    if sort == 'helpful':
+        key = review.helpfulness
+    elif sort == 'rated':
+        key = review.rating_score or 0 # Unrated reviews store 0
+    else:
+        key = str(review.created_at) # Same 'YYYY-MM-DD HH:MM:SS' text SQLite stores
+    return encode_cursor([key, review.id])
+
+def get_reviews_for_anime(anime_id, sort='newest', limit=None, cursor=None):
+    """
+    Returns the anime's reviews, newest first, most helpful first (see _wilson_lower_bound) or
+    highest rated first. With `limit`, returns one page; pass `cursor` (from review_page_cursor)
+    to continue after the last review of the previous page. Each order is a range read of its
+    (anime_id, sort key) index, which carries the rowid, so deep pages cost the same as the first.
+    """
     from app.models.ratings_reviews import Review
     from app.models.user import User # To get user details
     db = get_db()
-    rows = db.execute(
-        """SELECT r.id, r.user_id, r.anime_id, r.rating_id, r.text_content, r.is_spoiler,
-                  r.upvotes, r.downvotes, r.created_at, r.updated_at,
-                  u.username, u.avatar_url, rat.score as rating_score
-           FROM Reviews r
-           JOIN Users u ON r.user_id = u.id
-           LEFT JOIN Ratings rat ON r.rating_id = rat.id
-           WHERE r.anime_id = ?
-           ORDER BY r.created_at DESC""",
-        (anime_id,)
-    ).fetchall()
+    sort_key = _REVIEW_SORT_KEYS.get(sort, _REVIEW_SORT_KEYS['newest'])
+    query = """SELECT r.id, r.user_id, r.anime_id, r.rating_id, r.text_content, r.is_spoiler,
+                      r.upvotes, r.downvotes, r.helpfulness, r.created_at, r.updated_at,
+                      u.username, u.avatar_url, r.rating_score
+               FROM Reviews r
+               JOIN Users u ON r.user_id = u.id
+               WHERE r.anime_id = ?"""
+    params = [anime_id]
+    after = decode_cursor(cursor, 2)
+    if after:
+        query += f" AND ({sort_key}, r.id) < (?, ?)"
+        params.extend(after)
+    query += f" ORDER BY {sort_key} DESC, r.id DESC"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    rows = db.execute(query, params).fetchall()
 
     reviews = []
     for row_data in rows:
@@ -515,74 +2086,222 @@ def get_reviews_for_anime(anime_id):
         # We are primarily interested in username and avatar for display with the review
         
         # Create a dictionary for the review data, excluding user-specific fields already captured
-        review_data = {k: row[k] for k in row if k not in ['username', 'avatar_url']}
+        review_data = {k: row[k] for k in row if k not in ['username', 'avatar_url', 'rating_score']}
         review_obj = Review(**review_data)
         review_obj.user = user_data # Attach the User object (or just username/avatar)
-        review_obj.rating_score = row['rating_score'] # Attach associated rating score
+        review_obj.rating_score = row['rating_score'] or None # Attach associated rating score
         reviews.append(review_obj)
     return reviews
 
 # ReviewVote specific database functions
-def add_or_update_review_vote(user_id, review_id, vote_type):
-    """Adds or updates a user's vote for a review. vote_type should be 'upvote' or 'downvote'."""
+VOTE_TARGETS = { # kind -> (items table, votes table, votes column referencing the item)
+    'review': ('Reviews', 'ReviewVotes', 'review_id'),
+    'post': ('CommunityPosts', 'PostVotes', 'post_id'),
+}
+
+def vote_click_result(old_vote, vote_type):
+    """
+    The toggle rules for a vote click: the same vote again removes it, the other vote replaces it,
+    otherwise it's added. Returns (new vote or None, upvotes delta, downvotes delta).
+    """
+    new_vote = None if old_vote == vote_type else vote_type
+    deltas = {'upvote': 0, 'downvote': 0}
+    if old_vote:
+        deltas[old_vote] -= 1
+    if new_vote:
+        deltas[new_vote] += 1
+    return new_vote, deltas['upvote'], deltas['downvote']
+
+def _toggle_vote(db, kind, user_id, item_id, vote_type):
+    """
+    Applies one vote click (see vote_click_result) to the kind's votes table.
+    Returns (the user's resulting vote or None, upvotes delta, downvotes delta) for the item.
+    Does not commit; call it inside the write's transaction.
+    """
+    _, votes_table, item_column = VOTE_TARGETS[kind]
+    removed = db.execute(
+        f"DELETE FROM {votes_table} WHERE user_id = ? AND {item_column} = ? AND vote_type = ?",
+        (user_id, item_id, vote_type)
+    )
+    if removed.rowcount: # Clicked the same vote again (toggle off)
+        old_vote = vote_type
+    else:
+        # The DELETE already holds the write lock, so the row can't change between this read and the upsert
+        existing = db.execute(
+            f"SELECT vote_type FROM {votes_table} WHERE user_id = ? AND {item_column} = ?", (user_id, item_id)
+        ).fetchone()
+        old_vote = existing['vote_type'] if existing else None
+        db.execute(
+            f"""INSERT INTO {votes_table} (user_id, {item_column}, vote_type) VALUES (?, ?, ?)
+                ON CONFLICT (user_id, {item_column})
+                DO UPDATE SET vote_type = excluded.vote_type, created_at = CURRENT_TIMESTAMP""",
+            (user_id, item_id, vote_type)
+        )
+    return vote_click_result(old_vote, vote_type)
+
+def _apply_vote_deltas(db, kind, item_id, upvote_delta, downvote_delta):
+    """
+    Adds the deltas to the item's upvotes/downvotes (re-deriving a review's helpfulness or a post's hot score).
+    Returns the new (upvotes, downvotes), or None if the item doesn't exist.
+    Does not commit; call it inside the write's transaction.
+    """
+    items_table = VOTE_TARGETS[kind][0]
+    counts = db.execute(
+        f"""UPDATE {items_table} SET upvotes = upvotes + ?, downvotes = downvotes + ? WHERE id = ?
+            RETURNING upvotes, downvotes, CAST(strftime('%s', created_at) AS INTEGER) AS created_epoch""",
+        (upvote_delta, downvote_delta, item_id)
+    ).fetchone()
+    if counts and kind == 'review':
+        db.execute(
+            "UPDATE Reviews SET helpfulness = ? WHERE id = ?",
+            (_wilson_lower_bound(counts['upvotes'], counts['downvotes']), item_id)
+        )
+    elif counts and kind == 'post':
+        db.execute(
+            "UPDATE CommunityPosts SET hot_score = ? WHERE id = ?",
+            (_hot_score(counts['upvotes'], counts['downvotes'], counts['created_epoch']), item_id)
+        )
+    return (counts['upvotes'], counts['downvotes']) if counts else None
+
+def _write_vote_click(kind, user_id, item_id, vote_type):
+    """
+    Writes one vote click and the item's counters in one transaction, reading the result back
+    from the writes themselves. Returns {'upvotes', 'downvotes', 'vote'} for the item after the
+    click, None if the item doesn't exist (nothing is written), or False on error.
+    """
     db = get_db()
+    try:
+        new_vote, upvote_delta, downvote_delta = _toggle_vote(db, kind, user_id, item_id, vote_type)
+        # Runs even with zero deltas, as its RETURNING is also the existence check and the counts read
+        counts = _apply_vote_deltas(db, kind, item_id, upvote_delta, downvote_delta)
+        if counts is None:
+            db.rollback()
+            return None
+        db.commit()
+        return {'upvotes': counts[0], 'downvotes': counts[1], 'vote': new_vote}
+    except sqlite3.Error as e:
+        db.rollback()
+        print(f"Error adding/updating {kind} vote: {e}")
+        return False
+
+def add_or_update_review_vote(user_id, review_id, vote_type):
+    """
+    Adds, changes or (when the same vote_type is sent again) removes a user's vote for a review.
+    vote_type should be 'upvote' or 'downvote'. The vote row, the review's counters and its
+    helpfulness score are written in one transaction.
+    Returns {'upvotes', 'downvotes', 'vote'} after the click, None if the review doesn't exist
+    (or vote_type is invalid), or False on error.
+    """
     if vote_type not in ['upvote', 'downvote']:
         print(f"Invalid vote_type: {vote_type}")
         return None
-    
-    try:
-        existing_vote = db.execute(
-            "SELECT id, vote_type FROM ReviewVotes WHERE user_id = ? AND review_id = ?",
-            (user_id, review_id)
-        ).fetchone()
+    return _write_vote_click('review', user_id, review_id, vote_type)
 
-        if existing_vote:
-            if existing_vote['vote_type'] == vote_type:
-                # User clicked the same vote type again, remove the vote (toggle off)
-                db.execute("DELETE FROM ReviewVotes WHERE id = ?", (existing_vote['id'],))
-            else:
-                # User changed their vote
-                db.execute(
-                    "UPDATE ReviewVotes SET vote_type = ?, created_at = CURRENT_TIMESTAMP WHERE id = ?",
-                    (vote_type, existing_vote['id'])
-                )
-        else:
-            # New vote
-            db.execute(
-                "INSERT INTO ReviewVotes (user_id, review_id, vote_type) VALUES (?, ?, ?)",
-                (user_id, review_id, vote_type)
-            )
-        
+def apply_vote_batch(clicks):
+    """
+    Applies queued vote clicks [(kind, user_id, item_id, vote_type)], kind 'review' or 'post', in
+    order and in one transaction. Every click writes its vote row as add_or_update_review_vote /
+    add_or_update_post_vote would, but each item's counters are updated once with the summed deltas.
+    Clicks on an item deleted since they were queued are skipped, so they leave no orphaned vote rows.
+    Returns True on success, False on error (nothing is written).
+    """
+    db = get_db()
+    try:
+        db.execute("BEGIN IMMEDIATE") # Hold the write lock from the existence check below to the commit
+        existing = set()
+        for kind in {click[0] for click in clicks}:
+            items_table = VOTE_TARGETS[kind][0]
+            existing.update((kind, row[0]) for row in db.execute(
+                f"SELECT id FROM {items_table} WHERE id IN (SELECT value FROM json_each(?))",
+                (json.dumps([click[2] for click in clicks if click[0] == kind]),)
+            ))
+        item_deltas = {}
+        for kind, user_id, item_id, vote_type in clicks:
+            if (kind, item_id) not in existing:
+                continue
+            _, upvote_delta, downvote_delta = _toggle_vote(db, kind, user_id, item_id, vote_type)
+            deltas = item_deltas.setdefault((kind, item_id), [0, 0])
+            deltas[0] += upvote_delta
+            deltas[1] += downvote_delta
+        for (kind, item_id), (upvote_delta, downvote_delta) in item_deltas.items():
+            if upvote_delta or downvote_delta:
+                _apply_vote_deltas(db, kind, item_id, upvote_delta, downvote_delta)
         db.commit()
-        update_review_vote_counts(review_id) # Update review's vote counts
         return True
     except sqlite3.Error as e:
         db.rollback()
-        print(f"Error adding/updating review vote: {e}")
-        return None
+        print(f"Error applying vote batch: {e}")
+        return False
+
+def get_vote_state(kind, user_id, item_id):
+    """
+    Returns the stored (upvotes, downvotes) of a review or post and user_id's vote on it (or None),
+    in one query, or None if the item doesn't exist.
+    """
+    items_table, votes_table, item_column = VOTE_TARGETS[kind]
+    row = get_db().execute(
+        f"""SELECT item.upvotes, item.downvotes,
+                   (SELECT v.vote_type FROM {votes_table} v WHERE v.user_id = ? AND v.{item_column} = item.id) AS vote
+            FROM {items_table} item WHERE item.id = ?""",
+        (user_id, item_id)
+    ).fetchone()
+    return (row['upvotes'], row['downvotes'], row['vote']) if row else None
 
-def update_review_vote_counts(review_id):
-    """Updates the upvotes and downvotes counts for a review."""
+def reconcile_vote_counts():
+    """
+    Recounts every review's and post's upvotes/downvotes from ReviewVotes/PostVotes in bulk,
+    writing only rows that drifted, and re-derives review helpfulness and post hot scores where
+    they are out of date.
+    Returns (reviews repaired, posts repaired), or None on error.
+    """
     db = get_db()
     try:
-        upvotes = db.execute(
-            "SELECT COUNT(id) FROM ReviewVotes WHERE review_id = ? AND vote_type = 'upvote'",
-            (review_id,)
-        ).fetchone()[0]
-        
-        downvotes = db.execute(
-            "SELECT COUNT(id) FROM ReviewVotes WHERE review_id = ? AND vote_type = 'downvote'",
-            (review_id,)
-        ).fetchone()[0]
-        
-        db.execute(
-            "UPDATE Reviews SET upvotes = ?, downvotes = ? WHERE id = ?",
-            (upvotes, downvotes, review_id)
-        )
+        repaired = []
+        for items_table, votes_table, item_column in VOTE_TARGETS.values():
+            cursor = db.execute(
+                f"""UPDATE {items_table} SET upvotes = counts.upvotes, downvotes = counts.downvotes
+                    FROM (SELECT item.id,
+                                 COUNT(v.id) FILTER (WHERE v.vote_type = 'upvote') AS upvotes,
+                                 COUNT(v.id) FILTER (WHERE v.vote_type = 'downvote') AS downvotes
+                          FROM {items_table} item
+                          LEFT JOIN {votes_table} v ON v.{item_column} = item.id
+                          GROUP BY item.id) AS counts
+                    WHERE {items_table}.id = counts.id
+                      AND ({items_table}.upvotes IS NOT counts.upvotes OR {items_table}.downvotes IS NOT counts.downvotes)"""
+            )
+            repaired.append(cursor.rowcount)
+
+        stale = []
+        for row in db.execute("SELECT id, upvotes, downvotes, helpfulness FROM Reviews"):
+            helpfulness = _wilson_lower_bound(row['upvotes'], row['downvotes'])
+            if abs(helpfulness - row['helpfulness']) > 1e-9:
+                stale.append((helpfulness, row['id']))
+        db.executemany("UPDATE Reviews SET helpfulness = ? WHERE id = ?", stale)
+
+        stale = []
+        for row in db.execute(
+            """SELECT id, upvotes, downvotes, CAST(strftime('%s', created_at) AS INTEGER) AS created_epoch, hot_score
+               FROM CommunityPosts"""
+        ):
+            hot_score = _hot_score(row['upvotes'], row['downvotes'], row['created_epoch'])
+            if abs(hot_score - row['hot_score']) > 1e-9:
+                stale.append((hot_score, row['id']))
+        db.executemany("UPDATE CommunityPosts SET hot_score = ? WHERE id = ?", stale)
         db.commit()
+        return tuple(repaired)
     except sqlite3.Error as e:
+        print(f"Error reconciling vote counts: {e}")
         db.rollback()
-        print(f"Error updating review vote counts for review {review_id}: {e}")
+        return None
+
+@click.command('reconcile-vote-counts')
+@with_appcontext
+def reconcile_vote_counts_command():
+    """Recount review and post votes from the vote tables, repairing drifted counters."""
+    repaired = reconcile_vote_counts()
+    if repaired is None:
+        raise click.ClickException("Reconciling vote counts failed.")
+    click.echo(f"Repaired vote counts for {repaired[0]} review(s) and {repaired[1]} post(s).")
 
 def get_user_vote_for_review(user_id, review_id):
     """Gets the user's current vote for a review, if any."""
@@ -593,15 +2312,29 @@ def get_user_vote_for_review(user_id, review_id):
     ).fetchone()
     return row['vote_type'] if row else None
 
+def get_user_votes_for_reviews(user_id, review_ids):
+    """
+    Gets the user's votes for a page of reviews in one query.
+    Returns {review_id: 'upvote'/'downvote'}; reviews the user hasn't voted on are absent.
+    """
+    review_ids = list(review_ids)
+    if not review_ids:
+        return {}
+    rows = get_db().execute(
+        """SELECT review_id, vote_type FROM ReviewVotes
+           WHERE user_id = ? AND review_id IN (SELECT value FROM json_each(?))""",
+        (user_id, json.dumps(review_ids))
+    ).fetchall()
+    return {row['review_id']: row['vote_type'] for row in rows}
+
 def get_review_by_id(review_id):
     from app.models.ratings_reviews import Review
     from app.models.user import User
     db = get_db()
     row_data = db.execute(
-        """SELECT r.*, u.username, u.avatar_url, rat.score as rating_score
+        """SELECT r.*, u.username, u.avatar_url
            FROM Reviews r
            JOIN Users u ON r.user_id = u.id
-           LEFT JOIN Ratings rat ON r.rating_id = rat.id
            WHERE r.id = ?""",
         (review_id,)
     ).fetchone()
@@ -615,7 +2348,7 @@ def get_review_by_id(review_id):
     review_data = {k: row[k] for k in row if k not in ['username', 'avatar_url', 'rating_score']}
     review_obj = Review(**review_data)
     review_obj.user = user_data
-    review_obj.rating_score = row['rating_score']
+    review_obj.rating_score = row['rating_score'] or None
     return review_obj
 
 # Subcommunity specific database functions
@@ -673,16 +2406,34 @@ def get_all_subcommunities():
 
 
 # Community Post specific database functions
+HOT_SCORE_EPOCH = 1704067200 # 2024-01-01 UTC; keeps stored hot scores small
+HOT_SCORE_DECAY_SECONDS = 45000 # A post needs 10x the net votes to rank level with one posted this much later
+
+def _hot_score(upvotes, downvotes, created_epoch):
+    """
+    The "hot" feed rank: log10 of the net votes plus the post's age in HOT_SCORE_DECAY_SECONDS units.
+    Newer posts get a permanently higher baseline instead of older posts being decayed, so the score
+    only changes when the post is voted on and can be stored and indexed.
+    """
+    net_votes = upvotes - downvotes
+    sign = (net_votes > 0) - (net_votes < 0)
+    return sign * math.log10(max(abs(net_votes), 1)) + (created_epoch - HOT_SCORE_EPOCH) / HOT_SCORE_DECAY_SECONDS
+
 def add_post(user_id, title, content, subcommunity_id=None, post_type='discussion'):
     db = get_db()
     try:
-        cursor = db.execute(
+        row = db.execute(
             """INSERT INTO CommunityPosts (user_id, title, content, subcommunity_id, post_type)
-               VALUES (?, ?, ?, ?, ?)""",
+               VALUES (?, ?, ?, ?, ?)
+               RETURNING id, CAST(strftime('%s', created_at) AS INTEGER) AS created_epoch""",
             (user_id, title, content, subcommunity_id, post_type)
+        ).fetchone()
+        db.execute(
+            "UPDATE CommunityPosts SET hot_score = ? WHERE id = ?",
+            (_hot_score(0, 0, row['created_epoch']), row['id'])
         )
         db.commit()
-        return cursor.lastrowid
+        return row['id']
     except sqlite3.Error as e:
         db.rollback()
         print(f"Error adding post: {e}")
@@ -711,37 +2462,79 @@ def get_post_by_id(post_id):
         # Minimal subcommunity object for now, or call get_subcommunity_by_id if full object needed
         subcommunity = Subcommunity(id=row['subcommunity_id'], name=row['subcommunity_name']) 
     
-    # Fetch comment count
-    comment_count = db.execute("SELECT COUNT(id) FROM Comments WHERE post_id = ?", (post_id,)).fetchone()[0]
-
     post = CommunityPost(
         id=post_data['id'], user_id=post_data['user_id'], title=post_data['title'],
         content=post_data['content'], subcommunity_id=post_data['subcommunity_id'],
         post_type=post_data['post_type'], upvotes=post_data['upvotes'],
         downvotes=post_data['downvotes'], created_at=post_data['created_at'],
         updated_at=post_data['updated_at'], user=user, subcommunity=subcommunity,
-        comment_count=comment_count
+        comment_count=post_data['comment_count'], hot_score=post_data['hot_score']
     )
     return post
 
-def get_posts_for_subcommunity(subcommunity_id, limit=20, offset=0):
+POST_SORTS = ('hot', 'new', 'top')
+_POST_SORT_KEYS = { # sort -> SQL sort key, matching the feed indexes; ties go to the newest id
+    'hot': 'cp.hot_score',
+    'new': 'cp.created_at',
+    'top': '(cp.upvotes - cp.downvotes)',
+}
+POST_TOP_WINDOWS = { # window -> SQLite datetime modifier for the oldest post it includes
+    'day': '-1 day',
+    'week': '-7 days',
+    'month': '-1 month',
+    'year': '-1 year',
+    'all': None,
+}
+_POST_WINDOW_INDEXES = { # feed -> covering index for 'top' within a window, see _get_posts_query
+    'subcommunity': 'idx_communityposts_subcommunity_id_created_at',
+    'user': 'idx_communityposts_user_id_created_at',
+    'all': 'idx_communityposts_created_at',
+}
+
+def post_page_cursor(post, sort='new'):
+    """Cursor for the page of a post feed (get_all_posts etc.) with `sort` that follows `post`."""
+    if sort == 'hot':
+        key = post.hot_score
+    elif sort == 'top':
+        key = post.upvotes - post.downvotes
+    else:
+        key = str(post.created_at) # Same 'YYYY-MM-DD HH:MM:SS' text SQLite stores
+    return encode_cursor([key, post.id])
+
+def get_posts_for_subcommunity(subcommunity_id, limit=20, sort='new', window='all', cursor=None):
     # Similar to get_all_posts but filtered and with pagination
-    return _get_posts_query(subcommunity_id=subcommunity_id, limit=limit, offset=offset)
+    return _get_posts_query(subcommunity_id=subcommunity_id, limit=limit, sort=sort, window=window, cursor=cursor)
 
-def get_all_posts(limit=20, offset=0):
+def get_all_posts(limit=20, sort='new', window='all', cursor=None):
     # Generic function to get posts, can be used for main feed
-    return _get_posts_query(limit=limit, offset=offset)
+    return _get_posts_query(limit=limit, sort=sort, window=window, cursor=cursor)
 
-def _get_posts_query(subcommunity_id=None, user_id=None, limit=20, offset=0):
+def get_posts_by_user(user_id, limit=20, sort='new', window='all', cursor=None):
+    # A user's own posts, for their post history
+    return _get_posts_query(user_id=user_id, limit=limit, sort=sort, window=window, cursor=cursor)
+
+def _get_posts_query(subcommunity_id=None, user_id=None, limit=20, sort='new', window='all', cursor=None):
+    """
+    One page of posts, newest first ('new'), by stored hot score ('hot', see _hot_score) or by net
+    votes ('top'), optionally only those posted within a POST_TOP_WINDOWS window ('top' only).
+    Pass `cursor` (from post_page_cursor) to continue after the last post of the previous page.
+    Each order is a range read of a (subcommunity_id or user_id, sort key) index, or of the plain
+    sort-key index for the all-communities feed, so deep pages cost the same as the first.
+
+    'top' with a window is the exception: no single index orders by net votes and bounds the date,
+    so each page reads every post in the window from the feed's (..., created_at, upvotes, downvotes)
+    index and sorts them. That costs O(posts in the window) index entries per page, with no table
+    reads except for the page itself; the index is pinned so the cost doesn't depend on the plan.
+    """
     from app.models.community import CommunityPost, Subcommunity
     from app.models.user import User
     db = get_db()
+    sort_key = _POST_SORT_KEYS.get(sort, _POST_SORT_KEYS['new'])
     
     query = """
         SELECT cp.id, cp.title, cp.user_id, cp.subcommunity_id, cp.post_type, 
-               cp.upvotes, cp.downvotes, cp.created_at,
-               u.username, u.avatar_url, s.name as subcommunity_name,
-               (SELECT COUNT(id) FROM Comments WHERE post_id = cp.id) as comment_count
+               cp.upvotes, cp.downvotes, cp.created_at, cp.hot_score,
+               cp.comment_count, u.username, u.avatar_url, s.name as subcommunity_name
         FROM CommunityPosts cp
         JOIN Users u ON cp.user_id = u.id
         LEFT JOIN Subcommunities s ON cp.subcommunity_id = s.id
@@ -755,12 +2548,30 @@ def _get_posts_query(subcommunity_id=None, user_id=None, limit=20, offset=0):
     if user_id: # For fetching posts by a specific user
         conditions.append("cp.user_id = ?")
         params.append(user_id)
-
-    if conditions:
-        query += " WHERE " + " AND ".join(conditions)
-    
-    query += " ORDER BY cp.created_at DESC LIMIT ? OFFSET ?"
-    params.extend([limit, offset])
+    windowed = sort == 'top' and bool(POST_TOP_WINDOWS.get(window))
+    if windowed:
+        conditions.append("cp.created_at >= datetime('now', ?)")
+        params.append(POST_TOP_WINDOWS[window])
+    after = decode_cursor(cursor, 2)
+    if after:
+        # Spelled out rather than as a row value so SQLite can seek on the 'top' expression index too
+        conditions.append(f"{sort_key} <= ? AND ({sort_key} < ? OR cp.id < ?)")
+        params.extend([after[0], after[0], after[1]])
+
+    if windowed:
+        window_index = _POST_WINDOW_INDEXES['subcommunity' if subcommunity_id else 'user' if user_id else 'all']
+        # Pick the page's ids from the covering index alone, then fetch only those rows
+        query += f""" WHERE cp.id IN (
+            SELECT cp.id FROM CommunityPosts cp INDEXED BY {window_index}
+            WHERE {" AND ".join(conditions)}
+            ORDER BY {sort_key} DESC, cp.id DESC LIMIT ?)
+            ORDER BY {sort_key} DESC, cp.id DESC"""
+        params.append(limit)
+    else:
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += f" ORDER BY {sort_key} DESC, cp.id DESC LIMIT ?"
+        params.append(limit)
     
     rows = db.execute(query, params).fetchall()
     
@@ -777,56 +2588,19 @@ def _get_posts_query(subcommunity_id=None, user_id=None, limit=20, offset=0):
             subcommunity_id=row['subcommunity_id'], post_type=row['post_type'],
             upvotes=row['upvotes'], downvotes=row['downvotes'], created_at=row['created_at'],
             user=user, subcommunity=subcommunity, comment_count=row['comment_count'],
+            hot_score=row['hot_score'],
             content="" # Content is not fetched in list view for brevity
         ))
     return posts
 
 
-def update_post_vote_counts(post_id):
-    db = get_db()
-    try:
-        upvotes = db.execute(
-            "SELECT COUNT(id) FROM PostVotes WHERE post_id = ? AND vote_type = 'upvote'", (post_id,)
-        ).fetchone()[0]
-        downvotes = db.execute(
-            "SELECT COUNT(id) FROM PostVotes WHERE post_id = ? AND vote_type = 'downvote'", (post_id,)
-        ).fetchone()[0]
-        
-        db.execute(
-            "UPDATE CommunityPosts SET upvotes = ?, downvotes = ? WHERE id = ?",
-            (upvotes, downvotes, post_id)
-        )
-        db.commit()
-    except sqlite3.Error as e:
-        db.rollback()
-        print(f"Error updating post vote counts for post {post_id}: {e}")
-
 # PostVote specific database functions
 def add_or_update_post_vote(user_id, post_id, vote_type):
-    db = get_db()
+    # Same toggle rules and return values as add_or_update_review_vote; the vote row, the post's
+    # counters and its hot score land in one transaction
     if vote_type not in ['upvote', 'downvote']:
         return None
-    try:
-        existing_vote = db.execute(
-            "SELECT id, vote_type FROM PostVotes WHERE user_id = ? AND post_id = ?",
-            (user_id, post_id)
-        ).fetchone()
-
-        if existing_vote:
-            if existing_vote['vote_type'] == vote_type: # Clicked same vote again (toggle off)
-                db.execute("DELETE FROM PostVotes WHERE id = ?", (existing_vote['id'],))
-            else: # Changed vote
-                db.execute("UPDATE PostVotes SET vote_type = ? WHERE id = ?", (vote_type, existing_vote['id']))
-        else: # New vote
-            db.execute("INSERT INTO PostVotes (user_id, post_id, vote_type) VALUES (?, ?, ?)",
-                       (user_id, post_id, vote_type))
-        db.commit()
-        update_post_vote_counts(post_id)
-        return True
-    except sqlite3.Error as e:
-        db.rollback()
-        print(f"Error adding/updating post vote: {e}")
-        return False
+    return _write_vote_click('post', user_id, post_id, vote_type)
 
 def get_user_vote_for_post(user_id, post_id):
     db = get_db()
@@ -835,55 +2609,237 @@ def get_user_vote_for_post(user_id, post_id):
 
 
 # Comment specific database functions
+COMMENT_THREADS_PAGE_SIZE = 20 # Top-level comments (or replies to one comment) per page
+COMMENT_TREE_DEPTH = 3 # Levels of replies loaded beneath each comment on a page; deeper ones load on demand
+COMMENT_REPLIES_SHOWN = 5 # Replies loaded per comment within those levels; the rest load on demand
+
+def _comment_path_segment(comment_id):
+    return f"{comment_id:010d}/"
+
+def _insert_comment(db, user_id, post_id, text_content, parent_comment_id=None):
+    """
+    Inserts a comment with its materialized path and depth, and adds one to the parent's reply_count
+    and the post's comment_count. Returns the new id, or None if the parent isn't a comment on the
+    same post. Does not commit; call it inside the write's transaction.
+    """
+    parent = None
+    if parent_comment_id:
+        parent = db.execute(
+            "SELECT path, depth FROM Comments WHERE id = ? AND post_id = ?", (parent_comment_id, post_id)
+        ).fetchone()
+        if parent is None:
+            return None
+    comment_id = db.execute(
+        "INSERT INTO Comments (user_id, post_id, text_content, parent_comment_id, depth) VALUES (?, ?, ?, ?, ?)",
+        (user_id, post_id, text_content, parent_comment_id or None, parent['depth'] + 1 if parent else 0)
+    ).lastrowid
+    db.execute(
+        "UPDATE Comments SET path = ? WHERE id = ?",
+        ((parent['path'] if parent else '') + _comment_path_segment(comment_id), comment_id)
+    )
+    if parent:
+        db.execute("UPDATE Comments SET reply_count = reply_count + 1 WHERE id = ?", (parent_comment_id,))
+    db.execute("UPDATE CommunityPosts SET comment_count = comment_count + 1 WHERE id = ?", (post_id,))
+    return comment_id
+
 def add_comment(user_id, post_id, text_content, parent_comment_id=None):
     db = get_db()
     try:
-        cursor = db.execute(
-            "INSERT INTO Comments (user_id, post_id, text_content, parent_comment_id) VALUES (?, ?, ?, ?)",
-            (user_id, post_id, text_content, parent_comment_id)
-        )
+        comment_id = _insert_comment(db, user_id, post_id, text_content, parent_comment_id)
+        if comment_id is None:
+            db.rollback()
+            print(f"Error adding comment: parent comment {parent_comment_id} is not on post {post_id}")
+            return None
         db.commit()
-        return cursor.lastrowid
+        return comment_id
     except sqlite3.Error as e:
         db.rollback()
         print(f"Error adding comment: {e}")
         return None
 
-def get_comments_for_post(post_id):
+def _comment_from_row(row):
     from app.models.community import Comment
     from app.models.user import User
-    db = get_db()
-    
-    # Fetch all comments for the post
-    rows = db.execute(
+    user = User(id=row['user_id'], username=row['username'], email=None, password_hash=None, avatar_url=row['avatar_url'])
+    return Comment(
+        id=row['id'], user_id=row['user_id'], post_id=row['post_id'],
+        text_content=row['text_content'], parent_comment_id=row['parent_comment_id'],
+        created_at=row['created_at'], user=user, replies=[],
+        path=row['path'], depth=row['depth'], reply_count=row['reply_count'],
+        is_deleted=bool(row['is_deleted'])
+    )
+
+def get_comment_by_id(comment_id):
+    row = get_db().execute(
         """SELECT c.*, u.username, u.avatar_url
            FROM Comments c JOIN Users u ON c.user_id = u.id
-           WHERE c.post_id = ? 
-           ORDER BY c.created_at ASC""", # Important for threading logic later
-        (post_id,)
-    ).fetchall()
+           WHERE c.id = ?""",
+        (comment_id,)
+    ).fetchone()
+    return _comment_from_row(row) if row else None
 
-    comments_map = {} # To hold comments by their ID for easy lookup
-    threaded_comments = [] # To hold top-level comments
+def get_comment_threads(post_id, parent_comment_id=None, limit=COMMENT_THREADS_PAGE_SIZE, cursor=None,
+                        depth=COMMENT_TREE_DEPTH, replies_per_comment=COMMENT_REPLIES_SHOWN):
+    """
+    One page of a post's top-level comments (or of one comment's replies, with parent_comment_id),
+    oldest first, each with its replies nested up to `depth` levels below it and at most
+    `replies_per_comment` replies per comment. Pass `cursor` to continue after the previous page.
+    Comments with replies left out get more_replies_cursor, for loading the rest with
+    parent_comment_id. None for limit, depth or replies_per_comment means no bound.
+
+    The page is a range read of the (post_id, parent_comment_id) index, and the replies beneath it
+    one recursive query that reads only the replies it shows, so a comment with thousands of
+    replies costs no more than one with replies_per_comment. Returns (comments, next_cursor);
+    next_cursor is None on the last page.
+    """
+    db = get_db()
+    query = """SELECT c.*, u.username, u.avatar_url
+               FROM Comments c JOIN Users u ON c.user_id = u.id
+               WHERE c.post_id = ? AND c.parent_comment_id IS ?"""
+    params = [post_id, parent_comment_id]
+    after = decode_cursor(cursor, 1)
+    if after:
+        query += " AND c.id > ?"
+        params.append(after[0])
+    query += " ORDER BY c.id"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit + 1) # One extra row shows whether another page exists
+    comments = [_comment_from_row(row) for row in db.execute(query, params).fetchall()]
+    next_cursor = None
+    if limit is not None and len(comments) > limit:
+        comments = comments[:limit]
+        next_cursor = encode_cursor([comments[-1].id])
+    if not comments:
+        return [], None
+
+    comments_map = {comment.id: comment for comment in comments}
+    if depth is None or depth > 0:
+        # Each step reads at most replies_per_comment replies per shown comment, the oldest first,
+        # from the (parent_comment_id, id) index
+        query = """WITH RECURSIVE shown(id, level) AS (
+                       SELECT value, 0 FROM json_each(?)
+                       UNION ALL
+                       SELECT reply.id, shown.level + 1 FROM shown JOIN Comments reply ON reply.id IN
+                           (SELECT id FROM Comments WHERE parent_comment_id = shown.id ORDER BY id LIMIT ?)
+                       WHERE ? IS NULL OR shown.level < ?
+                   )
+                   SELECT c.*, u.username, u.avatar_url
+                   FROM shown JOIN Comments c ON c.id = shown.id JOIN Users u ON c.user_id = u.id
+                   WHERE shown.level > 0
+                   ORDER BY shown.level, c.id"""
+        params = (json.dumps(list(comments_map)), -1 if replies_per_comment is None else replies_per_comment,
+                  depth, depth)
+        for row in db.execute(query, params): # Level by level, so every reply arrives after its parent
+            reply = _comment_from_row(row)
+            comments_map[reply.parent_comment_id].replies.append(reply)
+            comments_map[reply.id] = reply
+
+    for comment in comments_map.values():
+        if comment.reply_count > len(comment.replies):
+            comment.has_more_replies = True
+            comment.more_replies_cursor = encode_cursor([comment.replies[-1].id]) if comment.replies else None
+    return comments, next_cursor
 
-    for row_data in rows:
-        row = dict(row_data)
-        user = User(id=row['user_id'], username=row['username'], email=None, password_hash=None, avatar_url=row['avatar_url'])
-        comment = Comment(
-            id=row['id'], user_id=row['user_id'], post_id=row['post_id'],
-            text_content=row['text_content'], parent_comment_id=row['parent_comment_id'],
-            created_at=row['created_at'], user=user, replies=[]
+def get_comments_for_post(post_id):
+    """Every comment on a post as a tree: the top-level comments, each with its replies nested."""
+    return get_comment_threads(post_id, limit=None, depth=None, replies_per_comment=None)[0]
+
+def delete_comment(comment_id, user_id):
+    """
+    Deletes user_id's comment. A comment with replies is soft-deleted instead (its text is blanked
+    and is_deleted set, the node kept so the replies stay in place); other users' replies are never
+    removed. Removing a comment also removes any soft-deleted ancestors it leaves without replies.
+    The post's comment_count and each parent's reply_count drop by the rows actually removed, in the
+    same transaction. Returns (post_id, comments removed), or None if the comment doesn't exist,
+    is already deleted, isn't the user's, or on error.
+    """
+    db = get_db()
+    try:
+        row = db.execute(
+            "SELECT id, post_id, parent_comment_id, reply_count FROM Comments WHERE id = ? AND user_id = ? AND NOT is_deleted",
+            (comment_id, user_id)
+        ).fetchone()
+        if row is None:
+            return None
+        post_id, removed = row['post_id'], 0
+        if row['reply_count'] > 0:
+            db.execute("UPDATE Comments SET text_content = '', is_deleted = TRUE WHERE id = ?", (comment_id,))
+        while row is not None:
+            cursor = db.execute("DELETE FROM Comments WHERE id = ? AND reply_count = 0", (row['id'],))
+            if cursor.rowcount == 0:
+                break
+            removed += cursor.rowcount
+            if not row['parent_comment_id']:
+                break
+            db.execute("UPDATE Comments SET reply_count = reply_count - 1 WHERE id = ?", (row['parent_comment_id'],))
+            row = db.execute( # A soft-deleted parent goes too once its last reply is gone
+                "SELECT id, parent_comment_id FROM Comments WHERE id = ? AND is_deleted AND reply_count = 0",
+                (row['parent_comment_id'],)
+            ).fetchone()
+        if removed:
+            db.execute("UPDATE CommunityPosts SET comment_count = comment_count - ? WHERE id = ?", (removed, post_id))
+        db.commit()
+        return post_id, removed
+    except sqlite3.Error as e:
+        db.rollback()
+        print(f"Error deleting comment {comment_id}: {e}")
+        return None
+
+def reconcile_comment_counts():
+    """
+    Recounts every post's comment_count and every comment's reply_count from the Comments table,
+    and rebuilds comment paths and depths from parent_comment_id, in bulk, writing only rows that
+    drifted. Returns (posts repaired, comments repaired), or None on error.
+    """
+    db = get_db()
+    try:
+        # The CTEs sit inside FROM so the cursor reports rowcount (sqlite3 only does for DML-led statements)
+        comments_cursor = db.execute(
+            """UPDATE Comments SET path = tree.path, depth = tree.depth
+               FROM (WITH RECURSIVE tree(id, path, depth) AS (
+                         SELECT id, printf('%010d/', id), 0 FROM Comments WHERE parent_comment_id IS NULL
+                         UNION ALL
+                         SELECT c.id, tree.path || printf('%010d/', c.id), tree.depth + 1
+                         FROM Comments c JOIN tree ON c.parent_comment_id = tree.id
+                     )
+                     SELECT id, path, depth FROM tree) AS tree
+               WHERE Comments.id = tree.id AND (Comments.path IS NOT tree.path OR Comments.depth IS NOT tree.depth)"""
+        )
+        comments_repaired = comments_cursor.rowcount
+        comments_cursor = db.execute(
+            """UPDATE Comments SET reply_count = counts.reply_count
+               FROM (SELECT parent.id, COUNT(c.id) AS reply_count
+                     FROM Comments parent
+                     LEFT JOIN Comments c ON c.parent_comment_id = parent.id
+                     GROUP BY parent.id) AS counts
+               WHERE Comments.id = counts.id AND Comments.reply_count IS NOT counts.reply_count"""
         )
-        comments_map[comment.id] = comment
+        comments_repaired += comments_cursor.rowcount
+        cursor = db.execute(
+            """UPDATE CommunityPosts SET comment_count = counts.comment_count
+               FROM (SELECT cp.id, COUNT(c.id) AS comment_count
+                     FROM CommunityPosts cp
+                     LEFT JOIN Comments c ON c.post_id = cp.id
+                     GROUP BY cp.id) AS counts
+               WHERE CommunityPosts.id = counts.id AND CommunityPosts.comment_count IS NOT counts.comment_count"""
+        )
+        db.commit()
+        return cursor.rowcount, comments_repaired
+    except sqlite3.Error as e:
+        print(f"Error reconciling comment counts: {e}")
+        db.rollback()
+        return None
 
-        if comment.parent_comment_id:
-            if comment.parent_comment_id in comments_map:
-                parent_comment = comments_map[comment.parent_comment_id]
-                parent_comment.replies.append(comment)
-        else:
-            threaded_comments.append(comment)
-            
-    return threaded_comments # Returns a list of top-level comments, each with its replies nested
+@click.command('reconcile-comment-counts')
+@with_appcontext
+def reconcile_comment_counts_command():
+    """Recount posts' comments and comments' replies, and rebuild comment paths, repairing drift."""
+    repaired = reconcile_comment_counts()
+    if repaired is None:
+        raise click.ClickException("Reconciling comment counts failed.")
+    click.echo(f"Repaired comment counts for {repaired[0]} post(s).")
+    click.echo(f"Repaired reply counts or paths for {repaired[1]} comment(s).")
 
 # WatchlistItem specific database functions
 def add_or_update_watchlist_item(user_id, anime_id, status):
@@ -891,7 +2847,7 @@ def add_or_update_watchlist_item(user_id, anime_id, status):
     db = get_db()
     try:
         existing_item = db.execute(
-            "SELECT id FROM WatchlistItems WHERE user_id = ? AND anime_id = ?",
+            "SELECT id, status FROM WatchlistItems WHERE user_id = ? AND anime_id = ?",
             (user_id, anime_id)
         ).fetchone()
 
@@ -909,7 +2865,10 @@ def add_or_update_watchlist_item(user_id, anime_id, status):
                 (user_id, anime_id, status)
             )
             item_id = cursor.lastrowid
+        if not existing_item or existing_item['status'] != status: # Re-saving the same status isn't new activity
+            _record_anime_activity(db, anime_id, 'watchlist')
         db.commit()
+        invalidate_home_feed(user_id)
         return item_id
     except sqlite3.Error as e:
         db.rollback()
@@ -924,12 +2883,159 @@ def remove_watchlist_item(user_id, anime_id): # Simplified: remove any status fo
             (user_id, anime_id)
         )
         db.commit()
+        invalidate_home_feed(user_id)
         return True
     except sqlite3.Error as e:
         db.rollback()
         print(f"Error removing watchlist item: {e}")
         return False
 
+# List import
+LIST_IMPORT_CHUNK_SIZE = 1000 # Entries resolved and written per transaction
+LIST_IMPORT_UNMATCHED_SHOWN = 50 # Unmatched titles kept in the summary
+
+def _resolve_anime_titles(db, titles):
+    """
+    Maps titles to Anime ids in two set-based queries: exact matches through idx_anime_title, then
+    one case-insensitive pass for the rest. Returns {title: anime_id} for the titles found.
+    """
+    resolved = {}
+    for row in db.execute(
+        "SELECT id, title FROM Anime WHERE title IN (SELECT value FROM json_each(?))", (json.dumps(titles),)
+    ):
+        resolved.setdefault(row['title'], row['id'])
+    missing = [title for title in titles if title not in resolved]
+    if missing:
+        folded = {}
+        for row in db.execute(
+            "SELECT id, title FROM Anime WHERE title COLLATE NOCASE IN (SELECT value FROM json_each(?))",
+            (json.dumps(missing),)
+        ):
+            folded.setdefault(row['title'].lower(), row['id'])
+        for title in missing:
+            if title.lower() in folded:
+                resolved[title] = folded[title.lower()]
+    return resolved
+
+def _import_list_chunk(db, user_id, chunk, summary, affected_anime_ids):
+    """Resolves and writes one chunk of (title, score, status) entries. Does not commit."""
+    resolved = _resolve_anime_titles(db, list({title for title, _, _ in chunk}))
+    ratings, watchlist_items = {}, {} # anime_id -> score / status; a title listed twice keeps its last entry
+    for title, score, status in chunk:
+        anime_id = resolved.get(title)
+        if anime_id is None:
+            summary['unmatched_count'] += 1
+            if len(summary['unmatched']) < LIST_IMPORT_UNMATCHED_SHOWN:
+                summary['unmatched'].append(title)
+            continue
+        summary['matched'] += 1
+        if score is not None:
+            ratings[anime_id] = score
+            affected_anime_ids.add(anime_id)
+        if status is not None:
+            watchlist_items[anime_id] = status
+
+    # Running totals, histograms and charts are recomputed once per title after the last chunk
+    db.executemany(
+        """INSERT INTO Ratings (user_id, anime_id, score) VALUES (?, ?, ?)
+           ON CONFLICT(user_id, anime_id) DO UPDATE SET score = excluded.score, created_at = CURRENT_TIMESTAMP
+           WHERE score != excluded.score""",
+        [(user_id, anime_id, score) for anime_id, score in ratings.items()]
+    )
+    # Same semantics as add_or_update_watchlist_item: move an existing item to the new status, else add one
+    db.executemany(
+        """UPDATE OR IGNORE WatchlistItems SET status = ?, added_at = CURRENT_TIMESTAMP
+           WHERE user_id = ? AND anime_id = ? AND status != ?""",
+        [(status, user_id, anime_id, status) for anime_id, status in watchlist_items.items()]
+    )
+    db.executemany(
+        """INSERT INTO WatchlistItems (user_id, anime_id, status)
+           SELECT ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM WatchlistItems WHERE user_id = ? AND anime_id = ?)""",
+        [(user_id, anime_id, status, user_id, anime_id) for anime_id, status in watchlist_items.items()]
+    )
+    summary['ratings'] += len(ratings)
+    summary['watchlist_items'] += len(watchlist_items)
+
+def _finish_list_import(db, user_id, anime_ids):
+    """Brings rating totals, histograms, review scores and chart entries of the imported titles up to date."""
+    if not anime_ids:
+        return
+    ids_json = json.dumps(sorted(anime_ids))
+    totals_sql = """SELECT COALESCE(SUM(rating_sum), 0), COALESCE(SUM(rating_count), 0)
+                    FROM Anime WHERE id IN (SELECT value FROM json_each(?))"""
+    sum_before, count_before = db.execute(totals_sql, (ids_json,)).fetchone()
+    _recompute_rating_stats(db, anime_ids)
+    sum_after, count_after = db.execute(totals_sql, (ids_json,)).fetchone()
+    db.execute(
+        "UPDATE RatingTotals SET rating_sum = rating_sum + ?, rating_count = rating_count + ? WHERE id = 1",
+        (sum_after - sum_before, count_after - count_before)
+    )
+    db.execute(
+        """UPDATE Reviews SET rating_score = (SELECT score FROM Ratings WHERE id = Reviews.rating_id)
+           WHERE user_id = ? AND rating_id IS NOT NULL AND anime_id IN (SELECT value FROM json_each(?))""",
+        (user_id, ids_json)
+    )
+    for anime_id in sorted(anime_ids):
+        _refresh_top_chart_entries(db, anime_id)
+
+def import_list_entries(user_id, entries, chunk_size=LIST_IMPORT_CHUNK_SIZE):
+    """
+    Imports a user's list from another tracker. entries is an iterable of (title, score, status),
+    score 1-10 or None and status a WatchlistItems status or None; it is consumed lazily, so it can
+    be a parser reading an upload. Titles are resolved and ratings/watchlist items written
+    chunk_size entries per transaction; each title's rating stats are then recomputed once.
+    Imported ratings don't count as trending activity.
+
+    Returns a summary dict (entries read, entries saved, and matched, ratings, watchlist_items,
+    unmatched_count and the first unmatched titles among the saved entries). If a chunk fails to
+    write, summary['error'] is set and the chunks before it stay imported, so saved < entries.
+    Errors raised by the entries iterable propagate after the same clean-up.
+    """
+    db = get_db()
+    summary = {'entries': 0, 'saved': 0, 'matched': 0, 'ratings': 0, 'watchlist_items': 0,
+               'unmatched_count': 0, 'unmatched': [], 'error': None}
+    affected_anime_ids = set()
+
+    def write_chunk(chunk):
+        # The counts only take in a chunk once it commits
+        counts = {key: summary[key] for key in ('matched', 'ratings', 'watchlist_items', 'unmatched_count')}
+        unmatched_shown = len(summary['unmatched'])
+        try:
+            _import_list_chunk(db, user_id, chunk, summary, affected_anime_ids)
+            db.commit()
+        except sqlite3.Error:
+            summary.update(counts)
+            del summary['unmatched'][unmatched_shown:]
+            raise
+        summary['saved'] += len(chunk)
+
+    chunk = []
+    try:
+        for entry in entries:
+            chunk.append(entry)
+            summary['entries'] += 1
+            if len(chunk) >= chunk_size:
+                write_chunk(chunk)
+                chunk = []
+        if chunk:
+            write_chunk(chunk)
+    except sqlite3.Error as e:
+        db.rollback()
+        print(f"Error importing list entries: {e}")
+        summary['error'] = str(e)
+    finally:
+        if db.in_transaction: # The entries iterable raised mid-chunk
+            db.rollback()
+        try:
+            _finish_list_import(db, user_id, affected_anime_ids)
+            db.commit()
+        except sqlite3.Error as e:
+            db.rollback()
+            print(f"Error refreshing rating stats after list import: {e}")
+            summary['error'] = summary['error'] or str(e)
+        invalidate_home_feed(user_id)
+    return summary
+
 def get_watchlist_for_user(user_id, status_filter=None):
     from app.models.user_activity import WatchlistItem
     from app.models.anime import Anime # To attach anime details
@@ -1044,12 +3150,12 @@ def add_comment(user_id, post_id, text_content, parent_comment_id=None): # Origi
     db = get_db()
     comment_id = None
     try:
-        cursor = db.execute(
-            "INSERT INTO Comments (user_id, post_id, text_content, parent_comment_id) VALUES (?, ?, ?, ?)",
-            (user_id, post_id, text_content, parent_comment_id)
-        )
-        comment_id = cursor.lastrowid
-        db.commit()
+        comment_id = _insert_comment(db, user_id, post_id, text_content, parent_comment_id)
+        if comment_id is None:
+            db.rollback()
+            print(f"Error adding comment: parent comment {parent_comment_id} is not on post {post_id}")
+            return None
+        db.commit() # Comment, path and both counters land together
     except sqlite3.Error as e:
         db.rollback()
         print(f"Error adding comment: {e}")
@@ -0,0 +1,243 @@
+"""
+Streaming parsers for anime list exports from other trackers (XML, JSON and CSV).
+
+Each parser reads the file incrementally and yields (title, score, status) entries, so a list with
+thousands of titles is never held in memory; db.import_list_entries resolves and writes them in
+chunks as they arrive.
+
+- XML: MyAnimeList-style, one <anime> element per title (series_title, my_score, my_status).
+- JSON: an array of objects, newline-delimited objects, or an object holding the array under
+  "anime", "entries", "list" or "items" (the first of those keys holding an array is streamed).
+- CSV: a header row naming the title, score and status columns.
+"""
+import codecs
+import csv
+import json
+import os
+import xml.etree.ElementTree as ET
+import click
+from flask.cli import with_appcontext
+from app.db import import_list_entries, find_user_by_username
+
+LIST_FORMATS = ('xml', 'json', 'csv')
+LIST_IMPORT_MAX_BYTES = 16 * 1024 * 1024 # Default upload limit for the web form (config LIST_IMPORT_MAX_BYTES)
+_FORMAT_EXTENSIONS = {'.xml': 'xml', '.json': 'json', '.jsonl': 'json', '.ndjson': 'json', '.csv': 'csv'}
+
+# Field names used by common exporters, checked in order (compared lower-cased)
+_TITLE_FIELDS = ('title', 'series_title', 'name', 'anime_title')
+_SCORE_FIELDS = ('score', 'my_score', 'rating')
+_STATUS_FIELDS = ('status', 'my_status', 'watch_status')
+_JSON_LIST_KEYS = ('anime', 'entries', 'list', 'items')
+_XML_ENTRY_TAGS = ('anime', 'entry', 'item')
+
+# Other trackers' statuses -> WatchlistItems.status (keys normalised by _status_key); others are skipped
+_STATUS_MAP = {
+    'completed': 'completed', 'complete': 'completed', 'watched': 'completed',
+    'watching': 'watching', 'currently_watching': 'watching', 'current': 'watching',
+    'plan_to_watch': 'plan_to_watch', 'planning': 'plan_to_watch', 'planned': 'plan_to_watch',
+    'want_to_watch': 'plan_to_watch',
+    'dropped': 'dropped',
+    'bookmarked': 'bookmarked',
+}
+
+JSON_READ_SIZE = 64 * 1024
+
+class ListFormatError(ValueError):
+    """Raised when an export can't be parsed as the given format."""
+
+def guess_list_format(filename):
+    """Returns the list format implied by a file name's extension, or None."""
+    return _FORMAT_EXTENSIONS.get(os.path.splitext(filename or '')[1].lower())
+
+def _status_key(value):
+    return '_'.join(str(value).strip().lower().replace('-', ' ').split())
+
+def _normalise_score(value):
+    """Scores come as 1-10, or 1-100 from trackers using a 100-point scale; 0 or blank means unrated."""
+    try:
+        score = float(value)
+    except (TypeError, ValueError):
+        return None
+    if score > 10:
+        score /= 10
+    if score < 1 or score > 10:
+        return None
+    return int(score + 0.5)
+
+def _entry_from_fields(fields):
+    """Builds a (title, score, status) entry from one exported record, or None without a title."""
+    fields = {str(key).strip().lower(): value for key, value in fields.items() if key is not None}
+    title = next((fields[key] for key in _TITLE_FIELDS if fields.get(key)), None)
+    if title is None or not str(title).strip():
+        return None
+    score = next((fields[key] for key in _SCORE_FIELDS if fields.get(key) not in (None, '')), None)
+    status = next((fields[key] for key in _STATUS_FIELDS if fields.get(key)), None)
+    return (str(title).strip(), _normalise_score(score),
+            _STATUS_MAP.get(_status_key(status)) if status is not None else None)
+
+def _text_stream(file):
+    """Wraps a binary file in an incremental UTF-8 reader (a byte-order mark is dropped)."""
+    if isinstance(file.read(0), str):
+        return file
+    return codecs.getreader('utf-8-sig')(file)
+
+def _iter_xml_records(file):
+    # iterparse builds the tree as it reads; clearing each finished entry keeps memory flat
+    try:
+        for _, element in ET.iterparse(file, events=('end',)):
+            if element.tag.lower() in _XML_ENTRY_TAGS:
+                yield {child.tag: (child.text or '').strip() for child in element}
+                element.clear()
+    except ET.ParseError as e:
+        raise ListFormatError(f"Invalid XML: {e}") from e
+
+class _JsonReader:
+    """Reads JSON values one at a time from a text stream, keeping only the unparsed tail buffered."""
+
+    def __init__(self, stream):
+        self.decoder = json.JSONDecoder()
+        self.stream = stream
+        self.buffer, self.position, self.exhausted = '', 0, False
+
+    def _read_more(self):
+        chunk = self.stream.read(JSON_READ_SIZE)
+        self.buffer, self.position, self.exhausted = self.buffer[self.position:] + chunk, 0, not chunk
+
+    def peek(self, skipped=''):
+        """Skips whitespace (and any of the skipped characters); returns the next character, or '' at the end."""
+        while True:
+            while self.position < len(self.buffer) and (self.buffer[self.position].isspace()
+                                                        or self.buffer[self.position] in skipped):
+                self.position += 1
+            if self.position < len(self.buffer) or self.exhausted:
+                return self.buffer[self.position:self.position + 1]
+            self._read_more()
+
+    def advance(self):
+        self.position += 1
+
+    def decode(self):
+        """Decodes the next value, reading on until it is complete."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError as e:
+                if self.exhausted:
+                    raise ListFormatError(f"Invalid JSON: {e}") from e
+                self._read_more() # The value may continue past what has been read so far
+                continue
+            if end == len(self.buffer) and not self.exhausted:
+                self._read_more() # A number cut off by the read size would decode short
+                continue
+            self.position = end
+            return value
+
+def _iter_json_array(reader):
+    # Called just past the '['; each element is decoded on its own
+    while True:
+        next_char = reader.peek(',')
+        if next_char == ']':
+            reader.advance()
+            return
+        if not next_char:
+            raise ListFormatError("Invalid JSON: unterminated array")
+        value = reader.decode()
+        if isinstance(value, dict):
+            yield value
+
+def _iter_json_object(reader):
+    # Walks an object key by key, so an export wrapped as {"anime": [...]} streams its array
+    # instead of being decoded whole; any other object is yielded as one record
+    reader.advance()
+    record, wrapped = {}, False
+    while True:
+        next_char = reader.peek(',')
+        if next_char == '}':
+            reader.advance()
+            break
+        if not next_char:
+            raise ListFormatError("Invalid JSON: unterminated object")
+        key = reader.decode()
+        if not isinstance(key, str) or reader.peek() != ':':
+            raise ListFormatError("Invalid JSON: expected a string key and ':' in an object")
+        reader.advance()
+        if not wrapped and key in _JSON_LIST_KEYS and reader.peek() == '[':
+            reader.advance()
+            wrapped = True
+            yield from _iter_json_array(reader)
+        else:
+            record[key] = reader.decode()
+    if not wrapped:
+        yield record
+
+def _iter_json_records(file):
+    reader = _JsonReader(_text_stream(file))
+    if reader.peek() == '[':
+        reader.advance()
+        yield from _iter_json_array(reader)
+        return
+    while True: # Newline-delimited values, or a single object wrapping the list
+        next_char = reader.peek()
+        if not next_char:
+            return
+        if next_char == '{':
+            yield from _iter_json_object(reader)
+        else:
+            reader.decode() # Only objects are records
+
+def _iter_csv_records(file):
+    try:
+        yield from csv.DictReader(_text_stream(file))
+    except csv.Error as e:
+        raise ListFormatError(f"Invalid CSV: {e}") from e
+
+def parse_list_export(file, list_format):
+    """
+    Yields (title, score, status) entries from an open export file (binary, or text for JSON/CSV)
+    as it is read. Raises ListFormatError for an unknown format or a malformed file.
+    """
+    parsers = {'xml': _iter_xml_records, 'json': _iter_json_records, 'csv': _iter_csv_records}
+    if list_format not in parsers:
+        raise ListFormatError(f"Unsupported list format: {list_format!r}")
+    try:
+        for record in parsers[list_format](file):
+            entry = _entry_from_fields(record)
+            if entry is not None:
+                yield entry
+    except UnicodeDecodeError as e:
+        raise ListFormatError(f"The file is not UTF-8 text: {e}") from e
+
+def import_list(user_id, file, list_format):
+    """Parses an export and imports it for a user; returns db.import_list_entries' summary."""
+    return import_list_entries(user_id, parse_list_export(file, list_format))
+
+@click.command('import-list')
+@click.argument('username')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'list_format', type=click.Choice(LIST_FORMATS),
+              help="Export format; guessed from the file extension by default.")
+@with_appcontext
+def import_list_command(username, path, list_format):
+    """Import a rating/watchlist export from another tracker into USERNAME's lists."""
+    user = find_user_by_username(username)
+    if user is None:
+        raise click.ClickException(f"No user named {username!r}.")
+    list_format = list_format or guess_list_format(path)
+    if list_format is None:
+        raise click.ClickException("Can't tell the export format from the file name; pass --format.")
+    with open(path, 'rb') as file:
+        try:
+            summary = import_list(user.id, file, list_format)
+        except ListFormatError as e:
+            raise click.ClickException(str(e))
+    click.echo(f"Imported {summary['matched']} of {summary['saved']} entries "
+               f"({summary['ratings']} ratings, {summary['watchlist_items']} watchlist items).")
+    if summary['unmatched_count']:
+        click.echo(f"{summary['unmatched_count']} titles didn't match the catalog, e.g. "
+                   + ', '.join(summary['unmatched'][:10]))
+    if summary['error']:
+        raise click.ClickException(f"Import stopped early: {summary['error']}")
+
+def init_app(app):
+    app.cli.add_command(import_list_command)
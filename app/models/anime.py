@@ -1,6 +1,7 @@
 class Anime:
     def __init__(self, id, title, description=None, release_year=None, cover_image_url=None, 
                  average_rating=0.0, language=None, created_at=None, updated_at=None,
+                 rating_sum=0, rating_count=0,
                  genres=None, tags=None): # Added genres and tags for convenience
         self.id = id
         self.title = title
@@ -8,6 +9,8 @@ class Anime:
         self.release_year = release_year
         self.cover_image_url = cover_image_url
         self.average_rating = average_rating
+        self.rating_sum = rating_sum
+        self.rating_count = rating_count
         self.language = language
         self.created_at = created_at
         self.updated_at = updated_at
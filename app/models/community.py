@@ -14,7 +14,7 @@ class CommunityPost:
     def __init__(self, id, user_id, title, content, subcommunity_id=None, 
                  post_type='discussion', upvotes=0, downvotes=0, 
                  created_at=None, updated_at=None, 
-                 user=None, subcommunity=None, comment_count=0): # Added user, subcommunity, comment_count
+                 user=None, subcommunity=None, comment_count=0, hot_score=0.0): # Added user, subcommunity, comment_count
         self.id = id
         self.user_id = user_id
         self.subcommunity_id = subcommunity_id
@@ -28,6 +28,7 @@ class CommunityPost:
         self.user = user # User object for author details
         self.subcommunity = subcommunity # Subcommunity object
         self.comment_count = comment_count # To display number of comments
+        self.hot_score = hot_score # Stored "hot" feed rank, see db._hot_score
 
     def __repr__(self):
         return f"<CommunityPost {self.id}: {self.title}>"
@@ -45,7 +46,7 @@ class PostVote:
 
 class Comment:
     def __init__(self, id, user_id, post_id, text_content, parent_comment_id=None, 
-                 created_at=None, user=None, replies=None): # Added user and replies
+                 created_at=None, user=None, replies=None, path='', depth=0, reply_count=0, is_deleted=False): # Added user and replies
         self.id = id
         self.user_id = user_id
         self.post_id = post_id
@@ -54,6 +55,12 @@ class Comment:
         self.created_at = created_at
         self.user = user # User object for commenter details
         self.replies = replies if replies else [] # List of Comment objects (replies)
+        self.path = path # Materialized path, see schema.sql
+        self.depth = depth # 0 for top-level comments
+        self.reply_count = reply_count # Direct replies, loaded or not
+        self.is_deleted = is_deleted # Deleted by its author but kept for its replies; text_content is blank
+        self.has_more_replies = False # Some direct replies aren't loaded into self.replies
+        self.more_replies_cursor = None # Continues after the last loaded reply (None: from the first)
 
     def __repr__(self):
         return f"<Comment {self.id} on Post {self.post_id} by User {self.user_id}>"
@@ -12,7 +12,7 @@ class Rating:
 class Review:
     def __init__(self, id, user_id, anime_id, text_content, rating_id=None, 
                  is_spoiler=False, upvotes=0, downvotes=0, created_at=None, updated_at=None,
-                 user=None): # Added user for convenience to hold User object
+                 user=None, helpfulness=0.0): # Added user for convenience to hold User object
         self.id = id
         self.user_id = user_id
         self.anime_id = anime_id
@@ -21,6 +21,7 @@ class Review:
         self.is_spoiler = is_spoiler
         self.upvotes = upvotes
         self.downvotes = downvotes
+        self.helpfulness = helpfulness # Wilson lower bound, kept in step with the vote counts
         self.created_at = created_at
         self.updated_at = updated_at
         self.user = user # To store the User object (username, avatar_url)
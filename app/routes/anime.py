@@ -1,40 +1,102 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, g
+from flask import Blueprint, render_template, request, redirect, url_for, flash, g, jsonify
 from app.db import (
-    get_all_anime, get_anime_by_id, get_random_anime, 
+    get_all_anime, get_anime_by_id, get_random_anime_id, get_anime_facets, anime_page_cursor, decode_cursor, search_anime,
+    get_top_chart, get_trending_anime, get_recommendations_for_user, get_similar_anime,
+    get_similar_by_description, get_rating_histogram,
     get_all_genres, get_all_tags, get_genre_by_id, get_tag_by_id,
-    get_reviews_for_anime, get_user_rating_for_anime, get_user_vote_for_review,
+    get_reviews_for_anime, review_page_cursor, REVIEW_SORTS, get_user_rating_for_anime, get_user_votes_for_reviews,
     get_watchlist_item_status # Added for watchlist status on anime detail page
 )
 from app.routes.auth import login_required
 
 bp = Blueprint('anime', __name__, url_prefix='/anime')
 
-@bp.route('/')
-def list_anime():
-    # Get filter parameters from request.args
-    selected_genre_id = request.args.get('genre_id', type=int)
-    selected_tag_id = request.args.get('tag_id', type=int)
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+RAIL_SIZE = 10 # Anime shown in the trending / recommended rails
+SIMILAR_ANIME_SHOWN = 6
+REVIEWS_PAGE_SIZE = 10
+
+def _get_list_filters():
+    """
+    Reads the anime list filters from the query string. genre_id and tag_id may repeat;
+    genre_mode/tag_mode choose whether all ('all') or any ('any') of them must match.
+    """
+    selected_genre_ids = [i for i in request.args.getlist('genre_id', type=int) if i]
+    selected_tag_ids = [i for i in request.args.getlist('tag_id', type=int) if i]
     release_year = request.args.get('release_year', type=int)
+    year_min = request.args.get('year_min', type=int)
+    year_max = request.args.get('year_max', type=int)
     language = request.args.get('language')
 
     filters = {}
-    if selected_genre_id:
-        filters['genre_id'] = selected_genre_id
-    if selected_tag_id:
-        filters['tag_id'] = selected_tag_id
+    if selected_genre_ids:
+        filters['genre_ids'] = selected_genre_ids
+        filters['genre_mode'] = request.args.get('genre_mode', 'all')
+    if selected_tag_ids:
+        filters['tag_ids'] = selected_tag_ids
+        filters['tag_mode'] = request.args.get('tag_mode', 'all')
     if release_year:
         filters['release_year'] = release_year
+    if year_min:
+        filters['year_min'] = year_min
+    if year_max:
+        filters['year_max'] = year_max
     if language and language != "all": # Assuming "all" means no filter
         filters['language'] = language
+    return filters
+
+def _get_anime_page(filters):
+    """
+    Fetches one keyset page of the catalog for the `cursor`/`limit` query args.
+    Returns (anime_list, next_cursor); next_cursor is None on the last page.
+    """
+    page_size = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    # Fetch one extra row to know whether another page exists
+    anime_list = get_all_anime(filters=filters if filters else None, limit=page_size + 1,
+                               cursor=request.args.get('cursor'))
+    next_cursor = None
+    if len(anime_list) > page_size:
+        anime_list = anime_list[:page_size]
+        next_cursor = anime_page_cursor(anime_list[-1])
+    return anime_list, next_cursor
+
+def _next_page_url(endpoint, next_cursor):
+    """Builds the URL of the next page, keeping the current filters."""
+    if not next_cursor:
+        return None
+    args = request.args.to_dict(flat=False) # flat=False keeps repeated genre_id/tag_id values
+    args['cursor'] = next_cursor
+    return url_for(endpoint, **args)
+
+def _surprise_url():
+    """Builds the Surprise Me URL, limited to the current list filters."""
+    args = request.args.to_dict(flat=False)
+    args.pop('cursor', None)
+    args.pop('limit', None)
+    return url_for('anime.surprise_me', **args)
+
+@bp.route('/')
+def list_anime():
+    filters = _get_list_filters()
+    language = request.args.get('language')
     
-    all_anime = get_all_anime(filters=filters if filters else None)
+    all_anime, next_cursor = _get_anime_page(filters)
+    first_page = decode_cursor(request.args.get('cursor'), 2) is None # A malformed cursor shows the first page
     all_genres = get_all_genres()
     all_tags = get_all_tags()
     
-    # This is just an example, you might want to get unique years/languages from your DB
-    # For simplicity, I'm not dynamically generating these from the current anime list in the DB
-    available_years = sorted(list(set(a.release_year for a in get_all_anime() if a.release_year)), reverse=True)
-    available_languages = sorted(list(set(a.language for a in get_all_anime() if a.language)))
+    # Distinct years/languages and per-option counts come from grouped (cached) facet queries
+    facets = get_anime_facets(filters=filters if filters else None)
+    available_years = [facet['value'] for facet in facets['years']]
+    available_languages = [facet['value'] for facet in facets['languages']]
+    facet_counts = {
+        'genres': {facet['id']: facet['count'] for facet in facets['genres']},
+        'tags': {facet['id']: facet['count'] for facet in facets['tags']},
+        'years': {facet['value']: facet['count'] for facet in facets['years']},
+        'languages': {facet['value']: facet['count'] for facet in facets['languages']},
+    }
 
 
     return render_template(
@@ -44,12 +106,161 @@ def list_anime():
         tags=all_tags,
         available_years=available_years,
         available_languages=available_languages,
-        selected_genre_id=selected_genre_id,
-        selected_tag_id=selected_tag_id,
-        selected_year=release_year,
+        facet_counts=facet_counts,
+        next_page_url=_next_page_url('anime.list_anime', next_cursor),
+        next_page_json_url=_next_page_url('anime.list_anime_json', next_cursor),
+        surprise_url=_surprise_url(),
+        trending_anime=get_trending_anime(limit=RAIL_SIZE) if first_page else [],
+        recommended_anime=get_recommendations_for_user(g.user.id, limit=RAIL_SIZE) if first_page and g.user else [],
+        selected_genre_ids=filters.get('genre_ids', []),
+        selected_tag_ids=filters.get('tag_ids', []),
+        selected_genre_mode=filters.get('genre_mode', 'all'),
+        selected_tag_mode=filters.get('tag_mode', 'all'),
+        selected_year_min=filters.get('year_min', filters.get('release_year')),
+        selected_year_max=filters.get('year_max', filters.get('release_year')),
         selected_language=language
     )
 
+@bp.route('/page.json')
+def list_anime_json():
+    """JSON variant of list_anime for infinite scroll: rendered cards plus the next cursor."""
+    filters = _get_list_filters()
+    anime_list, next_cursor = _get_anime_page(filters)
+    return jsonify({
+        'success': True,
+        'anime': [{'id': a.id, 'title': a.title, 'release_year': a.release_year,
+                   'average_rating': a.average_rating, 'cover_image_url': a.cover_image_url}
+                  for a in anime_list],
+        'html': render_template('partials/_anime_cards.html', anime_list=anime_list),
+        'next_cursor': next_cursor,
+        'next_url': _next_page_url('anime.list_anime_json', next_cursor),
+    })
+
+@bp.route('/trending.json')
+def trending_json():
+    """Trending anime (decay-weighted recent activity), best first."""
+    limit = max(1, min(request.args.get('limit', RAIL_SIZE, type=int), MAX_PAGE_SIZE))
+    return jsonify({
+        'success': True,
+        'anime': [{'id': a.id, 'title': a.title, 'cover_image_url': a.cover_image_url,
+                   'trending_score': a.trending_score} for a in get_trending_anime(limit=limit)],
+    })
+
+@bp.route('/recommendations.json')
+@login_required
+def recommendations_json():
+    """The current user's item-item recommendations, best first."""
+    limit = max(1, min(request.args.get('limit', RAIL_SIZE, type=int), MAX_PAGE_SIZE))
+    return jsonify({
+        'success': True,
+        'anime': [{'id': a.id, 'title': a.title, 'cover_image_url': a.cover_image_url,
+                   'recommendation_score': a.recommendation_score}
+                  for a in get_recommendations_for_user(g.user.id, limit=limit)],
+    })
+
+@bp.route('/search')
+def search():
+    """Full-text catalog search. Returns JSON (rendered results plus the next page URL) for AJAX requests."""
+    query = request.args.get('q', '').strip()
+    page_size = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    results, next_cursor = search_anime(query, limit=page_size, cursor=request.args.get('cursor'))
+    next_page_url = _next_page_url('anime.search', next_cursor)
+
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return jsonify({
+            'success': True,
+            'query': query,
+            'results': [{'id': a.id, 'title': a.title, 'title_highlight': str(a.title_highlight),
+                         'snippet': str(a.snippet) if a.snippet else None} for a in results],
+            'html': render_template('partials/_anime_search_results.html', results=results),
+            'next_cursor': next_cursor,
+            'next_url': next_page_url,
+        })
+
+    return render_template('anime/search.html', query=query, results=results, next_page_url=next_page_url)
+
+@bp.route('/top', defaults={'kind': 'top', 'key': 0})
+@bp.route('/top/<any(year, genre):kind>/<int:key>')
+def top_chart(kind, key):
+    """Top Rated, Top by Year and Top in Genre charts. Returns JSON for AJAX requests, like search."""
+    if kind == 'genre':
+        genre = get_genre_by_id(key)
+        if genre is None:
+            flash('Genre not found.', 'error')
+            return redirect(url_for('anime.top_chart'))
+        chart_title = f"Top {genre.name} Anime"
+    elif kind == 'year':
+        chart_title = f"Top Anime of {key}"
+    else:
+        chart_title = "Top Rated Anime"
+
+    page_size = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    anime_list, next_cursor = get_top_chart(kind, key, limit=page_size, cursor=request.args.get('cursor'))
+    next_page_url = _next_page_url('anime.top_chart', next_cursor)
+
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return jsonify({
+            'success': True,
+            'chart': {'kind': kind, 'key': key, 'title': chart_title},
+            'anime': [{'id': a.id, 'title': a.title, 'rank': a.chart_rank, 'score': a.chart_score,
+                       'average_rating': a.average_rating, 'rating_count': a.rating_count}
+                      for a in anime_list],
+            'html': render_template('partials/_top_chart_rows.html', anime_list=anime_list),
+            'next_cursor': next_cursor,
+            'next_url': next_page_url,
+        })
+
+    return render_template(
+        'anime/top_chart.html',
+        chart_title=chart_title,
+        chart_kind=kind,
+        chart_key=key,
+        anime_list=anime_list,
+        next_page_url=next_page_url,
+        genres=get_all_genres(),
+        available_years=[facet['value'] for facet in get_anime_facets()['years']]
+    )
+
+def _get_review_page(anime_id):
+    """
+    Fetches one keyset page of the anime's reviews for the `review_sort`/`review_cursor` query args.
+    Returns (reviews, sort, next_cursor); next_cursor is None on the last page.
+    """
+    sort = request.args.get('review_sort', 'newest')
+    if sort not in REVIEW_SORTS:
+        sort = 'newest'
+    # Fetch one extra row to know whether another page exists
+    reviews = get_reviews_for_anime(anime_id, sort=sort, limit=REVIEWS_PAGE_SIZE + 1,
+                                    cursor=request.args.get('review_cursor'))
+    next_cursor = None
+    if len(reviews) > REVIEWS_PAGE_SIZE:
+        reviews = reviews[:REVIEWS_PAGE_SIZE]
+        next_cursor = review_page_cursor(reviews[-1], sort)
+    return reviews, sort, next_cursor
+
+@bp.route('/<int:anime_id>/reviews')
+def reviews_page(anime_id):
+    """Next page of an anime's reviews as JSON for AJAX requests; otherwise the detail page shows it."""
+    if request.headers.get('X-Requested-With') != 'XMLHttpRequest':
+        return redirect(url_for('anime.detail', anime_id=anime_id, **request.args.to_dict(), _anchor='reviews'))
+
+    reviews, sort, next_cursor = _get_review_page(anime_id)
+    user_votes = get_user_votes_for_reviews(g.user.id, [review.id for review in reviews]) if g.user else {}
+    return jsonify({
+        'success': True,
+        'reviews': [{'id': review.id, 'username': review.user.username, 'text_content': review.text_content,
+                     'is_spoiler': bool(review.is_spoiler), 'rating_score': review.rating_score,
+                     'upvotes': review.upvotes, 'downvotes': review.downvotes,
+                     'helpfulness': review.helpfulness, 'created_at': str(review.created_at)}
+                    for review in reviews],
+        'html': render_template('partials/_review_items.html', reviews=reviews, user_votes=user_votes),
+        'next_cursor': next_cursor,
+        'next_url': url_for('anime.reviews_page', anime_id=anime_id, review_sort=sort, review_cursor=next_cursor)
+                    if next_cursor else None,
+    })
+
 @bp.route('/<int:anime_id>')
 def detail(anime_id):
     anime = get_anime_by_id(anime_id)
@@ -57,7 +268,7 @@ def detail(anime_id):
         flash('Anime not found.', 'error')
         return redirect(url_for('anime.list_anime'))
 
-    reviews = get_reviews_for_anime(anime_id)
+    reviews, review_sort, next_review_cursor = _get_review_page(anime_id)
     current_user_rating = None
     user_votes = {} # To store user's vote for each review: {review_id: 'upvote'/'downvote'}
     current_watchlist_status = None # For watchlist
@@ -65,27 +276,54 @@ def detail(anime_id):
     if g.user:
         current_user_rating = get_user_rating_for_anime(g.user.id, anime_id)
         current_watchlist_status = get_watchlist_item_status(g.user.id, anime_id) # Get watchlist status
-        for review_item in reviews: # Changed variable name from review to review_item
-            user_vote = get_user_vote_for_review(g.user.id, review_item.id)
-            if user_vote:
-                user_votes[review_item.id] = user_vote
-                
+        user_votes = get_user_votes_for_reviews(g.user.id, [review_item.id for review_item in reviews])
+
     return render_template(
         'anime/detail.html', 
         anime=anime, 
         reviews=reviews, 
         current_user_rating=current_user_rating,
         user_votes=user_votes,
-        current_watchlist_status=current_watchlist_status # Pass to template
+        review_sort=review_sort,
+        review_sorts={'newest': 'Newest', 'helpful': 'Most helpful', 'rated': 'Highest rated'},
+        next_reviews_url=url_for('anime.detail', anime_id=anime_id, review_sort=review_sort,
+                                 review_cursor=next_review_cursor, _anchor='reviews') if next_review_cursor else None,
+        next_reviews_json_url=url_for('anime.reviews_page', anime_id=anime_id, review_sort=review_sort,
+                                      review_cursor=next_review_cursor) if next_review_cursor else None,
+        current_watchlist_status=current_watchlist_status, # Pass to template
+        rating_histogram=get_rating_histogram(anime_id),
+        similar_anime=get_similar_anime(anime_id, k=SIMILAR_ANIME_SHOWN),
+        similar_stories=get_similar_by_description(anime_id, k=SIMILAR_ANIME_SHOWN)
     )
 
+@bp.route('/<int:anime_id>.json')
+def detail_json(anime_id):
+    """JSON variant of detail: the anime's fields plus its score distribution."""
+    anime = get_anime_by_id(anime_id)
+    if anime is None:
+        return jsonify({'success': False, 'message': 'Anime not found.'}), 404
+    return jsonify({
+        'success': True,
+        'anime': {'id': anime.id, 'title': anime.title, 'description': anime.description,
+                  'release_year': anime.release_year, 'language': anime.language,
+                  'cover_image_url': anime.cover_image_url, 'average_rating': anime.average_rating,
+                  'rating_count': anime.rating_count,
+                  'genres': [genre.name for genre in anime.genres], 'tags': [tag.name for tag in anime.tags]},
+        'rating_histogram': get_rating_histogram(anime_id), # Ratings at score 1, 2, ..., 10
+    })
+
 @bp.route('/surprise')
 def surprise_me():
-    anime = get_random_anime()
-    if anime is None:
+    # Accepts the same filters as the list page, e.g. ?genre_id=1&genre_id=4&language=Japanese
+    filters = _get_list_filters()
+    anime_id = get_random_anime_id(filters)
+    if anime_id is None:
+        if filters:
+            flash('No anime match those filters to surprise you with!', 'error')
+            return redirect(url_for('anime.list_anime', **request.args.to_dict(flat=False)))
         flash('No anime available to surprise you with!', 'error')
         return redirect(url_for('anime.list_anime'))
-    return redirect(url_for('anime.detail', anime_id=anime.id))
+    return redirect(url_for('anime.detail', anime_id=anime_id))
 
 # Optional: Add Anime Page (Basic Structure)
 # @bp.route('/add', methods=('GET', 'POST'))
@@ -1,20 +1,116 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, g, jsonify
 from app.db import (
     get_all_subcommunities, add_subcommunity, get_subcommunity_by_id, get_subcommunity_by_name,
-    add_post, get_post_by_id, get_posts_for_subcommunity, get_all_posts,
-    add_or_update_post_vote, get_user_vote_for_post,
-    add_comment, get_comments_for_post
+    add_post, get_post_by_id, get_posts_for_subcommunity, get_all_posts, get_posts_by_user, post_page_cursor,
+    POST_SORTS, POST_TOP_WINDOWS, find_user_by_username,
+    get_user_vote_for_post,
+    add_comment, get_comment_threads, get_comment_by_id, delete_comment
 )
 from app.routes.auth import login_required
+from app.vote_buffer import record_vote
 
 bp = Blueprint('community', __name__, url_prefix='/community')
 
+POSTS_PAGE_SIZE = 20
+POST_SORT_LABELS = {'hot': 'Hot', 'new': 'New', 'top': 'Top'}
+TOP_WINDOW_LABELS = {'day': 'Today', 'week': 'This week', 'month': 'This month', 'year': 'This year', 'all': 'All time'}
+
+def _get_post_sort():
+    """Reads the feed's `sort` and `t` (top window) query args, falling back to hot / this week."""
+    sort = request.args.get('sort', 'hot')
+    if sort not in POST_SORTS:
+        sort = 'hot'
+    window = request.args.get('t', 'week')
+    if window not in POST_TOP_WINDOWS:
+        window = 'week'
+    return sort, window
+
+def _get_post_page(subcommunity_id=None, user_id=None):
+    """
+    Fetches one keyset page of a post feed (all communities, one subcommunity or one user's posts)
+    for the `sort`/`t`/`cursor` query args. Returns (posts, sort, window, next_cursor);
+    next_cursor is None on the last page.
+    """
+    sort, window = _get_post_sort()
+    cursor = request.args.get('cursor')
+    # Fetch one extra row to know whether another page exists
+    if subcommunity_id is not None:
+        posts = get_posts_for_subcommunity(subcommunity_id, limit=POSTS_PAGE_SIZE + 1, sort=sort, window=window, cursor=cursor)
+    elif user_id is not None:
+        posts = get_posts_by_user(user_id, limit=POSTS_PAGE_SIZE + 1, sort=sort, window=window, cursor=cursor)
+    else:
+        posts = get_all_posts(limit=POSTS_PAGE_SIZE + 1, sort=sort, window=window, cursor=cursor)
+    next_cursor = None
+    if len(posts) > POSTS_PAGE_SIZE:
+        posts = posts[:POSTS_PAGE_SIZE]
+        next_cursor = post_page_cursor(posts[-1], sort)
+    return posts, sort, window, next_cursor
+
+def _post_feed_context(page_endpoint, page_args, json_args, posts, sort, window, next_cursor):
+    """
+    Template variables shared by the feed pages: the posts, the sort buttons' endpoint and the
+    next page's URLs (page_args/json_args identify the feed to the page and to posts_page).
+    """
+    sort_args = {'sort': sort, 't': window if sort == 'top' else None, 'cursor': next_cursor}
+    return dict(
+        posts=posts, post_sort=sort, top_window=window,
+        post_sorts=POST_SORT_LABELS, top_windows=TOP_WINDOW_LABELS,
+        feed_endpoint=page_endpoint, feed_args=page_args,
+        next_posts_url=url_for(page_endpoint, **page_args, **sort_args) if next_cursor else None,
+        next_posts_json_url=url_for('community.posts_page', **json_args, **sort_args) if next_cursor else None,
+    )
+
 @bp.route('/')
 def home():
     subcommunities = get_all_subcommunities()
-    # For "Recent Posts", get_all_posts already sorts by created_at DESC
-    recent_posts = get_all_posts(limit=10) # Get top 10 recent posts from all communities
-    return render_template('community/home.html', subcommunities=subcommunities, recent_posts=recent_posts)
+    posts, sort, window, next_cursor = _get_post_page()
+    return render_template('community/home.html', subcommunities=subcommunities,
+                           **_post_feed_context('community.home', {}, {}, posts, sort, window, next_cursor))
+
+@bp.route('/posts')
+@bp.route('/s/<int:subcommunity_id>/posts')
+@bp.route('/u/<username>/posts')
+def posts_page(subcommunity_id=None, username=None):
+    """Next page of a post feed as JSON for AJAX requests; otherwise the feed's page shows it."""
+    if request.headers.get('X-Requested-With') != 'XMLHttpRequest':
+        if subcommunity_id is not None:
+            return redirect(url_for('community.subcommunity_detail', subcommunity_identifier=subcommunity_id, **request.args.to_dict()))
+        if username is not None:
+            return redirect(url_for('community.user_posts', username=username, **request.args.to_dict()))
+        return redirect(url_for('community.home', **request.args.to_dict()))
+
+    user_id = None
+    if username is not None:
+        user = find_user_by_username(username)
+        if user is None:
+            return jsonify({'success': False, 'message': 'User not found.'}), 404
+        user_id = user.id
+    posts, sort, window, next_cursor = _get_post_page(subcommunity_id=subcommunity_id, user_id=user_id)
+    page_args = {'subcommunity_id': subcommunity_id} if subcommunity_id is not None else \
+                {'username': username} if username is not None else {}
+    return jsonify({
+        'success': True,
+        'posts': [{'id': post.id, 'title': post.title, 'username': post.user.username,
+                   'subcommunity_id': post.subcommunity_id, 'post_type': post.post_type,
+                   'upvotes': post.upvotes, 'downvotes': post.downvotes, 'comment_count': post.comment_count,
+                   'hot_score': post.hot_score, 'created_at': str(post.created_at)}
+                  for post in posts],
+        'html': render_template('partials/_post_items.html', posts=posts),
+        'next_cursor': next_cursor,
+        'next_url': url_for('community.posts_page', **page_args, sort=sort, t=window if sort == 'top' else None,
+                            cursor=next_cursor) if next_cursor else None,
+    })
+
+@bp.route('/u/<username>')
+def user_posts(username):
+    user = find_user_by_username(username)
+    if not user:
+        flash('User not found.', 'error')
+        return redirect(url_for('community.home'))
+    posts, sort, window, next_cursor = _get_post_page(user_id=user.id)
+    return render_template('community/user_posts.html', posts_user=user,
+                           **_post_feed_context('community.user_posts', {'username': username}, {'username': username},
+                                                posts, sort, window, next_cursor))
 
 @bp.route('/s/<subcommunity_identifier>') # Can be ID or name
 def subcommunity_detail(subcommunity_identifier):
@@ -31,8 +127,10 @@ def subcommunity_detail(subcommunity_identifier):
         flash('Subcommunity not found.', 'error')
         return redirect(url_for('community.home'))
     
-    posts = get_posts_for_subcommunity(subcommunity.id)
-    return render_template('community/subcommunity_detail.html', subcommunity=subcommunity, posts=posts)
+    posts, sort, window, next_cursor = _get_post_page(subcommunity_id=subcommunity.id)
+    return render_template('community/subcommunity_detail.html', subcommunity=subcommunity,
+                           **_post_feed_context('community.subcommunity_detail', {'subcommunity_identifier': subcommunity.id},
+                                                {'subcommunity_id': subcommunity.id}, posts, sort, window, next_cursor))
 
 @bp.route('/post/<int:post_id>')
 def post_detail(post_id):
@@ -41,12 +139,68 @@ def post_detail(post_id):
         flash('Post not found.', 'error')
         return redirect(url_for('community.home'))
     
-    comments = get_comments_for_post(post_id) # This should fetch threaded comments
+    # With ?thread=<comment id>, shows that comment and a page of its replies (the no-JS "load more replies")
+    thread = get_comment_by_id(request.args.get('thread', type=int) or 0)
+    if thread and thread.post_id == post_id:
+        thread.replies, next_cursor = get_comment_threads(post_id, parent_comment_id=thread.id,
+                                                          cursor=request.args.get('cursor'))
+        thread.has_more_replies, thread.more_replies_cursor = next_cursor is not None, next_cursor
+        comments, next_comments_url, next_comments_json_url = [thread], None, None
+    else:
+        thread = None
+        comments, next_cursor = get_comment_threads(post_id, cursor=request.args.get('cursor'))
+        next_comments_url = url_for('community.post_detail', post_id=post_id, cursor=next_cursor,
+                                    _anchor='comments') if next_cursor else None
+        next_comments_json_url = url_for('community.comments_page', post_id=post_id,
+                                         cursor=next_cursor) if next_cursor else None
     user_vote = None
     if g.user:
         user_vote = get_user_vote_for_post(g.user.id, post_id)
         
-    return render_template('community/post_detail.html', post=post, comments=comments, user_vote=user_vote)
+    return render_template('community/post_detail.html', post=post, comments=comments, user_vote=user_vote,
+                           thread=thread, next_comments_url=next_comments_url,
+                           next_comments_json_url=next_comments_json_url)
+
+@bp.route('/post/<int:post_id>/comments')
+@bp.route('/comment/<int:comment_id>/replies')
+def comments_page(post_id=None, comment_id=None):
+    """
+    Next page of a post's top-level comments, or of one comment's replies ("load more replies"),
+    as JSON for AJAX requests; otherwise the post page shows it.
+    """
+    parent = None
+    if comment_id is not None:
+        parent = get_comment_by_id(comment_id)
+        if parent is None:
+            if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                return jsonify({'success': False, 'message': 'Comment not found.'}), 404
+            flash('Comment not found.', 'error')
+            return redirect(url_for('community.home'))
+        post_id = parent.post_id
+    if request.headers.get('X-Requested-With') != 'XMLHttpRequest':
+        if parent is not None:
+            return redirect(url_for('community.post_detail', post_id=post_id, thread=parent.id,
+                                    cursor=request.args.get('cursor'), _anchor=f'comment-{parent.id}'))
+        return redirect(url_for('community.post_detail', post_id=post_id, cursor=request.args.get('cursor'),
+                                _anchor='comments'))
+
+    comments, next_cursor = get_comment_threads(post_id, parent_comment_id=comment_id,
+                                                cursor=request.args.get('cursor'))
+    page_args = {'comment_id': comment_id} if comment_id is not None else {'post_id': post_id}
+
+    def comment_json(comment):
+        return {'id': comment.id, 'username': comment.user.username, 'text_content': comment.text_content,
+                'parent_comment_id': comment.parent_comment_id, 'depth': comment.depth,
+                'reply_count': comment.reply_count, 'is_deleted': comment.is_deleted, 'created_at': str(comment.created_at),
+                'replies': [comment_json(reply) for reply in comment.replies]}
+
+    return jsonify({
+        'success': True,
+        'comments': [comment_json(comment) for comment in comments],
+        'html': render_template('partials/_comment_items.html', comments=comments, post_id=post_id),
+        'next_cursor': next_cursor,
+        'next_url': url_for('community.comments_page', **page_args, cursor=next_cursor) if next_cursor else None,
+    })
 
 @bp.route('/create_post', methods=('GET', 'POST'))
 @bp.route('/s/<int:subcommunity_id>/submit', methods=('GET', 'POST'))
@@ -111,17 +265,16 @@ def vote_post(post_id):
     if vote_type not in ['upvote', 'downvote']:
         return jsonify({'success': False, 'message': 'Invalid vote type.'}), 400
 
-    if not get_post_by_id(post_id): # Check if post exists
+    result = record_vote('post', g.user.id, post_id, vote_type) # None if the post doesn't exist
+    if result is None:
         return jsonify({'success': False, 'message': 'Post not found.'}), 404
-
-    if add_or_update_post_vote(g.user.id, post_id, vote_type):
-        post = get_post_by_id(post_id) # Fetch updated vote counts
+    if result:
         return jsonify({
             'success': True, 
             'message': 'Vote recorded.', 
-            'upvotes': post.upvotes, 
-            'downvotes': post.downvotes,
-            'new_vote_status': get_user_vote_for_post(g.user.id, post_id) # send back the new status
+            'upvotes': result['upvotes'], 
+            'downvotes': result['downvotes'],
+            'new_vote_status': result['vote'] # send back the new status
         })
     else:
         return jsonify({'success': False, 'message': 'Failed to record vote.'}), 500
@@ -148,6 +301,23 @@ def comment_on_post(post_id):
     
     return redirect(url_for('community.post_detail', post_id=post_id))
 
+@bp.route('/comment/<int:comment_id>/delete', methods=['POST'])
+@login_required
+def delete_comment_route(comment_id):
+    result = delete_comment(comment_id, g.user.id) # Kept, blanked, if others replied to it
+    message = 'Comment deleted.' if result and result[1] else 'Comment deleted; its replies remain.'
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        if not result:
+            return jsonify({'success': False, 'message': 'Comment not found or not yours.'}), 404
+        post_id, deleted = result
+        return jsonify({'success': True, 'message': message, 'deleted': deleted,
+                        'comment_count': get_post_by_id(post_id).comment_count})
+    if not result:
+        flash('Comment not found or not yours to delete.', 'error')
+        return redirect(request.referrer or url_for('community.home'))
+    flash(message, 'success')
+    return redirect(url_for('community.post_detail', post_id=result[0]))
+
 # Note: `/comment/<int:comment_id>/reply` is handled by the above `comment_on_post`
 # by passing `parent_comment_id` in the form.
 # The frontend will need to ensure the form for a reply includes this hidden field.
@@ -1,9 +1,10 @@
 from flask import Blueprint, request, redirect, url_for, flash, g, jsonify
 from app.db import (
-    add_or_update_rating, add_review, add_or_update_review_vote,
+    add_or_update_rating, add_review,
     get_user_rating_for_anime, get_anime_by_id, get_review_by_id # Assuming get_review_by_id exists
 )
 from app.routes.auth import login_required
+from app.vote_buffer import record_vote
 
 bp = Blueprint('ratings_reviews', __name__)
 
@@ -80,7 +81,21 @@ def vote_review(review_id):
             return redirect(url_for('anime.list_anime'))
 
 
-    if add_or_update_review_vote(g.user.id, review_id, vote_type):
+    result = record_vote('review', g.user.id, review_id, vote_type) # None if the review doesn't exist
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        if result is None:
+            return jsonify({'success': False, 'message': 'Review not found.'}), 404
+        if not result:
+            return jsonify({'success': False, 'message': 'Failed to record your vote.'}), 500
+        return jsonify({
+            'success': True,
+            'message': 'Your vote has been recorded.',
+            'upvotes': result['upvotes'],
+            'downvotes': result['downvotes'],
+            'new_vote_status': result['vote']
+        })
+
+    if result:
         flash('Your vote has been recorded.', 'success')
     else:
         flash('Failed to record your vote.', 'error')
@@ -3,7 +3,8 @@ from flask import (
 )
 from app.db import (
     find_user_by_username, get_watchlist_for_user, 
-    get_friendship_status # Added for profile page friend actions
+    get_friendship_status, # Added for profile page friend actions
+    set_user_favorite_genres
 )
 from app.routes.auth import login_required # Import the login_required decorator
 
@@ -51,28 +52,39 @@ def profile(username):
     #     user_profile_data = find_user_by_username(username) # Fetch full user data if g.user is minimal
     #     if not user_profile_data:
     #         flash("User profile not found.", "error")
-            return redirect(url_for('hello')) # Redirect to home or a generic error page
-
-        # Fetch watchlist for the user
-        # Group watchlist items by status for easier display
-        watchlist_items = get_watchlist_for_user(user_profile_data.id)
-        watchlists = {
-            'plan_to_watch': [],
-            'watching': [],
-            'completed': [],
-            'dropped': [],
-            'bookmarked': []
-        }
-        for item in watchlist_items:
-            if item.status in watchlists:
-                watchlists[item.status].append(item)
-            
-        # return render_template('user/profile.html', user_profile=user_profile_data, watchlists=watchlists)
+    #         return redirect(url_for('hello')) # Redirect to home or a generic error page
+    #
+    #     # Fetch watchlist for the user
+    #     # Group watchlist items by status for easier display
+    #     watchlist_items = get_watchlist_for_user(user_profile_data.id)
+    #     watchlists = {
+    #         'plan_to_watch': [],
+    #         'watching': [],
+    #         'completed': [],
+    #         'dropped': [],
+    #         'bookmarked': []
+    #     }
+    #     for item in watchlist_items:
+    #         if item.status in watchlists:
+    #             watchlists[item.status].append(item)
+    #
+    #     # return render_template('user/profile.html', user_profile=user_profile_data, watchlists=watchlists)
     # else:
     #     # If trying to access another user's profile or not logged in appropriately
     #     flash("You can only view your own profile.", "error")
     #     return redirect(url_for('user.profile', username=g.user.username if g.user else '')) # Redirect to own profile or login
 
+@bp.route('/favorite-genres', methods=['POST'])
+@login_required
+def favorite_genres():
+    # The home page form posts every selected genre as a repeated genre_id
+    genre_ids = request.form.getlist('genre_id', type=int)
+    if set_user_favorite_genres(g.user.id, genre_ids):
+        flash("Favourite genres saved.", "success")
+    else:
+        flash("Could not save your favourite genres.", "error")
+    return redirect(url_for('hello'))
+
 # Example of how to register this blueprint in app/__init__.py:
 # from .routes import user # Add this line in create_app
 # app.register_blueprint(user.bp) # Add this line in create_app
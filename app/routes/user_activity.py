@@ -1,10 +1,11 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, g, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, g, jsonify, current_app
 from app.db import (
     add_or_update_watchlist_item, remove_watchlist_item, get_watchlist_item_status,
     get_notifications_for_user, mark_notification_as_read, mark_all_notifications_as_read,
     get_anime_by_id, count_unread_notifications # Assuming get_anime_by_id is available
 )
 from app.routes.auth import login_required
+from app.list_import import LIST_FORMATS, LIST_IMPORT_MAX_BYTES, ListFormatError, guess_list_format, import_list
 
 bp = Blueprint('user_activity', __name__)
 
@@ -38,6 +39,54 @@ def update_watchlist(anime_id):
         else:
             return jsonify({'success': False, 'message': 'Failed to update watchlist.'}), 500
 
+# List import (ratings and watchlist from another tracker's export)
+@bp.route('/import-list', methods=['GET', 'POST'])
+@login_required
+def import_list_page():
+    if request.method == 'GET':
+        return render_template('user/import_list.html', list_formats=LIST_FORMATS, summary=None)
+
+    is_xhr = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+    # Checked before the form is parsed, so an oversized upload is never read
+    max_bytes = current_app.config.get('LIST_IMPORT_MAX_BYTES', LIST_IMPORT_MAX_BYTES)
+    if request.content_length is None or request.content_length > max_bytes:
+        error = f"That file is too large to import; the limit is {max_bytes // (1024 * 1024) or 1} MB."
+        if is_xhr:
+            return jsonify({'success': False, 'message': error}), 413
+        flash(error, 'error')
+        return render_template('user/import_list.html', list_formats=LIST_FORMATS, summary=None), 413
+
+    upload = request.files.get('list_file')
+    list_format = request.form.get('format') or (guess_list_format(upload.filename) if upload else None)
+    error = None
+    if not upload or not upload.filename:
+        error = 'Choose an export file to import.'
+    elif list_format not in LIST_FORMATS:
+        error = 'Unsupported file type. Upload an XML, JSON or CSV export.'
+    if error:
+        if is_xhr:
+            return jsonify({'success': False, 'message': error}), 400
+        flash(error, 'error')
+        return render_template('user/import_list.html', list_formats=LIST_FORMATS, summary=None), 400
+
+    try:
+        summary = import_list(g.user.id, upload.stream, list_format) # Parsed as it is read
+    except ListFormatError as e:
+        if is_xhr:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        flash(f"Couldn't read that file: {e}", 'error')
+        return render_template('user/import_list.html', list_formats=LIST_FORMATS, summary=None), 400
+
+    if summary['error']:
+        message = (f"The import stopped early. The first {summary['saved']} entries were saved "
+                   f"({summary['matched']} matched); run it again to import the rest.")
+    else:
+        message = f"Imported {summary['matched']} of {summary['entries']} titles."
+    if is_xhr:
+        return jsonify(dict(summary, success=summary['error'] is None, message=message))
+    flash(message, 'error' if summary['error'] else 'success')
+    return render_template('user/import_list.html', list_formats=LIST_FORMATS, summary=summary)
+
 # Notification routes
 @bp.route('/notifications')
 @login_required
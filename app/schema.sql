@@ -53,7 +53,9 @@ CREATE TABLE Anime (
     description TEXT,
     release_year INTEGER,
     cover_image_url TEXT,
-    average_rating REAL DEFAULT 0.0,
+    average_rating REAL DEFAULT 0.0, -- rating_sum / rating_count, kept in step with them
+    rating_sum INTEGER NOT NULL DEFAULT 0, -- Running SUM(Ratings.score), updated by delta on each rating write
+    rating_count INTEGER NOT NULL DEFAULT 0, -- Running COUNT of Ratings rows
     language TEXT, -- e.g., 'Japanese', 'English'
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP -- Handled by trigger/application logic for updates
@@ -110,6 +112,113 @@ CREATE TABLE Ratings (
 CREATE INDEX idx_ratings_user_id ON Ratings(user_id);
 CREATE INDEX idx_ratings_anime_id ON Ratings(anime_id);
 
+-- Top Charts: Bayesian-ranked anime per chart, refreshed on each rating write (see db.refresh_top_chart_entries)
+-- chart is 'top' (chart_key 0), 'year' (chart_key = release_year) or 'genre' (chart_key = genre_id)
+CREATE TABLE TopChartEntries (
+    chart TEXT NOT NULL,
+    chart_key INTEGER NOT NULL,
+    anime_id INTEGER NOT NULL,
+    score REAL NOT NULL, -- (rating_sum + m * C) / (rating_count + m), C = RatingTotals.chart_mean
+    FOREIGN KEY (anime_id) REFERENCES Anime(id) ON DELETE CASCADE,
+    PRIMARY KEY (chart, chart_key, anime_id)
+);
+
+-- Reading a chart page walks this index in order; nothing is sorted at request time
+CREATE INDEX idx_topchartentries_rank ON TopChartEntries(chart, chart_key, score DESC, anime_id);
+CREATE INDEX idx_topchartentries_anime_id ON TopChartEntries(anime_id);
+
+-- Bumped by the catalog_version_* triggers on every write to what the catalog caches hold (titles'
+-- year and language, genre and tag links); workers drop their caches when it moves (see db._catalog_cache_version)
+CREATE TABLE CatalogVersion (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT INTO CatalogVersion (id) VALUES (1);
+
+-- Catalog-wide rating totals (single row), kept by delta like Anime.rating_sum/rating_count
+CREATE TABLE RatingTotals (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    rating_sum INTEGER NOT NULL DEFAULT 0,
+    rating_count INTEGER NOT NULL DEFAULT 0,
+    -- The catalog mean every TopChartEntries score uses; `flask rebuild-top-charts` re-scores them against the live mean
+    chart_mean REAL
+);
+
+INSERT INTO RatingTotals (id) VALUES (1);
+
+-- Per-anime score distribution: how many ratings gave each score 1-10, kept by delta on rating writes
+CREATE TABLE RatingHistograms (
+    anime_id INTEGER PRIMARY KEY,
+    score_1 INTEGER NOT NULL DEFAULT 0,
+    score_2 INTEGER NOT NULL DEFAULT 0,
+    score_3 INTEGER NOT NULL DEFAULT 0,
+    score_4 INTEGER NOT NULL DEFAULT 0,
+    score_5 INTEGER NOT NULL DEFAULT 0,
+    score_6 INTEGER NOT NULL DEFAULT 0,
+    score_7 INTEGER NOT NULL DEFAULT 0,
+    score_8 INTEGER NOT NULL DEFAULT 0,
+    score_9 INTEGER NOT NULL DEFAULT 0,
+    score_10 INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (anime_id) REFERENCES Anime(id) ON DELETE CASCADE
+);
+
+-- Trending: weighted activity (ratings, reviews, watchlist adds) per anime per hour
+CREATE TABLE AnimeActivityBuckets (
+    anime_id INTEGER NOT NULL,
+    bucket INTEGER NOT NULL, -- Unix time // 3600
+    score REAL NOT NULL DEFAULT 0, -- Sum of event weights in this hour (see db.TRENDING_EVENT_WEIGHTS)
+    FOREIGN KEY (anime_id) REFERENCES Anime(id) ON DELETE CASCADE,
+    PRIMARY KEY (anime_id, bucket)
+);
+
+-- Covers the trending window scan and pruning of expired buckets
+CREATE INDEX idx_animeactivitybuckets_bucket ON AnimeActivityBuckets(bucket, anime_id, score);
+
+-- Item-item recommender: top-K most similar anime per anime, built offline by `flask build-recommendations`
+CREATE TABLE AnimeNeighbors (
+    anime_id INTEGER NOT NULL,
+    neighbor_id INTEGER NOT NULL,
+    similarity REAL NOT NULL, -- Shrunk adjusted-cosine similarity of the two anime's rating vectors
+    FOREIGN KEY (anime_id) REFERENCES Anime(id) ON DELETE CASCADE,
+    FOREIGN KEY (neighbor_id) REFERENCES Anime(id) ON DELETE CASCADE,
+    PRIMARY KEY (anime_id, neighbor_id)
+);
+
+CREATE INDEX idx_animeneighbors_neighbor_id ON AnimeNeighbors(neighbor_id);
+
+-- When the recommender last read Ratings (single row); incremental builds pick up ratings made after it
+CREATE TABLE RecommenderState (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    last_built_at TIMESTAMP
+);
+
+INSERT INTO RecommenderState (id) VALUES (1);
+
+-- "More like this": MinHash LSH band buckets over each anime's genres and tags (see db._refresh_similar_anime)
+CREATE TABLE AnimeLshBuckets (
+    band INTEGER NOT NULL,
+    bucket INTEGER NOT NULL, -- Hash of the band's slice of the MinHash signature
+    anime_id INTEGER NOT NULL,
+    FOREIGN KEY (anime_id) REFERENCES Anime(id) ON DELETE CASCADE,
+    PRIMARY KEY (band, bucket, anime_id)
+);
+
+CREATE INDEX idx_animelshbuckets_anime_id ON AnimeLshBuckets(anime_id);
+
+-- Top genre/tag Jaccard neighbours per anime, kept up to date as genres and tags are linked
+CREATE TABLE SimilarAnime (
+    anime_id INTEGER NOT NULL,
+    similar_id INTEGER NOT NULL,
+    similarity REAL NOT NULL, -- Exact Jaccard similarity of the two anime's genre/tag sets
+    FOREIGN KEY (anime_id) REFERENCES Anime(id) ON DELETE CASCADE,
+    FOREIGN KEY (similar_id) REFERENCES Anime(id) ON DELETE CASCADE,
+    PRIMARY KEY (anime_id, similar_id)
+);
+
+CREATE INDEX idx_similaranime_rank ON SimilarAnime(anime_id, similarity DESC, similar_id);
+CREATE INDEX idx_similaranime_similar_id ON SimilarAnime(similar_id);
+
 -- Reviews Table
 CREATE TABLE Reviews (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -120,6 +229,8 @@ CREATE TABLE Reviews (
     is_spoiler BOOLEAN DEFAULT FALSE,
     upvotes INTEGER DEFAULT 0,
     downvotes INTEGER DEFAULT 0,
+    helpfulness REAL NOT NULL DEFAULT 0, -- Wilson score lower bound of upvotes / (upvotes + downvotes)
+    rating_score INTEGER NOT NULL DEFAULT 0, -- Score of the linked rating (0 if none), copied so "highest rated" is indexable
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, -- Handled by trigger/application logic for updates
     FOREIGN KEY (user_id) REFERENCES Users(id),
@@ -128,7 +239,10 @@ CREATE TABLE Reviews (
 );
 
 CREATE INDEX idx_reviews_user_id ON Reviews(user_id);
-CREATE INDEX idx_reviews_anime_id ON Reviews(anime_id);
+-- Review pages per sort mode; both also serve plain lookups by anime_id
+CREATE INDEX idx_reviews_anime_id_created_at ON Reviews(anime_id, created_at);
+CREATE INDEX idx_reviews_anime_id_helpfulness ON Reviews(anime_id, helpfulness);
+CREATE INDEX idx_reviews_anime_id_rating_score ON Reviews(anime_id, rating_score);
 CREATE INDEX idx_reviews_rating_id ON Reviews(rating_id);
 
 -- ReviewVotes Table
@@ -161,6 +275,7 @@ CREATE TABLE WatchlistItems (
 CREATE INDEX idx_watchlistitems_user_id ON WatchlistItems(user_id);
 CREATE INDEX idx_watchlistitems_anime_id ON WatchlistItems(anime_id);
 CREATE INDEX idx_watchlistitems_status ON WatchlistItems(status);
+CREATE INDEX idx_watchlistitems_user_id_added_at ON WatchlistItems(user_id, added_at); -- Latest changes, for the home feed
 
 
 -- Subcommunities Table
@@ -186,14 +301,27 @@ CREATE TABLE CommunityPosts (
     post_type TEXT NOT NULL CHECK (post_type IN ('discussion', 'meme', 'theory', 'poll_question')), -- Enum/String
     upvotes INTEGER DEFAULT 0,
     downvotes INTEGER DEFAULT 0,
+    comment_count INTEGER NOT NULL DEFAULT 0, -- Running COUNT of Comments rows, updated by delta on comment writes
+    hot_score REAL NOT NULL DEFAULT 0, -- Time-decayed vote score for the "hot" feed, rewritten on every vote
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, -- Handled by trigger/application logic for updates
     FOREIGN KEY (user_id) REFERENCES Users(id),
     FOREIGN KEY (subcommunity_id) REFERENCES Subcommunities(id)
 );
 
-CREATE INDEX idx_communityposts_user_id ON CommunityPosts(user_id);
-CREATE INDEX idx_communityposts_subcommunity_id ON CommunityPosts(subcommunity_id);
+-- A user's posts in each sort mode (get_posts_by_user)
+CREATE INDEX idx_communityposts_user_id_created_at ON CommunityPosts(user_id, created_at, upvotes, downvotes);
+CREATE INDEX idx_communityposts_user_id_hot_score ON CommunityPosts(user_id, hot_score);
+CREATE INDEX idx_communityposts_user_id_net_votes ON CommunityPosts(user_id, (upvotes - downvotes));
+-- Feed orders: each sort mode reads its index in order (the composites also serve subcommunity lookups).
+-- The created_at indexes carry the vote counts so 'top' within a window can rank the window's posts
+-- from the index alone; that mode still reads and sorts the whole window (see _get_posts_query)
+CREATE INDEX idx_communityposts_subcommunity_id_hot_score ON CommunityPosts(subcommunity_id, hot_score);
+CREATE INDEX idx_communityposts_subcommunity_id_created_at ON CommunityPosts(subcommunity_id, created_at, upvotes, downvotes);
+CREATE INDEX idx_communityposts_hot_score ON CommunityPosts(hot_score);
+CREATE INDEX idx_communityposts_created_at ON CommunityPosts(created_at, upvotes, downvotes);
+CREATE INDEX idx_communityposts_subcommunity_id_net_votes ON CommunityPosts(subcommunity_id, (upvotes - downvotes));
+CREATE INDEX idx_communityposts_net_votes ON CommunityPosts((upvotes - downvotes));
 CREATE INDEX idx_communityposts_title ON CommunityPosts(title);
 CREATE INDEX idx_communityposts_post_type ON CommunityPosts(post_type);
 
@@ -219,6 +347,12 @@ CREATE TABLE Comments (
     post_id INTEGER NOT NULL,
     parent_comment_id INTEGER, -- Nullable for top-level comments
     text_content TEXT NOT NULL,
+    -- Materialized path: every ancestor's id and then this comment's, each as '%010d/'. Sorting by it
+    -- lists a thread depth-first with siblings oldest first; a subtree is the range [path, path || '~')
+    path TEXT NOT NULL DEFAULT '',
+    depth INTEGER NOT NULL DEFAULT 0, -- 0 for top-level comments
+    reply_count INTEGER NOT NULL DEFAULT 0, -- Running COUNT of direct replies, updated by delta on comment writes
+    is_deleted BOOLEAN NOT NULL DEFAULT FALSE, -- Deleted while it had replies: text blanked, node kept for the thread
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES Users(id),
     FOREIGN KEY (post_id) REFERENCES CommunityPosts(id),
@@ -226,7 +360,10 @@ CREATE TABLE Comments (
 );
 
 CREATE INDEX idx_comments_user_id ON Comments(user_id);
-CREATE INDEX idx_comments_post_id ON Comments(post_id);
+-- A page of one comment's replies (or a post's top-level comments) in id order; also serves post_id lookups
+CREATE INDEX idx_comments_post_id_parent_comment_id ON Comments(post_id, parent_comment_id);
+-- The subtrees beneath a page of comments, depth-first
+CREATE INDEX idx_comments_post_id_path ON Comments(post_id, path);
 CREATE INDEX idx_comments_parent_comment_id ON Comments(parent_comment_id);
 
 -- PollOptions Table
@@ -352,6 +489,90 @@ BEGIN
     UPDATE Anime SET updated_at = CURRENT_TIMESTAMP WHERE id = OLD.id;
 END;
 
+-- Full-text search over anime titles and descriptions.
+-- External-content FTS5 table: the text lives in Anime, the index is kept in sync by the triggers below.
+CREATE VIRTUAL TABLE AnimeSearch USING fts5(
+    title,
+    description,
+    content='Anime',
+    content_rowid='id',
+    tokenize='porter unicode61 remove_diacritics 2' -- stemming lets 'titan' match 'Titans' without slow prefix queries
+);
+
+-- Rank title matches above description matches (bm25 column weights)
+INSERT INTO AnimeSearch(AnimeSearch, rank) VALUES ('rank', 'bm25(10.0, 1.0)');
+
+CREATE TRIGGER anime_search_after_insert
+AFTER INSERT ON Anime
+FOR EACH ROW
+BEGIN
+    INSERT INTO AnimeSearch(rowid, title, description) VALUES (NEW.id, NEW.title, NEW.description);
+END;
+
+CREATE TRIGGER anime_search_after_delete
+AFTER DELETE ON Anime
+FOR EACH ROW
+BEGIN
+    INSERT INTO AnimeSearch(AnimeSearch, rowid, title, description) VALUES ('delete', OLD.id, OLD.title, OLD.description);
+END;
+
+CREATE TRIGGER anime_search_after_update
+AFTER UPDATE OF title, description ON Anime
+FOR EACH ROW
+BEGIN
+    INSERT INTO AnimeSearch(AnimeSearch, rowid, title, description) VALUES ('delete', OLD.id, OLD.title, OLD.description);
+    INSERT INTO AnimeSearch(rowid, title, description) VALUES (NEW.id, NEW.title, NEW.description);
+END;
+
+CREATE TRIGGER catalog_version_anime_insert
+AFTER INSERT ON Anime
+FOR EACH ROW
+BEGIN
+    UPDATE CatalogVersion SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER catalog_version_anime_delete
+AFTER DELETE ON Anime
+FOR EACH ROW
+BEGIN
+    UPDATE CatalogVersion SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER catalog_version_anime_update
+AFTER UPDATE OF release_year, language ON Anime
+FOR EACH ROW
+BEGIN
+    UPDATE CatalogVersion SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER catalog_version_animegenres_insert
+AFTER INSERT ON AnimeGenres
+FOR EACH ROW
+BEGIN
+    UPDATE CatalogVersion SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER catalog_version_animegenres_delete
+AFTER DELETE ON AnimeGenres
+FOR EACH ROW
+BEGIN
+    UPDATE CatalogVersion SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER catalog_version_animetags_insert
+AFTER INSERT ON AnimeTags
+FOR EACH ROW
+BEGIN
+    UPDATE CatalogVersion SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER catalog_version_animetags_delete
+AFTER DELETE ON AnimeTags
+FOR EACH ROW
+BEGIN
+    UPDATE CatalogVersion SET version = version + 1 WHERE id = 1;
+END;
+
 CREATE TRIGGER update_reviews_updated_at
 AFTER UPDATE ON Reviews
 FOR EACH ROW
@@ -259,7 +259,7 @@ document.addEventListener('DOMContentLoaded', function () {
                 
                 let url = this.action; // Get URL from form action attribute
                 if (!url) { // Fallback if action is not set (though it should be)
-                    if (reviewId) url = `/ratings_reviews/review/${reviewId}/vote`;
+                    if (reviewId) url = `/review/${reviewId}/vote`;
                     else if (postId) url = `/community/post/${postId}/vote`; 
                     // else if (commentId) url = `/community/comment/${commentId}/vote`; // Backend route needed
                     else {
@@ -327,6 +327,53 @@ document.addEventListener('DOMContentLoaded', function () {
     attachReplyEventListeners(); // Initial attachment
 
 
+    // --- Infinite Scroll / "Load More" for cursor-paginated lists ---
+    // A .load-more-link points at a JSON endpoint (data-next-url) returning { html, next_url }.
+    // The rendered html is appended to the element whose ID is in data-target.
+    // Links with data-auto-load="false" (e.g. "Load more replies") only load when clicked.
+    function attachLoadMoreListeners(parentElement = document) {
+        parentElement.querySelectorAll('.load-more-link').forEach(link => {
+            if (link.dataset.loadMoreAttached) return;
+            link.dataset.loadMoreAttached = true;
+            let loading = false;
+
+            async function loadNextPage(event) {
+                if (event) event.preventDefault();
+                if (loading || !link.dataset.nextUrl) return;
+                const target = document.getElementById(link.dataset.target);
+                if (!target) return;
+                loading = true;
+                try {
+                    const data = await fetchJSON(link.dataset.nextUrl);
+                    target.insertAdjacentHTML('beforeend', data.html);
+                    attachVoteEventListeners(target);
+                    attachReplyEventListeners(target);
+                    attachLoadMoreListeners(target); // e.g. "Load more replies" inside loaded comments
+                    if (data.next_url) {
+                        link.dataset.nextUrl = data.next_url;
+                    } else {
+                        link.remove(); // Last page reached
+                        if (observer) observer.disconnect();
+                    }
+                } catch (error) {
+                    showFlashMessage(`Error: ${error.message}`, 'error');
+                    console.error('Load more error:', error);
+                } finally {
+                    loading = false;
+                }
+            }
+
+            link.addEventListener('click', loadNextPage);
+            // Load the next page automatically when the link scrolls into view
+            const observer = ('IntersectionObserver' in window && link.dataset.autoLoad !== 'false') ? new IntersectionObserver(entries => {
+                if (entries.some(entry => entry.isIntersecting)) loadNextPage();
+            }, { rootMargin: '200px' }) : null;
+            if (observer) observer.observe(link);
+        });
+    }
+    attachLoadMoreListeners();
+
+
     // --- Watchlist AJAX (from previous iteration, kept for completeness) ---
     // ... (existing watchlist AJAX code, ensure it uses showFlashMessage and fetchJSON if refactoring)
     // For brevity, I'm omitting the full watchlist code here but it should be retained and potentially refactored.
@@ -0,0 +1,235 @@
+"""
+Write-behind buffering for review and post votes.
+
+With VOTE_WRITE_BEHIND enabled, vote clicks are queued in memory and a background thread applies
+them with apply_vote_batch: every VOTE_FLUSH_SECONDS, or as soon as VOTE_FLUSH_MAX_PENDING clicks
+are waiting. Each click still gets its own ReviewVotes/PostVotes row, but each item's counters are
+updated once per batch, and a spike costs one write transaction per batch instead of one per click.
+The queue is flushed when the interpreter exits, so a graceful shutdown doesn't lose votes.
+A click whose write fails is retried one per transaction, ahead of newer clicks, and dropped (and
+logged) after VOTE_FLUSH_MAX_ATTEMPTS failed attempts, so one bad click can't hold up the rest.
+With it disabled (the default), record_vote writes synchronously.
+The flush metrics are served at /metrics/vote-buffer to logged-in users, and only in debug mode or
+with VOTE_BUFFER_METRICS set; put that route behind an internal network in production.
+"""
+import atexit
+import threading
+import time
+from flask import current_app, jsonify
+from app.db import (
+    add_or_update_review_vote, add_or_update_post_vote, apply_vote_batch, get_vote_state, vote_click_result
+)
+from app.routes.auth import login_required
+
+DEFAULT_FLUSH_SECONDS = 1.0
+DEFAULT_FLUSH_MAX_PENDING = 500
+DEFAULT_FLUSH_MAX_ATTEMPTS = 5
+
+class VoteBuffer:
+    def __init__(self, app):
+        self.app = app
+        self.flush_seconds = app.config.get('VOTE_FLUSH_SECONDS', DEFAULT_FLUSH_SECONDS)
+        self.max_pending = app.config.get('VOTE_FLUSH_MAX_PENDING', DEFAULT_FLUSH_MAX_PENDING)
+        self.max_attempts = app.config.get('VOTE_FLUSH_MAX_ATTEMPTS', DEFAULT_FLUSH_MAX_ATTEMPTS)
+        self._lock = threading.Lock() # Guards the queue, pending state and metrics; never held across a query
+        self._flush_lock = threading.Lock() # One flush at a time, so batches land in click order
+        self._wake = threading.Event()
+        # (kind, user_id, item_id, vote_type, queued_at, upvote_delta, downvote_delta, failed attempts)
+        self._queue = []
+        self._flush_generation = 0 # Odd while a batch is being written
+        # What this process's queued clicks will change once flushed, so voters see their own votes
+        self._pending_votes = {} # (kind, user_id, item_id) -> [vote after the last queued click, queued clicks]
+        self._pending_deltas = {} # (kind, item_id) -> [upvotes delta, downvotes delta, queued clicks]
+        self._thread = None
+        self._closed = False
+        self.metrics = {
+            'flushes': 0,
+            'failed_flushes': 0,
+            'flushed_votes': 0,
+            'dropped_votes': 0, # Given up on after max_attempts failed writes
+            'last_flush_at': None,
+            'last_flush_ms': None,
+            'last_batch_size': 0,
+            'max_lag_seconds': 0.0, # Longest a click has waited in the queue
+        }
+        atexit.register(self.close)
+
+    def record(self, kind, user_id, item_id, vote_type):
+        """
+        Queues a vote click. Returns {'upvotes', 'downvotes', 'vote'} for the item as they will be
+        once the click is flushed, or None if the item doesn't exist. Must run in an app context.
+        """
+        while True:
+            with self._lock:
+                generation = self._flush_generation
+            if generation % 2: # A batch is being written, so the stored state may or may not include it
+                with self._flush_lock: # Wait for it to land
+                    pass
+                continue
+            state = get_vote_state(kind, user_id, item_id) # Stored counts and vote, in one query, unlocked
+            if state is None:
+                return None
+            with self._lock:
+                if self._flush_generation != generation: # A flush began or landed since the read
+                    continue
+                counts = state[:2]
+                pending_vote = self._pending_votes.get((kind, user_id, item_id))
+                old_vote = pending_vote[0] if pending_vote else state[2]
+                new_vote, upvote_delta, downvote_delta = vote_click_result(old_vote, vote_type)
+
+                self._queue.append((kind, user_id, item_id, vote_type, time.time(), upvote_delta, downvote_delta, 0))
+                pending_vote = self._pending_votes.setdefault((kind, user_id, item_id), [None, 0])
+                pending_vote[0] = new_vote
+                pending_vote[1] += 1
+                pending_deltas = self._pending_deltas.setdefault((kind, item_id), [0, 0, 0])
+                pending_deltas[0] += upvote_delta
+                pending_deltas[1] += downvote_delta
+                pending_deltas[2] += 1
+                queued = len(self._queue)
+                result = {'upvotes': counts[0] + pending_deltas[0], 'downvotes': counts[1] + pending_deltas[1],
+                          'vote': new_vote}
+            break
+
+        self._ensure_thread()
+        if queued >= self.max_pending:
+            self._wake.set()
+        return result
+
+    def flush(self):
+        """
+        Writes the queued clicks: those that failed before one per transaction, in order, then the
+        rest in one transaction. Clicks that fail go back to the front of the queue, and are dropped
+        after max_attempts failures. The queue is only locked to take the batch and to settle it,
+        never while writing. Returns the number of clicks written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._queue = self._queue, []
+                if not batch:
+                    return 0
+                self._flush_generation += 1
+            started = time.time()
+            written = 0 # batch[:written] landed; batch[written] failed, if failed
+            failed = False
+            try:
+                with self.app.app_context():
+                    while written < len(batch) and batch[written][7]: # Retries, one click at a time
+                        if not apply_vote_batch([batch[written][:4]]):
+                            failed = True
+                            break
+                        written += 1
+                    if not failed and written < len(batch):
+                        failed = not apply_vote_batch([click[:4] for click in batch[written:]])
+                        if not failed:
+                            written = len(batch)
+            except Exception: # Not a database error; count it as a failed attempt all the same
+                self.app.logger.exception("Vote buffer flush failed")
+                failed = True
+
+            with self._lock:
+                self._flush_generation += 1
+                self._settle(batch[:written])
+                if failed:
+                    self.metrics['failed_flushes'] += 1
+                if failed and written < len(batch): # Otherwise it failed after every click had landed
+                    # A lone retry failed: just that click; a batch failed: every click in it
+                    failed_clicks = batch[written:written + 1] if batch[written][7] else batch[written:]
+                    requeue, dropped = [], []
+                    for click in failed_clicks:
+                        click = click[:7] + (click[7] + 1,)
+                        (dropped if click[7] >= self.max_attempts else requeue).append(click)
+                    if dropped:
+                        self._settle(dropped)
+                        self.metrics['dropped_votes'] += len(dropped)
+                        self.app.logger.error("Vote buffer dropped %d click(s) after %d failed attempts: %r",
+                                              len(dropped), self.max_attempts, [click[:4] for click in dropped])
+                    self._queue[:0] = requeue + batch[written + len(failed_clicks):]
+                if written:
+                    finished = time.time()
+                    self.metrics['flushes'] += 1
+                    self.metrics['flushed_votes'] += written
+                    self.metrics['last_flush_at'] = finished
+                    self.metrics['last_flush_ms'] = (finished - started) * 1000
+                    self.metrics['last_batch_size'] = written
+                    self.metrics['max_lag_seconds'] = max(self.metrics['max_lag_seconds'], finished - batch[0][4])
+            return written
+
+    def _settle(self, clicks):
+        # Takes written or dropped clicks out of the pending state; call with self._lock held
+        for kind, user_id, item_id, _, _, upvote_delta, downvote_delta, _ in clicks:
+            pending_vote = self._pending_votes[(kind, user_id, item_id)]
+            pending_vote[1] -= 1
+            if not pending_vote[1]:
+                del self._pending_votes[(kind, user_id, item_id)]
+            pending_deltas = self._pending_deltas[(kind, item_id)]
+            pending_deltas[0] -= upvote_delta
+            pending_deltas[1] -= downvote_delta
+            pending_deltas[2] -= 1
+            if not pending_deltas[2]:
+                del self._pending_deltas[(kind, item_id)]
+
+    def stats(self):
+        """Flush metrics plus the current queue depth and how long its oldest click has waited."""
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['pending_votes'] = len(self._queue)
+            stats['lag_seconds'] = time.time() - self._queue[0][4] if self._queue else 0.0
+        return stats
+
+    def close(self):
+        """Stops the flush thread and writes whatever is still queued."""
+        self._closed = True
+        self._wake.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=self.flush_seconds + 5)
+        while self.flush(): # Clicks queued by requests still finishing
+            pass
+        with self._lock:
+            unwritten = len(self._queue)
+        if unwritten:
+            self.app.logger.error("Vote buffer closed with %d click(s) unwritten", unwritten)
+
+    def _ensure_thread(self):
+        # Started lazily so pre-forking servers get a thread in each worker rather than the master
+        if self._closed or (self._thread and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='vote-buffer-flush', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception: # Keep flushing; flush() itself requeues clicks whose write failed
+                self.app.logger.exception("Vote buffer flush failed")
+
+def record_vote(kind, user_id, item_id, vote_type):
+    """
+    Records a vote click on a review or post (kind 'review' or 'post'), through the write-behind
+    buffer when it's enabled. Returns {'upvotes', 'downvotes', 'vote'} for the item after the
+    click, None if the item doesn't exist, or False if the write failed.
+    """
+    buffer = current_app.extensions.get('vote_buffer')
+    if buffer is not None:
+        return buffer.record(kind, user_id, item_id, vote_type)
+
+    # The write reads the result back from its own transaction, so this is the only round trip
+    write = add_or_update_review_vote if kind == 'review' else add_or_update_post_vote
+    return write(user_id, item_id, vote_type)
+
+@login_required
+def vote_buffer_stats():
+    buffer = current_app.extensions.get('vote_buffer')
+    if buffer is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(buffer.stats(), enabled=True))
+
+def init_app(app):
+    if app.config.get('VOTE_WRITE_BEHIND'):
+        app.extensions['vote_buffer'] = VoteBuffer(app)
+    if app.debug or app.config.get('VOTE_BUFFER_METRICS'):
+        app.add_url_rule('/metrics/vote-buffer', 'vote_buffer_stats', vote_buffer_stats)
@@ -1,6 +1,14 @@
+import sqlite3
+import time
 import pytest
 from flask import url_for
-from app.db import get_anime_by_id, get_all_anime, get_random_anime, get_db
+from app.db import (
+    get_anime_by_id, get_all_anime, get_random_anime, get_random_anime_id, get_anime_facets, anime_page_cursor,
+    search_anime, add_anime, get_db, encode_cursor,
+    add_or_update_rating, add_review, add_or_update_watchlist_item, get_trending_anime, refresh_trending_anime,
+    get_similar_anime, rebuild_similar_anime, link_anime_to_genre, link_anime_to_tag,
+    build_description_index, get_similar_by_description, _description_index_maps, _refresh_similar_anime
+)
 
 def test_list_anime_page(client, seeded_database):
     """Test the main anime listing page."""
@@ -149,6 +157,253 @@ def test_db_get_random_anime(app, seeded_database):
         all_titles = [a.title for a in get_all_anime()]
         assert random_anime.title in all_titles
 
+def test_db_get_random_anime_with_filters(app, seeded_database):
+    with app.app_context():
+        db = get_db()
+        mecha_id = db.execute("SELECT id FROM Genres WHERE name = 'Mecha'").fetchone()['id']
+        code_geass_id = db.execute("SELECT id FROM Anime WHERE title = 'Code Geass: Lelouch of the Rebellion'").fetchone()['id']
+        for _ in range(5):
+            assert get_random_anime_id({'genre_ids': [mecha_id], 'language': 'Japanese'}) == code_geass_id
+        assert get_random_anime_id({'language': 'Korean'}) is None
+
+        # Catalog writes refresh the cached id pool
+        new_id = add_anime(title="Mecha Sequel", language="Korean", genre_names=["Mecha"])
+        assert get_random_anime_id({'genre_ids': [mecha_id], 'language': 'Korean'}) == new_id
+
+def test_surprise_me_with_filters(client, app, seeded_database):
+    with app.app_context():
+        mecha_id = get_db().execute("SELECT id FROM Genres WHERE name = 'Mecha'").fetchone()['id']
+        code_geass_id = get_db().execute("SELECT id FROM Anime WHERE title = 'Code Geass: Lelouch of the Rebellion'").fetchone()['id']
+    response = client.get(url_for('anime.surprise_me', genre_id=mecha_id))
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith(url_for('anime.detail', anime_id=code_geass_id))
+
+def test_db_get_all_anime_batches_taxonomy(app, seeded_database):
+    with app.app_context():
+        statements = []
+        get_db().set_trace_callback(statements.append)
+        all_anime = get_all_anime()
+        get_db().set_trace_callback(None)
+
+        # One list query plus one batched query each for genres and tags
+        assert len(statements) == 3
+        k_on = next(a for a in all_anime if a.title == "K-On!")
+        assert any(g.name == "Slice of Life" for g in k_on.genres)
+        assert any(t.name == "School Life" for t in k_on.tags)
+
+def test_db_get_anime_facets(app, seeded_database):
+    with app.app_context():
+        facets = get_anime_facets()
+        assert {'value': 'Japanese', 'count': 4} in facets['languages']
+        assert [f['value'] for f in facets['years']] == [2016, 2013, 2009, 2006]
+        action = next(f for f in facets['genres'] if f['name'] == 'Action')
+        assert action['count'] == 2
+
+        # Counts respect the other applied filters, but not the facet's own filter
+        filtered = get_anime_facets({'genre_id': action['id'], 'release_year': 2013})
+        assert filtered['languages'] == [{'value': 'Japanese', 'count': 1}]
+        assert [f['value'] for f in filtered['years']] == [2013, 2006]
+        assert 'Romance' not in [f['name'] for f in filtered['genres']] # Only values with matches are listed
+
+        # Cached counts are invalidated when the catalog changes
+        bebop_id = add_anime("Cowboy Bebop", release_year=1998, language="Japanese", genre_names=["Action"])
+        assert {'value': 'Japanese', 'count': 5} in get_anime_facets()['languages']
+
+        # ...by another worker's connection too, once it commits
+        other = sqlite3.connect(app.config['DATABASE'])
+        other.execute("UPDATE Anime SET language = 'English' WHERE id = ?", (bebop_id,))
+        other.commit()
+        other.close()
+        assert {'value': 'English', 'count': 1} in get_anime_facets()['languages']
+
+        # Uncommitted links are neither cached nor hidden by the cache
+        romance_id = next(f['id'] for f in get_anime_facets()['genres'] if f['name'] == 'Romance')
+        link_anime_to_genre(bebop_id, romance_id, refresh_similar=False)
+        assert {'value': 'English', 'count': 1} in get_anime_facets({'genre_id': romance_id})['languages']
+        get_db().rollback()
+        assert {'value': 'English', 'count': 1} not in get_anime_facets({'genre_id': romance_id})['languages']
+
+def test_db_get_all_anime_keyset_pages(app, seeded_database):
+    with app.app_context():
+        everything = [a.title for a in get_all_anime()]
+        first_page = get_all_anime(limit=2)
+        second_page = get_all_anime(limit=2, cursor=anime_page_cursor(first_page[-1]))
+        assert [a.title for a in first_page + second_page] == everything
+        assert get_all_anime(limit=2, cursor=anime_page_cursor(second_page[-1])) == []
+
+def test_list_anime_json_pagination(client, seeded_database):
+    response = client.get(url_for('anime.list_anime_json', limit=3))
+    assert response.status_code == 200
+    data = response.get_json()
+    assert len(data['anime']) == 3
+    assert data['next_cursor'] is not None
+    assert b"View Details" in data['html'].encode()
+
+    response_next = client.get(data['next_url'])
+    data_next = response_next.get_json()
+    assert [a['title'] for a in data_next['anime']] == ["Your Name."]
+    assert data_next['next_cursor'] is None
+
+def test_malformed_cursor_starts_from_first_page(client, seeded_database):
+    first_page = client.get(url_for('anime.list_anime_json', limit=3)).get_json()['anime']
+    for cursor in ["not base64!", "YWJj", encode_cursor({'title': "K-On!"}), encode_cursor([["K-On!"], 1]),
+                   encode_cursor(["K-On!", 1, 2]), encode_cursor([0.5, 1, "rank"])]:
+        response = client.get(url_for('anime.list_anime_json', limit=3, cursor=cursor))
+        assert response.status_code == 200 and response.get_json()['anime'] == first_page
+        assert client.get(url_for('anime.top_chart', cursor=cursor)).status_code == 200
+        assert client.get(url_for('anime.search', q="titan", cursor=cursor)).status_code == 200
+
+def test_db_get_all_anime_multi_filters(app, seeded_database):
+    with app.app_context():
+        db = get_db()
+        genre_ids = {row['name']: row['id'] for row in db.execute("SELECT id, name FROM Genres")}
+        mecha_tag_id = db.execute("SELECT id FROM Tags WHERE name = 'Mecha'").fetchone()['id']
+
+        # Tag filters match on the tag itself, not on a genre that happens to share its id
+        assert [a.title for a in get_all_anime({'tag_ids': [mecha_tag_id]})] == ["Code Geass: Lelouch of the Rebellion"]
+
+        action_fantasy = [genre_ids['Action'], genre_ids['Fantasy']]
+        assert [a.title for a in get_all_anime({'genre_ids': action_fantasy})] == ["Attack on Titan"]
+        assert [a.title for a in get_all_anime({'genre_ids': action_fantasy, 'genre_mode': 'any'})] == \
+            ["Attack on Titan", "Code Geass: Lelouch of the Rebellion", "Your Name."]
+
+        assert [a.title for a in get_all_anime({'year_min': 2009, 'year_max': 2013})] == ["Attack on Titan", "K-On!"]
+
+def test_list_anime_multi_genre_filter(client, app, seeded_database):
+    with app.app_context():
+        genre_ids = [row['id'] for row in get_db().execute("SELECT id FROM Genres WHERE name IN ('Action', 'Fantasy')")]
+    response = client.get(url_for('anime.list_anime', genre_id=genre_ids, genre_mode='all'))
+    assert response.status_code == 200
+    assert b"Attack on Titan" in response.data
+    assert b"K-On!" not in response.data
+
+def test_db_search_anime(app, seeded_database):
+    with app.app_context():
+        results, next_cursor = search_anime("titans")
+        assert [a.title for a in results] == ["Attack on Titan"]
+        assert "<mark>Titan</mark>" in results[0].title_highlight
+        assert next_cursor is None
+
+        # FTS syntax in user input is treated as plain text
+        assert search_anime('"(*') == ([], None)
+        assert search_anime('NEAR(titan') == ([], None) # Searched as a phrase, not the NEAR operator
+
+        # The index follows title updates through the triggers
+        db = get_db()
+        db.execute("UPDATE Anime SET title = 'Shingeki no Kyojin' WHERE title = 'Attack on Titan'")
+        db.commit()
+        assert [a.title for a in search_anime("kyojin")[0]] == ["Shingeki no Kyojin"]
+
+def test_search_page(client, seeded_database):
+    response = client.get(url_for('anime.search', q='magical'))
+    assert response.status_code == 200
+    assert b"Your Name." in response.data
+    assert b"<mark>magical</mark>" in response.data
+
+    response_json = client.get(url_for('anime.search', q='magical'), headers={'X-Requested-With': 'XMLHttpRequest'})
+    assert response_json.get_json()['results'][0]['title'] == "Your Name."
+
+def test_trending_anime_from_activity(client, runner, app, seeded_database, registered_user1):
+    with app.app_context():
+        db = get_db()
+        user_id = db.execute("SELECT id FROM Users WHERE username = ?", (registered_user1['username'],)).fetchone()['id']
+        anime_ids = {row['title']: row['id'] for row in db.execute("SELECT id, title FROM Anime")}
+
+        add_or_update_rating(user_id, anime_ids["Attack on Titan"], 8)
+        add_review(user_id, anime_ids["K-On!"], "So relaxing.")
+        add_or_update_watchlist_item(user_id, anime_ids["K-On!"], 'watching')
+        add_or_update_watchlist_item(user_id, anime_ids["K-On!"], 'watching') # Unchanged status isn't counted
+
+        # Older activity decays; activity outside the window is dropped entirely
+        current_bucket = int(time.time() // 3600)
+        db.execute("INSERT INTO AnimeActivityBuckets (anime_id, bucket, score) VALUES (?, ?, ?)",
+                   (anime_ids["Your Name."], current_bucket - 96, 10.0)) # Two half-lives old: counts 2.5
+        db.execute("INSERT INTO AnimeActivityBuckets (anime_id, bucket, score) VALUES (?, ?, ?)",
+                   (anime_ids["Code Geass: Lelouch of the Rebellion"], current_bucket - 8 * 24, 100.0))
+        db.commit()
+
+        top = refresh_trending_anime()
+        assert [anime_id for anime_id, _ in top] == [anime_ids["K-On!"], anime_ids["Your Name."], anime_ids["Attack on Titan"]]
+        assert top[0][1] == pytest.approx(5.0)
+        assert top[1][1] == pytest.approx(2.5)
+
+        trending = get_trending_anime(limit=2)
+        assert [a.title for a in trending] == ["K-On!", "Your Name."]
+
+    response = client.get(url_for('anime.list_anime'))
+    assert b"Trending this week" in response.data
+    data = client.get(url_for('anime.trending_json', limit=1)).get_json()
+    assert [a['title'] for a in data['anime']] == ["K-On!"]
+    with app.app_context():
+        db = get_db()
+        # GETs only read; stale buckets wait for the cron command
+        assert db.execute("SELECT COUNT(*) FROM AnimeActivityBuckets WHERE bucket < ?",
+                          (current_bucket - 7 * 24,)).fetchone()[0] == 1
+    result = runner.invoke(args=['prune-trending-activity'])
+    assert 'Pruned 1 activity bucket(s).' in result.output
+
+def test_similar_anime(client, app, seeded_database, monkeypatch):
+    with app.app_context():
+        db = get_db()
+        anime_ids = {row['title']: row['id'] for row in db.execute("SELECT id, title FROM Anime")}
+        code_geass_id = anime_ids["Code Geass: Lelouch of the Rebellion"]
+
+        similar = get_similar_anime(code_geass_id)
+        assert [a.title for a in similar] == ["Attack on Titan", "Your Name."]
+        assert similar[0].similarity == pytest.approx(3 / 10) # Action, Drama, Shounen shared of 10 genres/tags
+
+        # Linking genres/tags refreshes the lists on both sides
+        for genre in db.execute("SELECT id FROM Genres WHERE name IN ('Action', 'Sci-Fi', 'Drama', 'Mecha')").fetchall():
+            link_anime_to_genre(anime_ids["K-On!"], genre['id'])
+        link_anime_to_tag(anime_ids["K-On!"], db.execute("SELECT id FROM Tags WHERE name = 'Mecha'").fetchone()['id'])
+        db.commit()
+        incremental = [(a.title, a.similarity) for a in get_similar_anime(code_geass_id)]
+        assert incremental[0] == ("K-On!", pytest.approx(0.5))
+        assert [a.title for a in get_similar_anime(anime_ids["K-On!"], k=1)] == ["Code Geass: Lelouch of the Rebellion"]
+
+        # A full rebuild agrees with the incrementally maintained lists
+        assert rebuild_similar_anime() == 4
+        assert [(a.title, a.similarity) for a in get_similar_anime(code_geass_id)] == incremental
+
+        # A list that loses its entry is refilled from its own buckets, not left short
+        monkeypatch.setattr('app.db.SIMILAR_ANIME_STORED', 1)
+        rebuild_similar_anime()
+        db.execute("DELETE FROM AnimeGenres WHERE anime_id = ?", (anime_ids["K-On!"],))
+        db.execute("DELETE FROM AnimeTags WHERE anime_id = ?", (anime_ids["K-On!"],))
+        _refresh_similar_anime(db, anime_ids["K-On!"])
+        db.commit()
+        assert [a.title for a in get_similar_anime(code_geass_id)] == ["Attack on Titan"]
+        monkeypatch.undo()
+
+    response = client.get(url_for('anime.detail', anime_id=code_geass_id))
+    assert b"More like this" in response.data
+
+def test_similar_by_description(client, app, seeded_database, tmp_path):
+    app.config['DESCRIPTION_INDEX_PATH'] = str(tmp_path / 'description_index.bin')
+    with app.app_context():
+        titan_id = get_db().execute("SELECT id FROM Anime WHERE title = 'Attack on Titan'").fetchone()['id']
+        assert get_similar_by_description(titan_id) == [] # Index not built yet
+
+        sequel_id = add_anime("Titan Sequel", description="Eren Jaeger and the Survey Corps fight the giant Titans beyond the walls.")
+        add_anime("Titan Spinoff", description="A new recruit fights giant Titans.")
+        assert build_description_index() == 6
+
+        similar = get_similar_by_description(titan_id)
+        assert [a.title for a in similar] == ["Titan Sequel", "Titan Spinoff"]
+        assert 0 < similar[1].description_similarity < similar[0].description_similarity <= 1
+        assert [a.title for a in get_similar_by_description(sequel_id, k=1)] == ["Attack on Titan"]
+
+        # A rebuilt file is remapped and the old map closed; a truncated one is ignored, not misread
+        old_map = _description_index_maps[app.config['DESCRIPTION_INDEX_PATH']][1]
+        index_bytes = (tmp_path / 'description_index.bin').read_bytes()
+        (tmp_path / 'description_index.bin').write_bytes(index_bytes[:-4])
+        assert get_similar_by_description(titan_id) == [] and old_map.closed
+        (tmp_path / 'description_index.bin').write_bytes(index_bytes)
+        assert [a.title for a in get_similar_by_description(titan_id)] == ["Titan Sequel", "Titan Spinoff"]
+
+    response = client.get(url_for('anime.detail', anime_id=titan_id))
+    assert b"Similar stories" in response.data
+
 # Add test for add_anime page if it's implemented (currently commented out in routes)
 # def test_add_anime_page_get(client_user1): # Assuming admin/logged-in user
 #     response = client_user1.get(url_for('anime.add_anime_route'))
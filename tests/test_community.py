@@ -1,6 +1,11 @@
+import contextlib
 import pytest
 from flask import url_for, g
-from app.db import get_db, get_post_by_id, get_subcommunity_by_id, get_comments_for_post, get_user_vote_for_post
+from app.db import (
+    get_db, get_post_by_id, get_subcommunity_by_id, get_comments_for_post, get_user_vote_for_post,
+    get_all_posts, get_posts_for_subcommunity, post_page_cursor, POST_SORTS,
+    add_comment, get_comment_threads, get_comment_by_id, delete_comment, add_or_update_post_vote
+)
 
 # Helper to get user ID
 def get_user_id_from_username(app, username):
@@ -159,6 +164,40 @@ def test_add_comment_on_post(client_user1, client_user2, app, user1_data, user2_
         assert user2_data['username'] in notifs[0]['content']
 
 
+def test_comment_count_maintained(client_user1, runner, app, user1_data):
+    post_title = "Post with Counted Comments"
+    client_user1.post(url_for('community.create_post'), data={'title': post_title, 'content': "Content"})
+    post_id = get_post_id_by_title(app, post_title)
+    comment_url = url_for('community.comment_on_post', post_id=post_id)
+    client_user1.post(comment_url, data={'text_content': "First"})
+    client_user1.post(comment_url, data={'text_content': "Second"})
+    with app.app_context():
+        first_id = get_comments_for_post(post_id)[0].id
+    client_user1.post(comment_url, data={'text_content': "Reply", 'parent_comment_id': first_id})
+    client_user1.post(comment_url, data={'text_content': "Nested reply", 'parent_comment_id': first_id + 2})
+
+    with app.app_context():
+        assert get_post_by_id(post_id).comment_count == 4
+        assert next(p for p in get_all_posts() if p.id == post_id).comment_count == 4
+
+    # A comment with replies is blanked, not removed, so the replies stay
+    xhr = {'X-Requested-With': 'XMLHttpRequest'}
+    response = client_user1.post(url_for('community.delete_comment_route', comment_id=first_id), headers=xhr)
+    assert response.get_json() == {'success': True, 'message': 'Comment deleted; its replies remain.', 'deleted': 0,
+                                   'comment_count': 4}
+    assert client_user1.post(url_for('community.delete_comment_route', comment_id=first_id), headers=xhr).status_code == 404
+    with app.app_context():
+        first = get_comments_for_post(post_id)[0]
+        assert (first.is_deleted, first.text_content, first.replies[0].replies[0].text_content) == (True, "", "Nested reply")
+        assert get_post_by_id(post_id).comment_count == 4
+
+        get_db().execute("UPDATE CommunityPosts SET comment_count = 9 WHERE id = ?", (post_id,))
+        get_db().commit()
+    result = runner.invoke(args=['reconcile-comment-counts'])
+    assert 'Repaired comment counts for 1 post(s).' in result.output
+    with app.app_context():
+        assert get_post_by_id(post_id).comment_count == 4
+
 def test_reply_to_comment(client_user1, client_user2, app, user1_data, user2_data):
     # User1 posts, User2 comments, User1 replies to User2's comment
     post_title = "Post for Replies"
@@ -239,4 +278,271 @@ def test_vote_post(client_user1, client_user2, app, user1_data, user2_data):
     assert json_data_none['upvotes'] == 0
     assert json_data_none['downvotes'] == 0
     assert json_data_none['new_vote_status'] is None
+
+
+def test_vote_buffer_write_behind(client_user1, app, user1_data, user2_data):
+    """Buffered clicks show up in responses straight away and reach the database in one flush."""
+    from app.vote_buffer import VoteBuffer
+    post_title = "Post for Buffered Votes"
+    client_user1.post(url_for('community.create_post'), data={'title': post_title, 'content': "Vote content"})
+    post_id = get_post_id_by_title(app, post_title)
+    user1_id = get_user_id_from_username(app, user1_data['username'])
+    client_user2 = app.test_client() # A second session, so both users can vote at once
+    client_user2.post('/auth/register', data=user2_data)
+    client_user2.post('/auth/login', data={'identifier': user2_data['username'], 'password': user2_data['password']})
+    user2_id = get_user_id_from_username(app, user2_data['username'])
+
+    app.config['VOTE_FLUSH_SECONDS'] = 60 # Flush by hand below
+    buffer = VoteBuffer(app)
+    app.extensions['vote_buffer'] = buffer
+    try:
+        json_data = client_user2.post(url_for('community.vote_post', post_id=post_id), data={'vote_type': 'upvote'}).get_json()
+        assert (json_data['upvotes'], json_data['downvotes'], json_data['new_vote_status']) == (1, 0, 'upvote')
+        json_data = client_user2.post(url_for('community.vote_post', post_id=post_id), data={'vote_type': 'downvote'}).get_json()
+        assert (json_data['upvotes'], json_data['downvotes'], json_data['new_vote_status']) == (0, 1, 'downvote')
+        json_data = client_user1.post(url_for('community.vote_post', post_id=post_id), data={'vote_type': 'downvote'}).get_json()
+        assert (json_data['upvotes'], json_data['downvotes'], json_data['new_vote_status']) == (0, 2, 'downvote')
+
+        with app.app_context():
+            post = get_post_by_id(post_id)
+            assert (post.upvotes, post.downvotes) == (0, 0) # Nothing written yet
+            assert get_user_vote_for_post(user2_id, post_id) is None
+        assert buffer.stats()['pending_votes'] == 3
+
+        assert buffer.flush() == 3
+        with app.app_context():
+            post = get_post_by_id(post_id)
+            assert (post.upvotes, post.downvotes) == (0, 2)
+            assert get_user_vote_for_post(user1_id, post_id) == 'downvote'
+            assert get_user_vote_for_post(user2_id, post_id) == 'downvote'
+        stats = buffer.stats()
+        assert (stats['pending_votes'], stats['flushes'], stats['flushed_votes'], stats['last_batch_size']) == (0, 1, 3, 3)
+
+        # A click after the flush builds on the stored vote
+        json_data = client_user2.post(url_for('community.vote_post', post_id=post_id), data={'vote_type': 'downvote'}).get_json()
+        assert (json_data['upvotes'], json_data['downvotes'], json_data['new_vote_status']) == (0, 1, None)
+    finally:
+        buffer.close()
+        del app.extensions['vote_buffer']
+    with app.app_context():
+        assert get_post_by_id(post_id).downvotes == 1 # close() flushed the last click
+
+
+def test_vote_buffer_retries_then_drops(app, monkeypatch, user1_data, user2_data):
+    """A failed flush requeues its clicks, whatever it raised; a click that keeps failing is dropped alone."""
+    from app import vote_buffer
+    from app.vote_buffer import VoteBuffer
+    client = app.test_client()
+    for user_data in (user1_data, user2_data):
+        client.post('/auth/register', data=user_data)
+    client.post('/auth/login', data={'identifier': user1_data['username'], 'password': user1_data['password']})
+    client.post(url_for('community.create_post'), data={'title': "Post for Retried Votes", 'content': "Content"})
+    post_id = get_post_id_by_title(app, "Post for Retried Votes")
+    user1_id = get_user_id_from_username(app, user1_data['username'])
+    user2_id = get_user_id_from_username(app, user2_data['username'])
+
+    app.config.update(VOTE_FLUSH_SECONDS=60, VOTE_FLUSH_MAX_ATTEMPTS=2)
+    buffer = VoteBuffer(app)
+    apply_vote_batch = vote_buffer.apply_vote_batch
+    def broken_batch(clicks):
+        raise RuntimeError("not a database error")
+    def reject_user1(clicks):
+        return all(click[1] != user1_id for click in clicks) and apply_vote_batch(clicks)
+    try:
+        with app.app_context():
+            buffer.record('post', user1_id, post_id, 'upvote')
+            assert buffer.record('post', user2_id, post_id, 'upvote')['upvotes'] == 2
+        monkeypatch.setattr(vote_buffer, 'apply_vote_batch', broken_batch)
+        assert buffer.flush() == 0
+        assert (buffer.stats()['pending_votes'], buffer.stats()['failed_flushes']) == (2, 1)
+
+        monkeypatch.setattr(vote_buffer, 'apply_vote_batch', reject_user1)
+        assert buffer.flush() == 0 # user1's click fails its last attempt; user2's waits behind it
+        assert (buffer.stats()['pending_votes'], buffer.stats()['dropped_votes']) == (1, 1)
+        assert buffer.flush() == 1
+        with app.app_context():
+            assert get_post_by_id(post_id).upvotes == 1
+            assert buffer.record('post', user1_id, post_id, 'upvote')['upvotes'] == 2 # Dropped, so not pending
+        monkeypatch.undo()
+
+        # A failure after the whole batch landed (here, the app context's teardown) requeues nothing
+        app_context = app.app_context
+        @contextlib.contextmanager
+        def failing_teardown():
+            with app_context():
+                yield
+            raise RuntimeError("teardown failed")
+        monkeypatch.setattr(app, 'app_context', failing_teardown)
+        assert buffer.flush() == 1
+        monkeypatch.undo()
+        assert (buffer.stats()['pending_votes'], buffer.stats()['failed_flushes']) == (0, 3)
+
+        # A click on a post deleted before the flush is skipped rather than written as an orphan
+        client.post(url_for('community.create_post'), data={'title': "Post Deleted Before Flush", 'content': "Content"})
+        deleted_id = get_post_id_by_title(app, "Post Deleted Before Flush")
+        with app.app_context():
+            assert buffer.record('post', user2_id, deleted_id, 'upvote')['upvotes'] == 1
+            get_db().execute("DELETE FROM CommunityPosts WHERE id = ?", (deleted_id,))
+            get_db().commit()
+        assert buffer.flush() == 1 and buffer.stats()['pending_votes'] == 0
+        with app.app_context():
+            assert get_db().execute("SELECT COUNT(*) FROM PostVotes WHERE post_id = ?", (deleted_id,)).fetchone()[0] == 0
+            assert get_post_by_id(post_id).upvotes == 2
+    finally:
+        monkeypatch.undo()
+        buffer.close()
+    assert client.get('/metrics/vote-buffer').status_code == 404 # Only served in debug or with VOTE_BUFFER_METRICS
+
+def test_post_sort_modes(client_user1, runner, app, user1_data):
+    """Hot follows votes and recency, top follows net votes within its window, new is by date."""
+    for title in ("Old Favourite", "Fresh Post", "Newest Post"):
+        client_user1.post(url_for('community.create_post'), data={'title': title, 'content': "Content"})
+    old_id, fresh_id, newest_id = (get_post_id_by_title(app, t) for t in ("Old Favourite", "Fresh Post", "Newest Post"))
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE CommunityPosts SET created_at = datetime('now', '-3 days'), upvotes = 999 WHERE id = ?", (old_id,))
+        db.execute("UPDATE CommunityPosts SET created_at = datetime('now', '-1 hour'), upvotes = 99 WHERE id = ?", (fresh_id,))
+        db.commit()
+    # Each vote rewrites the post's stored hot score from its counts and age
+    client_user1.post(url_for('community.vote_post', post_id=old_id), data={'vote_type': 'upvote'})
+    client_user1.post(url_for('community.vote_post', post_id=fresh_id), data={'vote_type': 'upvote'})
+
+    with app.app_context():
+        assert [p.id for p in get_all_posts(sort='new')] == [newest_id, fresh_id, old_id]
+        assert [p.id for p in get_all_posts(sort='hot')] == [fresh_id, newest_id, old_id]
+        assert [p.id for p in get_all_posts(sort='top', window='all')] == [old_id, fresh_id, newest_id]
+        assert [p.id for p in get_all_posts(sort='top', window='day')] == [fresh_id, newest_id]
+        newest_hot_score = get_post_by_id(newest_id).hot_score
+        get_db().execute("UPDATE CommunityPosts SET hot_score = 0 WHERE id = ?", (newest_id,))
+        get_db().commit()
+
+    response = client_user1.get(url_for('community.home', sort='top', t='day'))
+    assert response.status_code == 200
+    assert b"Fresh Post" in response.data and b"Old Favourite" not in response.data
+
+    assert runner.invoke(args=['reconcile-vote-counts']).exit_code == 0
+    with app.app_context():
+        assert get_post_by_id(newest_id).hot_score == pytest.approx(newest_hot_score)
+
+def test_post_feed_pagination(client, client_user1, app, user1_data):
+    """Cursor pages cover each feed once, in order, in every sort mode, from templates and JSON."""
+    client_user1.post(url_for('community.create_subcommunity'), data={'name': "Paged Sub", 'description': "Pages"})
+    sub_id = get_subcommunity_id_by_name(app, "Paged Sub")
+    for i in range(22):
+        client_user1.post(url_for('community.create_post', subcommunity_id=sub_id), data={'title': f"Paged {i}", 'content': "x"})
+    with app.app_context():
+        get_db().execute("UPDATE CommunityPosts SET upvotes = id % 3") # Ties within each sort key
+        get_db().commit()
+        for sort, window in [(sort, 'all') for sort in POST_SORTS] + [('top', 'week')]:
+            expected = [p.id for p in get_posts_for_subcommunity(sub_id, limit=100, sort=sort, window=window)]
+            paged, cursor = [], None
+            while True:
+                page = get_posts_for_subcommunity(sub_id, limit=5, sort=sort, window=window, cursor=cursor)
+                if not page:
+                    break
+                paged.extend(p.id for p in page)
+                cursor = post_page_cursor(page[-1], sort)
+            assert paged == expected and len(paged) == 22
+
+    response = client.get(url_for('community.subcommunity_detail', subcommunity_identifier=sub_id, sort='new'))
+    assert response.data.count(b'class="card post-card') == 20
+    assert b"Paged 21" in response.data and b"Paged 1<" not in response.data
+    assert b"Load more posts" in response.data
+
+    response = client.get(url_for('community.posts_page', username=user1_data['username'], sort='new'),
+                          headers={'X-Requested-With': 'XMLHttpRequest'})
+    data = response.get_json()
+    assert len(data['posts']) == 20 and data['next_cursor'] is not None
+    data_next = client.get(data['next_url'], headers={'X-Requested-With': 'XMLHttpRequest'}).get_json()
+    assert [post['title'] for post in data_next['posts']] == ["Paged 1", "Paged 0"]
+    assert data_next['next_cursor'] is None and data_next['next_url'] is None
+    assert b"Paged 0" in data_next['html'].encode()
+
+def test_comment_threads_paginated(client_user1, runner, app, user1_data):
+    """Threads load a page at a time to a bounded depth and breadth; the rest loads on demand."""
+    client_user1.post(url_for('community.create_post'), data={'title': "Threaded Post", 'content': "Content"})
+    post_id = get_post_id_by_title(app, "Threaded Post")
+    user_id = get_user_id_from_username(app, user1_data['username'])
+    with app.app_context():
+        first, second, third = (add_comment(user_id, post_id, text) for text in ("First", "Second", "Third"))
+        replies = [add_comment(user_id, post_id, f"Reply {i}", first) for i in range(7)]
+        chain = [replies[0]]
+        for level in range(2, 5): # Replies down to depth 4
+            chain.append(add_comment(user_id, post_id, f"Depth {level}", chain[-1]))
+        # A parent stamped later than its reply used to drop the reply from the tree
+        get_db().execute("UPDATE Comments SET created_at = datetime('now', '+1 hour') WHERE id = ?", (third,))
+        get_db().commit()
+        late_reply = add_comment(user_id, post_id, "Reply to third", third)
+        assert add_comment(user_id, post_id + 1, "Wrong post", first) is None
+
+        assert [c.replies[0].id for c in get_comments_for_post(post_id) if c.id == third] == [late_reply]
+
+        comments, next_cursor = get_comment_threads(post_id, limit=2)
+        assert [c.id for c in comments] == [first, second] and next_cursor is not None
+        assert [c.id for c in get_comment_threads(post_id, limit=2, cursor=next_cursor)[0]] == [third]
+        top = comments[0]
+        assert [r.id for r in top.replies] == replies[:5] and top.reply_count == 7 and top.has_more_replies
+        deepest = top.replies[0].replies[0].replies[0]
+        assert (deepest.id, deepest.depth, deepest.replies, deepest.has_more_replies) == (chain[2], 3, [], True)
+
+        # A hot comment's replies are capped inside the index read, not after reading them all
+        busy = [add_comment(user_id, post_id, f"Busy reply {i}", second) for i in range(200)]
+        statements = []
+        get_db().set_trace_callback(statements.append)
+        busy_thread = get_comment_threads(post_id, limit=2)[0][1]
+        get_db().set_trace_callback(None)
+        assert [r.id for r in busy_thread.replies] == busy[:5] and busy_thread.reply_count == 200
+        replies_sql = next(sql for sql in statements if sql.lstrip().startswith('WITH RECURSIVE'))
+        plan = [row['detail'] for row in get_db().execute("EXPLAIN QUERY PLAN " + replies_sql)]
+        assert any('idx_comments_parent_comment_id (parent_comment_id=?)' in step for step in plan)
+        assert not any(step.startswith('SCAN') and 'shown' not in step and 'json_each' not in step for step in plan)
+
+    xhr = {'X-Requested-With': 'XMLHttpRequest'}
+    data = client_user1.get(url_for('community.comments_page', comment_id=first, cursor=top.more_replies_cursor),
+                            headers=xhr).get_json()
+    assert [c['id'] for c in data['comments']] == replies[5:] and data['next_url'] is None
+    data = client_user1.get(url_for('community.comments_page', comment_id=chain[2]), headers=xhr).get_json()
+    assert [c['text_content'] for c in data['comments']] == ["Depth 4"] and 'id="comment-%d"' % chain[3] in data['html']
+
+    response = client_user1.get(url_for('community.post_detail', post_id=post_id))
+    assert b"Load more replies" in response.data and b"Depth 3" in response.data and b"Depth 4" not in response.data
+    response = client_user1.get(url_for('community.comments_page', comment_id=chain[2]))
+    assert b"Depth 4" in client_user1.get(response.headers['Location']).data # No-JS fallback shows the thread
+
+    with app.app_context():
+        assert delete_comment(replies[0], user_id) == (post_id, 0) # Soft: it has replies
+        assert delete_comment(chain[3], user_id) == (post_id, 1)
+        assert delete_comment(chain[1], user_id) == (post_id, 0)
+        # Removing the last reply also removes the soft-deleted ancestors it leaves empty
+        assert delete_comment(chain[2], user_id) == (post_id, 3)
+        assert get_comment_by_id(replies[0]) is None and get_comment_by_id(first).reply_count == 6
+        assert get_post_by_id(post_id).comment_count == 210
+        get_db().execute("UPDATE Comments SET path = '', reply_count = 0 WHERE id = ?", (first,))
+        get_db().commit()
+    result = runner.invoke(args=['reconcile-comment-counts'])
+    assert 'Repaired reply counts or paths for 2 comment(s).' in result.output
+    with app.app_context():
+        assert get_comment_by_id(first).path == f"{first:010d}/" and get_comment_by_id(first).reply_count == 6
+
+def test_vote_write_returns_state(client_user1, app, user1_data):
+    """A vote click answers from its own write transaction; a missing post writes nothing."""
+    client_user1.post(url_for('community.create_post'), data={'title': "Post for Vote State", 'content': "Content"})
+    post_id = get_post_id_by_title(app, "Post for Vote State")
+    user_id = get_user_id_from_username(app, user1_data['username'])
+    with app.app_context():
+        statements = []
+        get_db().set_trace_callback(statements.append)
+        assert add_or_update_post_vote(user_id, post_id, 'upvote') == {'upvotes': 1, 'downvotes': 0, 'vote': 'upvote'}
+        assert add_or_update_post_vote(user_id, post_id, 'downvote') == {'upvotes': 0, 'downvotes': 1, 'vote': 'downvote'}
+        get_db().set_trace_callback(None)
+        assert not [sql for sql in statements if sql.lstrip().upper().startswith('SELECT') and 'CommunityPosts' in sql]
+        assert [sql for sql in statements if sql == 'COMMIT'] == ['COMMIT', 'COMMIT']
+
+        assert add_or_update_post_vote(user_id, post_id + 1, 'upvote') is None
+        assert get_db().execute("SELECT COUNT(*) FROM PostVotes WHERE post_id = ?", (post_id + 1,)).fetchone()[0] == 0
+
+    json_data = client_user1.post(url_for('community.vote_post', post_id=post_id), data={'vote_type': 'downvote'}).get_json()
+    assert (json_data['upvotes'], json_data['downvotes'], json_data['new_vote_status']) == (0, 0, None)
+    response = client_user1.post(url_for('community.vote_post', post_id=post_id + 1), data={'vote_type': 'upvote'})
+    assert response.status_code == 404
 ```
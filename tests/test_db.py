@@ -1,5 +1,8 @@
 import pytest
-from app.db import get_db, seed_db # seed_db might be tested via command too
+from app.db import (
+    get_db, seed_db, # seed_db might be tested via command too
+    add_review, add_or_update_review_vote, add_or_update_post_vote, get_anime_by_id, search_anime
+)
 
 def test_init_db_command(runner, app):
     """Test that the init-db command clears existing data and creates new tables."""
@@ -83,3 +86,88 @@ def test_seed_db_function_directly(app):
         assert "School Life" in tag_names
     
     # Further checks can be added for other seeded data.
+
+def test_reconcile_vote_counts_command(runner, app, seeded_database):
+    """Vote counters are maintained by deltas; reconcile-vote-counts repairs any that drift."""
+    with app.app_context():
+        db = get_db()
+        voter_ids = [
+            db.execute("INSERT INTO Users (username, email, password_hash) VALUES (?, ?, 'x')",
+                       (f"voter{i}", f"voter{i}@example.com")).lastrowid
+            for i in range(3)
+        ]
+        anime_id = db.execute("SELECT id FROM Anime WHERE title = 'K-On!'").fetchone()['id']
+        review_id = add_review(voter_ids[0], anime_id, "Great club")
+        post_id = db.execute(
+            "INSERT INTO CommunityPosts (user_id, title, content, post_type) VALUES (?, 'Best band?', '...', 'discussion')",
+            (voter_ids[0],)
+        ).lastrowid
+        db.commit()
+
+        for voter_id in voter_ids:
+            add_or_update_review_vote(voter_id, review_id, 'upvote')
+            add_or_update_post_vote(voter_id, post_id, 'upvote')
+        add_or_update_review_vote(voter_ids[1], review_id, 'downvote') # Switch
+        add_or_update_review_vote(voter_ids[2], review_id, 'upvote') # Toggle off
+        add_or_update_post_vote(voter_ids[0], post_id, 'downvote')
+        review = db.execute("SELECT upvotes, downvotes, helpfulness FROM Reviews WHERE id = ?", (review_id,)).fetchone()
+        assert (review['upvotes'], review['downvotes']) == (1, 1)
+        post = db.execute("SELECT upvotes, downvotes FROM CommunityPosts WHERE id = ?", (post_id,)).fetchone()
+        assert (post['upvotes'], post['downvotes']) == (2, 1)
+
+        db.execute("UPDATE Reviews SET upvotes = 40, helpfulness = 0.9 WHERE id = ?", (review_id,))
+        db.execute("UPDATE CommunityPosts SET downvotes = 7 WHERE id = ?", (post_id,))
+        db.commit()
+
+    result = runner.invoke(args=['reconcile-vote-counts'])
+    assert 'Repaired vote counts for 1 review(s) and 1 post(s).' in result.output
+    with app.app_context():
+        db = get_db()
+        repaired = db.execute("SELECT upvotes, downvotes, helpfulness FROM Reviews WHERE id = ?", (review_id,)).fetchone()
+        assert tuple(repaired) == tuple(review)
+        post = db.execute("SELECT upvotes, downvotes FROM CommunityPosts WHERE id = ?", (post_id,)).fetchone()
+        assert (post['upvotes'], post['downvotes']) == (2, 1)
+
+
+def test_ingest_catalog_command(runner, app, seeded_database, tmp_path):
+    """ingest-catalog bulk-loads JSONL/CSV dumps, reusing existing genres/tags and skipping known titles."""
+    jsonl_path = tmp_path / "catalog.jsonl"
+    jsonl_path.write_text(
+        '{"title": "Mushishi", "release_year": 2005, "language": "Japanese", "genres": ["Fantasy", "Slice of Life"], "tags": ["iyashikei"]}\n'
+        '\n'
+        '{"title": "K-On!", "genres": ["Comedy"]}\n' # Already seeded
+        '{"title": "Mushishi", "genres": ["Drama"]}\n' # Repeated in the dump
+        '{"title": "Planetes", "release_year": "2003", "genres": ["Sci-Fi", "Drama"], "tags": ["space", "iyashikei"]}\n'
+        '{"title": "Hunter x Hunter", "release_year": 1999}\n'
+        '{"title": "Hunter x Hunter", "release_year": 2011}\n' # A remake, not a repeat
+    )
+    result = runner.invoke(args=['ingest-catalog', str(jsonl_path)])
+    assert 'Added 4 anime (2 already in the catalog)' in result.output
+
+    csv_path = tmp_path / "catalog.csv"
+    csv_path.write_text('title,release_year,genres,tags\n"Haibane Renmei",2002,Fantasy|Drama,iyashikei|angels\n')
+    result = runner.invoke(args=['ingest-catalog', str(csv_path)])
+    assert 'Added 1 anime (0 already in the catalog)' in result.output
+
+    with app.app_context():
+        db = get_db()
+        assert db.execute("SELECT COUNT(*) FROM Genres WHERE name = 'Fantasy'").fetchone()[0] == 1
+        assert db.execute("SELECT COUNT(*) FROM Tags WHERE name = 'iyashikei'").fetchone()[0] == 1
+        anime_ids = {row['title']: row['id'] for row in db.execute(
+            "SELECT id, title FROM Anime WHERE title IN ('Mushishi', 'Planetes', 'Haibane Renmei')")}
+        mushishi = get_anime_by_id(anime_ids['Mushishi'])
+        assert (mushishi.release_year, mushishi.language) == (2005, 'Japanese')
+        assert sorted(genre.name for genre in mushishi.genres) == ['Fantasy', 'Slice of Life']
+        assert [tag.name for tag in mushishi.tags] == ['iyashikei']
+        planetes = get_anime_by_id(anime_ids['Planetes'])
+        assert planetes.release_year == 2003
+        assert sorted(tag.name for tag in planetes.tags) == ['iyashikei', 'space']
+        assert len(search_anime("Hunter")[0]) == 2 # Indexed as they went in
+        haibane = get_anime_by_id(anime_ids['Haibane Renmei'])
+        assert sorted(genre.name for genre in haibane.genres) == ['Drama', 'Fantasy']
+        assert sorted(tag.name for tag in haibane.tags) == ['angels', 'iyashikei']
+
+    bad_path = tmp_path / "broken.jsonl"
+    bad_path.write_text('{"title": "Broken"\n')
+    result = runner.invoke(args=['ingest-catalog', str(bad_path)])
+    assert result.exit_code != 0
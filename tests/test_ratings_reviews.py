@@ -1,6 +1,12 @@
 import pytest
 from flask import url_for, g
-from app.db import get_db, get_anime_by_id, get_user_rating_for_anime, get_reviews_for_anime, get_user_vote_for_review
+from app.db import (
+    get_db, get_anime_by_id, get_user_rating_for_anime, get_reviews_for_anime, get_user_vote_for_review,
+    get_user_votes_for_reviews, add_or_update_review_vote, add_review, review_page_cursor, REVIEW_SORTS,
+    add_or_update_rating, rebuild_anime_rating_stats, get_top_chart, rebuild_top_charts,
+    build_anime_neighbors, get_recommendations_for_user, get_rating_histogram, update_anime_average_rating,
+    TOP_CHART_PRIOR_WEIGHT
+)
 
 # Helper to get an anime ID (e.g., Code Geass)
 def get_seeded_anime_id(app, title="Code Geass: Lelouch of the Rebellion"):
@@ -99,6 +105,7 @@ def test_vote_review(client_user1, client_user2, app, seeded_database, user1_dat
         assert review['upvotes'] == 1
         assert review['downvotes'] == 0
         assert get_user_vote_for_review(user2_id, review_id) == 'upvote'
+        assert get_user_votes_for_reviews(user2_id, [review_id, review_id + 1]) == {review_id: 'upvote'}
 
     # User2 changes vote to downvote
     client_user2.post(url_for('ratings_reviews.vote_review', review_id=review_id), data={'vote_type': 'downvote'})
@@ -115,6 +122,7 @@ def test_vote_review(client_user1, client_user2, app, seeded_database, user1_dat
         assert review['upvotes'] == 0
         assert review['downvotes'] == 0
         assert get_user_vote_for_review(user2_id, review_id) is None
+        assert get_user_votes_for_reviews(user2_id, [review_id]) == {}
 
     # User1 (author) cannot vote for their own review (optional check, depends on requirements, not explicitly implemented)
     # For now, we assume this is allowed or not checked.
@@ -149,7 +157,189 @@ def test_average_rating_calculation(client_user1, client_user2, app, seeded_data
         anime = get_anime_by_id(anime_id)
         assert anime.average_rating == 7.0 # (5+9)/2
 
+def test_rating_stats_maintained_incrementally(app, seeded_database, registered_user1, registered_user2):
+    anime_id = get_seeded_anime_id(app, title="Attack on Titan")
+    with app.app_context():
+        users = get_db().execute("SELECT id, username FROM Users").fetchall()
+        user_ids = {row['username']: row['id'] for row in users}
+        user1_id = user_ids[registered_user1['username']]
+        user2_id = user_ids[registered_user2['username']]
+        add_or_update_rating(user1_id, anime_id, 6)
+        add_or_update_rating(user2_id, anime_id, 10)
+        add_or_update_rating(user1_id, anime_id, 9) # Score change shifts the sum only
+
+        anime = get_anime_by_id(anime_id)
+        assert (anime.rating_sum, anime.rating_count) == (19, 2)
+        assert anime.average_rating == 9.5
+
+        # A bulk rebuild from the Ratings table agrees with the running totals
+        db = get_db()
+        db.execute("UPDATE Anime SET rating_sum = 0, rating_count = 0, average_rating = 0.0 WHERE id = ?", (anime_id,))
+        db.commit()
+        assert rebuild_anime_rating_stats() >= 1
+        anime = get_anime_by_id(anime_id)
+        assert (anime.rating_sum, anime.rating_count, anime.average_rating) == (19, 2, 9.5)
+
+def test_rating_histogram(client, app, seeded_database, registered_user1, registered_user2):
+    anime_id = get_seeded_anime_id(app, title="Attack on Titan")
+    with app.app_context():
+        users = get_db().execute("SELECT id, username FROM Users").fetchall()
+        user_ids = {row['username']: row['id'] for row in users}
+        user1_id = user_ids[registered_user1['username']]
+        user2_id = user_ids[registered_user2['username']]
+        assert get_rating_histogram(anime_id) == [0] * 10
+        add_or_update_rating(user1_id, anime_id, 6)
+        add_or_update_rating(user2_id, anime_id, 10)
+        add_or_update_rating(user1_id, anime_id, 9) # Moves user1's rating from the 6 bucket to the 9 bucket
+        add_or_update_rating(user2_id, anime_id, 10) # Same score again changes nothing
+        assert get_rating_histogram(anime_id) == [0, 0, 0, 0, 0, 0, 0, 0, 1, 1]
+
+        # Repairs recompute the histogram from the Ratings table
+        db = get_db()
+        db.execute("UPDATE RatingHistograms SET score_1 = 5, score_9 = 0 WHERE anime_id = ?", (anime_id,))
+        db.commit()
+        assert update_anime_average_rating(anime_id)
+        assert get_rating_histogram(anime_id) == [0, 0, 0, 0, 0, 0, 0, 0, 1, 1]
+        db.execute("DELETE FROM RatingHistograms")
+        db.commit()
+        rebuild_anime_rating_stats()
+        assert get_rating_histogram(anime_id) == [0, 0, 0, 0, 0, 0, 0, 0, 1, 1]
+
+    json_data = client.get(url_for('anime.detail_json', anime_id=anime_id)).get_json()
+    assert json_data['rating_histogram'] == [0, 0, 0, 0, 0, 0, 0, 0, 1, 1]
+    assert json_data['anime']['rating_count'] == 2
+    response = client.get(url_for('anime.detail', anime_id=anime_id))
+    assert b'rating-histogram' in response.data
+    assert b'2 ratings' in response.data
+
+def test_top_charts_follow_ratings(client, app, seeded_database, registered_user1, registered_user2):
+    code_geass_id = get_seeded_anime_id(app)
+    k_on_id = get_seeded_anime_id(app, title="K-On!")
+    aot_id = get_seeded_anime_id(app, title="Attack on Titan")
+    with app.app_context():
+        users = get_db().execute("SELECT id, username FROM Users").fetchall()
+        user_ids = {row['username']: row['id'] for row in users}
+        user1_id = user_ids[registered_user1['username']]
+        user2_id = user_ids[registered_user2['username']]
+        add_or_update_rating(user1_id, aot_id, 2)
+        add_or_update_rating(user2_id, aot_id, 2)
+        add_or_update_rating(user1_id, k_on_id, 10) # Higher mean, but a single rating
+        add_or_update_rating(user1_id, code_geass_id, 9)
+        add_or_update_rating(user2_id, code_geass_id, 9)
+
+        top, next_cursor = get_top_chart('top')
+        assert [a.id for a in top] == [code_geass_id, k_on_id, aot_id]
+        assert [a.chart_rank for a in top] == [1, 2, 3]
+        assert next_cursor is None
+
+        # Keyset pages continue the ranking
+        first_page, cursor = get_top_chart('top', limit=2)
+        second_page, _ = get_top_chart('top', limit=2, cursor=cursor)
+        assert [a.id for a in first_page + second_page] == [code_geass_id, k_on_id, aot_id]
+        assert second_page[0].chart_rank == 3
+
+        assert [a.id for a in get_top_chart('year', 2009)[0]] == [k_on_id]
+        mecha_id = get_db().execute("SELECT id FROM Genres WHERE name = 'Mecha'").fetchone()['id']
+        assert [a.id for a in get_top_chart('genre', mecha_id)[0]] == [code_geass_id]
+
+        # Every entry shares one prior: the mean at the first rating, however far it has moved since
+        chart_mean = get_db().execute("SELECT chart_mean FROM RatingTotals").fetchone()['chart_mean']
+        assert chart_mean == 2.0
+        for anime in top:
+            expected = (anime.rating_sum + TOP_CHART_PRIOR_WEIGHT * chart_mean) / (anime.rating_count + TOP_CHART_PRIOR_WEIGHT)
+            assert anime.chart_score == pytest.approx(expected)
+
+        # A rating write only touches its own anime's entries, even with the mean moving
+        statements = []
+        get_db().set_trace_callback(statements.append)
+        add_or_update_rating(user2_id, k_on_id, 1)
+        get_db().set_trace_callback(None)
+        assert not any(sql.strip() == "DELETE FROM TopChartEntries" for sql in statements)
+
+        # The periodic rebuild re-scores everything against the live mean
+        assert rebuild_top_charts() > 0
+        totals = get_db().execute("SELECT rating_sum, rating_count, chart_mean FROM RatingTotals").fetchone()
+        assert totals['chart_mean'] == pytest.approx(totals['rating_sum'] / totals['rating_count'])
+        assert [a.id for a in get_top_chart('top')[0]] == [code_geass_id, k_on_id, aot_id]
+
+    response = client.get(url_for('anime.top_chart', kind='year', key=2009))
+    assert response.status_code == 200
+    assert b"Top Anime of 2009" in response.data
+    assert b"K-On!" in response.data
+
+def test_item_item_recommendations(client_user1, app, seeded_database, user1_data):
+    titles = ["Code Geass: Lelouch of the Rebellion", "Attack on Titan", "K-On!", "Your Name."]
+    anime_ids = {title: get_seeded_anime_id(app, title=title) for title in titles}
+    with app.app_context():
+        db = get_db()
+        user_id = db.execute("SELECT id FROM Users WHERE username = ?", (user1_data['username'],)).fetchone()['id']
+        # Raters who like the two action shows together and rate the slice-of-life ones low
+        for n, scores in enumerate([(10, 9, 3, 4), (9, 10, 2, 5), (8, 9, 4, 3)]):
+            rater_id = db.execute("INSERT INTO Users (username, email, password_hash) VALUES (?, ?, 'x')",
+                                  (f"rater{n}", f"rater{n}@example.com")).lastrowid
+            for title, score in zip(titles, scores):
+                add_or_update_rating(rater_id, anime_ids[title], score)
+        add_or_update_rating(user_id, anime_ids["Code Geass: Lelouch of the Rebellion"], 10)
+
+        assert build_anime_neighbors() == 4
+        recommendations = get_recommendations_for_user(user_id)
+        assert [a.title for a in recommendations] == ["Attack on Titan"] # Already-rated titles are excluded
+        assert recommendations[0].recommendation_score > 0
+
+        # An incremental build only revisits anime rated by users with new ratings
+        db.execute("UPDATE RecommenderState SET last_built_at = datetime('now', '+1 minute')")
+        db.commit()
+        assert build_anime_neighbors(incremental=True) == 0
+        db.execute("UPDATE RecommenderState SET last_built_at = datetime('now', '-1 minute')")
+        db.commit()
+        assert build_anime_neighbors(incremental=True) == 4
+
+    response = client_user1.get(url_for('anime.recommendations_json'))
+    assert [a['title'] for a in response.get_json()['anime']] == ["Attack on Titan"]
+    assert b"Recommended for you" in client_user1.get(url_for('anime.list_anime')).data
+
 # Test that review appears on anime detail page
+def test_review_sorting_and_pagination(client, app, seeded_database):
+    anime_id = get_seeded_anime_id(app)
+    with app.app_context():
+        db = get_db()
+        user_ids = [
+            db.execute("INSERT INTO Users (username, email, password_hash) VALUES (?, ?, 'x')",
+                       (f"voter{i}", f"voter{i}@example.com")).lastrowid
+            for i in range(13)
+        ]
+        review_ids = {}
+        for day, (author_id, (text, score)) in enumerate(zip(user_ids, [('rated 6', 6), ('rated 9', 9), ('unrated', None)]), start=1):
+            rating_id = add_or_update_rating(author_id, anime_id, score) if score else None
+            review_ids[text] = add_review(author_id, anime_id, text, rating_id=rating_id)
+            db.execute("UPDATE Reviews SET created_at = ? WHERE id = ?", (f"2024-01-0{day} 12:00:00", review_ids[text]))
+        db.commit()
+        add_or_update_rating(user_ids[0], anime_id, 7) # Re-rating updates the linked review's score
+        for voter_id in user_ids[:12]:
+            add_or_update_review_vote(voter_id, review_ids['rated 9'], 'upvote')
+        add_or_update_review_vote(user_ids[12], review_ids['rated 9'], 'downvote')
+        for voter_id in user_ids[:5]:
+            add_or_update_review_vote(voter_id, review_ids['rated 6'], 'upvote')
+        add_or_update_review_vote(user_ids[0], review_ids['unrated'], 'upvote')
+
+        texts = lambda reviews: [review.text_content for review in reviews]
+        assert texts(get_reviews_for_anime(anime_id)) == ['unrated', 'rated 9', 'rated 6']
+        assert texts(get_reviews_for_anime(anime_id, sort='rated')) == ['rated 9', 'rated 6', 'unrated']
+        assert [review.rating_score for review in get_reviews_for_anime(anime_id, sort='rated')] == [9, 7, None]
+        helpful = get_reviews_for_anime(anime_id, sort='helpful')
+        # 12 up / 1 down outranks 5 up / 0 down, which outranks a single upvote
+        assert texts(helpful) == ['rated 9', 'rated 6', 'unrated']
+        assert helpful[0].helpfulness == pytest.approx(0.667, abs=1e-3)
+
+        for sort in REVIEW_SORTS:
+            first_page = get_reviews_for_anime(anime_id, sort=sort, limit=2)
+            rest = get_reviews_for_anime(anime_id, sort=sort, limit=2, cursor=review_page_cursor(first_page[-1], sort))
+            assert texts(first_page + rest) == texts(get_reviews_for_anime(anime_id, sort=sort))
+
+    response = client.get(url_for('anime.detail', anime_id=anime_id, review_sort='helpful'))
+    assert response.status_code == 200
+    assert response.data.index(b'rated 9') < response.data.index(b'unrated')
+
 def test_review_display_on_anime_page(client, client_user1, app, seeded_database, user1_data):
     anime_id = get_seeded_anime_id(app)
     review_text = "My awesome review for display."
@@ -1,10 +1,15 @@
+import io
+import time
 import pytest
 from flask import url_for, g
 from app.db import (
     get_db, get_watchlist_for_user, get_watchlist_item_status,
     get_notifications_for_user, count_unread_notifications,
-    create_notification # For direct testing if needed
+    create_notification, # For direct testing if needed
+    add_or_update_rating, add_or_update_watchlist_item, get_home_feed, set_user_favorite_genres,
+    get_anime_by_id, get_rating_histogram, get_user_rating_for_anime
 )
+from app.list_import import parse_list_export
 
 # Helper to get an anime ID
 def get_anime_id_by_title(app, title="Code Geass: Lelouch of the Rebellion"):
@@ -75,11 +80,120 @@ def test_view_watchlist_on_profile(client_user1, app, seeded_database, user1_dat
     assert b"Plan to Watch (1)" in response.data
 
 
+# --- Home Feed Tests ---
+def test_home_feed(client_user1, app, seeded_database, user1_data):
+    user_id = get_user_id(app, user1_data['username'])
+    titles = {title: get_anime_id_by_title(app, title) for title in
+              ["Code Geass: Lelouch of the Rebellion", "Attack on Titan", "K-On!", "Your Name."]}
+    with app.app_context():
+        db = get_db()
+        rater_id = db.execute(
+            "INSERT INTO Users (username, email, password_hash) VALUES ('rater', 'rater@example.com', 'x')"
+        ).lastrowid
+        db.commit()
+        for title, score in [("Code Geass: Lelouch of the Rebellion", 9), ("Attack on Titan", 8), ("Your Name.", 7), ("K-On!", 6)]:
+            add_or_update_rating(rater_id, titles[title], score)
+
+        # No favourites or watchlist yet: the overall top chart
+        assert [a.title for a in get_home_feed(user_id)] == [
+            "Code Geass: Lelouch of the Rebellion", "Attack on Titan", "Your Name.", "K-On!"
+        ]
+
+        # Each of the user's writes drops their cached feed
+        slice_of_life_id = db.execute("SELECT id FROM Genres WHERE name = 'Slice of Life'").fetchone()['id']
+        assert set_user_favorite_genres(user_id, [slice_of_life_id])
+        assert get_home_feed(user_id)[0].title == "K-On!"
+
+        # Watchlisted titles leave the feed and their genres lift related ones
+        add_or_update_watchlist_item(user_id, titles["Code Geass: Lelouch of the Rebellion"], 'watching')
+        assert [a.title for a in get_home_feed(user_id)] == ["Attack on Titan", "K-On!", "Your Name."]
+
 # --- Notification Tests ---
 # Notification creation is tested indirectly via test_community.py (comment notifications)
 # and will be tested in test_social.py (friend request notifications).
 # Here we test fetching and marking notifications as read.
 
+def test_import_list(client_user1, runner, app, seeded_database, user1_data, tmp_path):
+    aot_id = get_anime_id_by_title(app, "Attack on Titan")
+    kon_id = get_anime_id_by_title(app, "K-On!")
+    with app.app_context():
+        user_id = get_db().execute("SELECT id FROM Users WHERE username = ?", (user1_data['username'],)).fetchone()['id']
+        add_or_update_rating(user_id, aot_id, 4)
+        add_or_update_watchlist_item(user_id, kon_id, 'plan_to_watch')
+
+    # MyAnimeList-style XML upload, parsed as it streams in
+    export = b"""<?xml version="1.0" encoding="UTF-8"?>
+<myanimelist>
+  <myinfo><user_name>someone</user_name></myinfo>
+  <anime><series_title>attack on titan</series_title><my_score>9</my_score><my_status>Completed</my_status></anime>
+  <anime><series_title>K-On!</series_title><my_score>0</my_score><my_status>Watching</my_status></anime>
+  <anime><series_title>Not In The Catalog</series_title><my_score>7</my_score><my_status>Dropped</my_status></anime>
+</myanimelist>"""
+    response = client_user1.post(
+        url_for('user_activity.import_list_page'),
+        data={'list_file': (io.BytesIO(export), 'animelist.xml')},
+        content_type='multipart/form-data', headers={'X-Requested-With': 'XMLHttpRequest'}
+    )
+    summary = response.get_json()
+    assert summary['success'] is True
+    assert (summary['entries'], summary['matched'], summary['ratings'], summary['watchlist_items']) == (3, 2, 1, 2)
+    assert summary['unmatched'] == ['Not In The Catalog']
+    assert (summary['saved'], summary['message']) == (3, "Imported 2 of 3 titles.")
+
+    app.config['LIST_IMPORT_MAX_BYTES'] = len(export) # The multipart body around it tips it over
+    response = client_user1.post(
+        url_for('user_activity.import_list_page'),
+        data={'list_file': (io.BytesIO(export), 'animelist.xml')},
+        content_type='multipart/form-data', headers={'X-Requested-With': 'XMLHttpRequest'}
+    )
+    assert response.status_code == 413 and response.get_json()['success'] is False
+    del app.config['LIST_IMPORT_MAX_BYTES']
+
+    with app.app_context():
+        assert get_user_rating_for_anime(user_id, aot_id).score == 9 # Replaced the earlier 4
+        anime = get_anime_by_id(aot_id)
+        assert (anime.rating_count, anime.average_rating) == (1, 9.0)
+        assert get_rating_histogram(aot_id)[8] == 1 and get_rating_histogram(aot_id)[3] == 0
+        assert get_watchlist_item_status(user_id, aot_id) == 'completed'
+        assert get_watchlist_item_status(user_id, kon_id) == 'watching' # Moved from plan_to_watch
+        assert get_user_rating_for_anime(user_id, kon_id) is None # A score of 0 means unrated
+
+    # CLI import of a JSON array, a few entries per transaction
+    export_path = tmp_path / "list.json"
+    export_path.write_text('[{"title": "K-On!", "score": 80, "status": "completed"},\n'
+                           ' {"title": "Your Name.", "score": "7"}]')
+    result = runner.invoke(args=['import-list', user1_data['username'], str(export_path)])
+    assert 'Imported 2 of 2 entries (2 ratings, 1 watchlist items).' in result.output
+    with app.app_context():
+        assert get_user_rating_for_anime(user_id, kon_id).score == 8 # 100-point scale
+        assert get_watchlist_item_status(user_id, kon_id) == 'completed'
+        assert get_anime_by_id(get_anime_id_by_title(app, "Your Name.")).rating_count == 1
+        totals = get_db().execute("SELECT rating_sum, rating_count FROM RatingTotals").fetchone()
+        assert tuple(totals) == (9 + 8 + 7, 3)
+
+    export_path.write_text('[{"title": "K-On!", "score": 8')
+    result = runner.invoke(args=['import-list', user1_data['username'], str(export_path)])
+    assert result.exit_code != 0 and 'Invalid JSON' in result.output
+
+def test_import_list_wrapped_json_streams():
+    def wrapped_export(count):
+        entries = ','.join('{"title": "Show %d", "score": %d, "status": "completed"}' % (i, i % 10 + 1)
+                           for i in range(count))
+        return ('{"user": {"name": "someone"}, "anime": [' + entries + '], "version": 2}').encode()
+
+    def parse_seconds(export):
+        started = time.perf_counter()
+        assert sum(1 for _ in parse_list_export(io.BytesIO(export), 'json')) == export.count(b'"title"')
+        return time.perf_counter() - started
+
+    # The wrapped array is streamed element by element, so 4x the file takes about 4x the time
+    # (re-decoding the outer object on every read made it ~16x)
+    small, large = wrapped_export(20000), wrapped_export(80000) # About 1 MB and 4 MB
+    assert len(large) > 4 * 1024 * 1024
+    assert parse_seconds(large) < 8 * min(parse_seconds(small) for _ in range(2))
+    assert list(parse_list_export(io.BytesIO(b'{"anime": "x", "items": [{"title": "A", "score": 8}]}'), 'json')) \
+        == [("A", 8, None)]
+
 def test_view_notifications_page(client_user1, app, user1_data):
     user_id = get_user_id(app, user1_data['username'])
     # Manually create a notification for this user for testing